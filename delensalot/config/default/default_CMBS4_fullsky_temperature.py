@@ -128,7 +128,8 @@ DL_DEFAULT = {
         'libdir_it': None,
         'binning': 'binned',
         'spectrum_calculator': pospace,
-        'basemap': 'lens'
+        'basemap': 'lens',
+        'cache_couplings': True
     },
     'phana': {
         'custom_WF_TEMP': None,
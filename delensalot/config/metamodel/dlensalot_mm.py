@@ -306,9 +306,10 @@ class DLENSALOT_Mapdelensing(DLENSALOT_Concept):
         Cl_fid (type):          fiducial power spectrum, and needed for template calculation of the binned power spectrum package\n
         libdir_it (type):       TBD\n
         binning (type):         can be either 'binned' or 'unbinned'. If 'unbinned', overwrites :code:`edges` and calculates power spectrum for each multipole\n
-        spectrum_calculator (package): name of the package of the power spectrum calculator. Can be 'healpy' if :code:`binning=unbinned`\n
+        spectrum_calculator (package): name of the package of the power spectrum calculator. Can be 'healpy' if :code:`binning=unbinned`. If :code:`binning=binned`, it must provide map2cl_binned() and map2cl_binned_masks(), as pospace does\n
         masks_fn (list[str]):   the sky patches to calculate the power spectra on. Note that this is different to using `nlevels`. Here, no tresholds are calculated, but masks are used 'as is' for delensing.\n
         basemap (str):          the delensed map Bdel is calculated as Bdel = basemap - blt. Basemap can be two things: 'obs' or 'lens', where 'obs' will use the observed sky map, and lens will use the pure B-lensing map.
+        cache_couplings (bool): if set, the coupling matrices of the binned power spectrum calculator are cached on disk, next to the delensed spectra. The calculator must accept a 'lib_dir' argument, as pospace does\n
     """
 
     data_from_CFS =         attr.field(default=DEFAULT_NotAValue, validator=mapdelensing.data_from_CFS)
@@ -323,6 +324,7 @@ class DLENSALOT_Mapdelensing(DLENSALOT_Concept):
     spectrum_calculator =   attr.field(default=DEFAULT_NotAValue, validator=mapdelensing.spectrum_calculator)
     masks_fn =              attr.field(default=DEFAULT_NotAValue, validator=mapdelensing.masks)
     basemap =               attr.field(default=DEFAULT_NotAValue, validator=mapdelensing.basemap)
+    cache_couplings =       attr.field(default=DEFAULT_NotAValue, validator=mapdelensing.cache_couplings)
 
 @attr.s
 class DLENSALOT_Phianalysis(DLENSALOT_Concept):
@@ -834,6 +834,7 @@ class l2delensalotjob_Transformer(l2base_Transformer):
                         dl.cl_calc = hp
                     else:
                         dl.cl_calc = ma.spectrum_calculator       
+                    dl.cache_couplings = ma.cache_couplings and dl.binning == 'binned'
 
 
                 def _process_Config(dl, co):
@@ -848,8 +849,8 @@ class l2delensalotjob_Transformer(l2base_Transformer):
 
                 def _check_powspeccalculator(clc):
                     if dl.binning == 'binned':
-                        if 'map2cl_binned' not in clc.__dict__:
-                            log.error("Spectrum calculator doesn't provide needed function map2cl_binned() for binned spectrum calculation")
+                        if 'map2cl_binned' not in clc.__dict__ or 'map2cl_binned_masks' not in clc.__dict__:
+                            log.error("Spectrum calculator doesn't provide needed functions map2cl_binned() and map2cl_binned_masks() for binned spectrum calculation")
                             sys.exit()
                     elif dl.binning == 'unbinned':
                         if 'map2cl' not in clc.__dict__:
@@ -23,6 +23,7 @@ safelist = [
     'OMP_NUM_THREADS',
     'rhits_normalised',
     'masks_fn',
+    'cache_couplings',
 ]
 
 DEFAULT_NotAValue = -123456789
\ No newline at end of file
@@ -15,6 +15,7 @@ valid_value = {
     'spectrum_calculator': [],
     'masks_fn': [],
     'basemap': [],
+    'cache_couplings': [True, False],
 }
 # if [], doesn't check for bounds
 valid_bound = {
@@ -30,6 +31,7 @@ valid_bound = {
     'spectrum_calculator': [],
     'masks_fn': [],
     'basemap': [],
+    'cache_couplings': [],
 }
 
 # if [], doesn't check for type
@@ -46,6 +48,7 @@ valid_type = {
     'spectrum_calculator': [],
     'masks_fn': [],
     'basemap': [],
+    'cache_couplings': [],
 }
 
 def edges(instance, attribute, value):
@@ -145,3 +148,7 @@ def binning(instance, attribute, value):
 def spectrum_calculator(instance, attribute, value):
     if np.all(value != DEFAULT_NotAValue):
         assert value in valid_value[attribute.name] if valid_value[attribute.name] != [] else 1, ValueError('Must be in {}, but is {}'.format(valid_bound[attribute.name], value))
+
+def cache_couplings(instance, attribute, value):
+    if np.all(value != DEFAULT_NotAValue):
+        assert value in valid_value[attribute.name] if valid_value[attribute.name] != [] else 1, ValueError('Must be in {}, but is {}'.format(valid_value[attribute.name], value))
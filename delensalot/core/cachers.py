@@ -1,4 +1,9 @@
 import os
+import mmap
+import time
+import fnmatch
+import threading
+from collections import OrderedDict
 import numpy as np
 import pickle as pk
 
@@ -7,8 +12,23 @@ class cacher(object):
         assert 0
     def load(self, fn):
         assert 0
+    def load_view(self, fn):
+        """Read-only access to a cached object. Defaults to load, subclasses may avoid the copy
+
+        """
+        return self.load(fn)
     def is_cached(self, fn):
         assert 0
+    def stamp(self, fn):
+        """Signature of the stored object (e.g. its size and modification time), changing whenever it is rewritten, or None if there is none
+
+        """
+        assert 0
+    def get(self, fn, default=None):
+        """Returns the cached object, or default if there is none
+
+        """
+        return self.load(fn) if self.is_cached(fn) else default
     def remove(self, fn):
         assert 0
 
@@ -23,11 +43,20 @@ class cacher_none(cacher):
         pass
 
 class cacher_npy(cacher):
-    def __init__(self, lib_dir, verbose=False):
+    def __init__(self, lib_dir, verbose=False, mmap_mode=None):
+        """Stores each array as an uncompressed npy file in lib_dir
+
+            Args:
+                lib_dir: directory of the npy files
+                mmap_mode(optional): if set, 'load' memory-maps the arrays with this mode (see np.load),
+                                     e.g. 'c' for copy-on-write arrays paged in from disk on access
+
+        """
         if not os.path.exists(lib_dir):
             os.makedirs(lib_dir)
         self.lib_dir = lib_dir
         self.verbose = verbose
+        self.mmap_mode = mmap_mode
 
     def _path(self, fn):
         assert '.npy' not in fn
@@ -45,16 +74,128 @@ class cacher_npy(cacher):
         assert os.path.exists(p), p
         if self.verbose:
             print("Loading " + fn + '.npy')
-        return np.load(p, allow_pickle=True)
+        return np.load(p, mmap_mode=self.mmap_mode, allow_pickle=True)
+
+    def load_view(self, fn):
+        """Returns a read-only memory-mapped view onto the cached array
+
+            Nothing is read until the view is accessed, and only the accessed pages are.
+            Pickled object arrays cannot be memory-mapped and are loaded as usual.
+
+        """
+        p = self._path(fn)
+        assert os.path.exists(p), p
+        if self.verbose:
+            print("Mapping " + fn + '.npy')
+        try:
+            return np.load(p, mmap_mode='r', allow_pickle=True)
+        except ValueError:
+            return np.load(p, allow_pickle=True)
 
     def is_cached(self, fn):
         return os.path.exists(self._path(fn))
 
+    def stamp(self, fn):
+        try:
+            st = os.stat(self._path(fn))
+        except OSError:
+            return None
+        return [st.st_size, st.st_mtime_ns]
+
     def remove(self, fn):
         assert self.is_cached(fn)
         os.remove(self._path(fn))
 
 
+class cacher_h5(cacher):
+    def __init__(self, lib_dir, fn='cache.h5', compression='gzip', compression_opts=4, downcast=(), verbose=False):
+        """Stores all arrays of lib_dir as datasets of a single chunked HDF5 container
+
+            Args:
+                lib_dir: directory of the container
+                fn: container file name
+                compression: lossless h5py filter of the datasets ('gzip', 'lzf', or None for no compression)
+                compression_opts: options of the filter (gzip level)
+                downcast: fnmatch patterns of keys stored in single precision, and brought back to their dtype on load
+
+            Note:
+                Removed datasets are unlinked but their space is not reclaimed until the container is repacked (h5repack)
+
+        """
+        try:
+            import h5py
+        except ImportError:
+            assert 0, "could not import h5py, needed for cacher_h5"
+        if not os.path.exists(lib_dir):
+            os.makedirs(lib_dir)
+        self.lib_dir = lib_dir
+        self.fn = os.path.join(lib_dir, fn)
+        self.compression = compression
+        self.compression_opts = compression_opts if compression == 'gzip' else None
+        self.downcast = list(downcast)
+        self.verbose = verbose
+
+    def _key(self, fn):
+        if fn.startswith('/'):
+            assert os.path.dirname(fn) == os.path.abspath(self.lib_dir), (fn, self.lib_dir)
+            fn = os.path.basename(fn)
+        return fn
+
+    def _open(self, mode):
+        import h5py
+        return h5py.File(self.fn, mode)
+
+    def _is_downcast(self, key):
+        return np.any([fnmatch.fnmatch(key, pattern) for pattern in self.downcast])
+
+    def cache(self, fn, obj):
+        key = self._key(fn)
+        obj = np.asarray(obj)
+        assert obj.dtype != object, 'cacher_h5 only supports numerical arrays, ' + fn
+        dtype = obj.dtype
+        if self._is_downcast(key) and dtype in [np.float64, np.complex128]:
+            obj = obj.astype({np.dtype(np.float64): np.float32, np.dtype(np.complex128): np.complex64}[dtype])
+        with self._open('a') as f:
+            if key in f:
+                del f[key]
+            if obj.ndim == 0:
+                dset = f.create_dataset(key, data=obj)
+            else:
+                dset = f.create_dataset(key, data=obj, chunks=True, compression=self.compression, compression_opts=self.compression_opts)
+            dset.attrs['dtype'] = dtype.str
+            dset.attrs['mtime_ns'] = time.time_ns()
+        if self.verbose: print("Cached " + key + ' in ' + self.fn)
+
+    def load(self, fn):
+        key = self._key(fn)
+        assert self.is_cached(fn), key
+        if self.verbose:
+            print("Loading " + key + ' from ' + self.fn)
+        with self._open('r') as f:
+            dset = f[key]
+            return dset[()].astype(np.dtype(dset.attrs['dtype']), copy=False)
+
+    def is_cached(self, fn):
+        if not os.path.exists(self.fn):
+            return False
+        with self._open('r') as f:
+            return self._key(fn) in f
+
+    def stamp(self, fn):
+        if not os.path.exists(self.fn):
+            return None
+        with self._open('r') as f:
+            key = self._key(fn)
+            if key not in f:
+                return None
+            return [int(f[key].id.get_storage_size()), int(f[key].attrs.get('mtime_ns', -1))]
+
+    def remove(self, fn):
+        assert self.is_cached(fn)
+        with self._open('a') as f:
+            del f[self._key(fn)]
+
+
 class cacher_mem(cacher):
     def __init__(self, safe=True):
         """Makes copies if safe is set, otherwise returns and cache the reference
@@ -75,6 +216,15 @@ class cacher_mem(cacher):
         else:
             return self._cache[fn]
 
+    def load_view(self, fn):
+        """Returns a read-only view onto the cached array, without copy
+
+        """
+        assert fn in self._cache.keys()
+        ret = np.asarray(self._cache[fn]).view()
+        ret.flags.writeable = False
+        return ret
+
     def is_cached(self, fn):
         return fn in self._cache.keys()
 
@@ -82,6 +232,213 @@ class cacher_mem(cacher):
         assert fn in self._cache.keys()
         del self._cache[fn]
 
+def _is_mapped(obj):
+    """Whether the array is a view onto a memory-mapped file, e.g. as returned by np.load with mmap_mode
+
+    """
+    while obj is not None:
+        if isinstance(obj, (mmap.mmap, np.memmap)):
+            return True
+        obj = getattr(obj, 'base', None)
+    return False
+
+
+class cacher_lru(cacher):
+    def __init__(self, cacher:cacher, maxbytes=2 ** 30):
+        """Bounded in-memory layer on top of another cacher
+
+            Objects are written through to 'cacher', and the most recently used arrays are also kept in memory,
+            up to 'maxbytes' in total. Arrays larger than 'maxbytes' are never kept.
+            Memory-mapped views returned by load_view are kept as they are, without reading them in, and are
+            accounted for separately in 'nbytes_mapped', with their own limit of 'maxbytes'.
+
+        """
+        self.cacher = cacher
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.nbytes_mapped = 0
+        self._cache = OrderedDict()
+        self._mapped = set()
+
+    def _keep(self, fn, obj, view=False):
+        self._drop(fn)
+        mapped = view and _is_mapped(obj)
+        if mapped:
+            obj = np.asarray(obj).view()
+        else:
+            obj = np.array(obj)
+        if obj.nbytes > self.maxbytes:
+            return
+        obj.flags.writeable = False
+        self._cache[fn] = obj
+        if mapped:
+            self._mapped.add(fn)
+            self.nbytes_mapped += obj.nbytes
+        else:
+            self.nbytes += obj.nbytes
+        while self.nbytes > self.maxbytes or self.nbytes_mapped > self.maxbytes:
+            over_mapped = self.nbytes_mapped > self.maxbytes
+            self._drop(next(key for key in self._cache.keys() if (key in self._mapped) == over_mapped))
+
+    def _drop(self, fn):
+        if fn in self._cache:
+            if fn in self._mapped:
+                self._mapped.discard(fn)
+                self.nbytes_mapped -= self._cache.pop(fn).nbytes
+            else:
+                self.nbytes -= self._cache.pop(fn).nbytes
+
+    def cache(self, fn, obj):
+        self.cacher.cache(fn, obj)
+        self._keep(fn, obj)
+
+    def load(self, fn):
+        if fn in self._cache:
+            self._cache.move_to_end(fn)
+            return np.copy(self._cache[fn])
+        obj = self.cacher.load(fn)
+        self._keep(fn, obj)
+        return obj
+
+    def load_view(self, fn):
+        if fn in self._cache:
+            self._cache.move_to_end(fn)
+            return self._cache[fn]
+        ret = self.cacher.load_view(fn)
+        if np.asarray(ret).nbytes <= self.maxbytes:
+            self._keep(fn, ret, view=True)
+            return self._cache[fn]
+        return ret
+
+    def is_cached(self, fn):
+        return fn in self._cache or self.cacher.is_cached(fn)
+
+    def stamp(self, fn):
+        return self.cacher.stamp(fn)
+
+    def remove(self, fn):
+        self._drop(fn)
+        self.cacher.remove(fn)
+
+
+class mem_budget(object):
+    def __init__(self, maxbytes=None):
+        """Memory budget shared by several cacher_mem_ro instances
+
+            Holds the least recently used order of the arrays of all these cachers, such that the oldest arrays are evicted
+            whichever cacher they belong to, once more than 'maxbytes' are held in total. No budget if maxbytes is None.
+
+        """
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.lock = threading.RLock() # shared by the cachers, to keep the order and their contents consistent
+        self._lru = OrderedDict() # (id(cacher), fn) -> cacher
+
+    def touch(self, cacher, fn):
+        self._lru.move_to_end((id(cacher), fn))
+
+    def add(self, cacher, fn, nbytes):
+        self._lru[(id(cacher), fn)] = cacher
+        self.nbytes += nbytes
+        self.evict()
+
+    def discard(self, cacher, fn, nbytes):
+        self._lru.pop((id(cacher), fn))
+        self.nbytes -= nbytes
+
+    def evict(self):
+        if self.maxbytes is None:
+            return
+        for (_, fn), cacher in list(self._lru.items())[:-1]:
+            if self.nbytes <= self.maxbytes:
+                break
+            if fn not in cacher._pinned:
+                cacher.remove(fn)
+
+
+class cacher_mem_ro(cacher):
+    def __init__(self, maxbytes=None, budget=None):
+        """Zero-copy in-memory cacher with a memory budget
+
+            Arrays are kept by reference and handed out as non-writeable views, without any copy.
+            Callers which need to modify a loaded array must copy it first (copy-on-write).
+            The least recently used arrays are evicted once more than 'maxbytes' are held, except for pinned ones
+            and the most recent one. No budget if maxbytes is None. Safe to share among threads.
+
+            Args:
+                maxbytes(optional): memory budget of this cacher
+                budget(optional): mem_budget instance shared with other cachers, replaces maxbytes
+
+        """
+        self.budget = mem_budget(maxbytes) if budget is None else budget
+        self.nbytes = 0
+        self._cache = dict()
+        self._pinned = set()
+        self._lock = self.budget.lock
+
+    @property
+    def maxbytes(self):
+        return self.budget.maxbytes
+
+    def cache(self, fn, obj):
+        obj = np.asarray(obj).view()
+        obj.flags.writeable = False
+        with self._lock:
+            if fn in self._cache:
+                self.remove(fn)
+            self._cache[fn] = obj
+            self.nbytes += obj.nbytes
+            self.budget.add(self, fn, obj.nbytes)
+
+    def load(self, fn):
+        with self._lock:
+            assert fn in self._cache.keys(), fn
+            self.budget.touch(self, fn)
+            return self._cache[fn]
+
+    def load_view(self, fn):
+        return self.load(fn)
+
+    def get(self, fn, default=None):
+        """Returns the cached array, or default if there is none, in one step (an array could be evicted by another thread in between is_cached and load)
+
+        """
+        with self._lock:
+            if fn not in self._cache.keys():
+                return default
+            self.budget.touch(self, fn)
+            return self._cache[fn]
+
+    def pin(self, fn):
+        """Exempts a cached array from eviction, e.g. if it cannot be recomputed
+
+        """
+        with self._lock:
+            assert fn in self._cache.keys(), fn
+            self._pinned.add(fn)
+
+    def is_cached(self, fn):
+        with self._lock:
+            return fn in self._cache.keys()
+
+    def remove(self, fn):
+        with self._lock:
+            assert fn in self._cache.keys()
+            nbytes = self._cache.pop(fn).nbytes
+            self.nbytes -= nbytes
+            self.budget.discard(self, fn, nbytes)
+            self._pinned.discard(fn)
+
+    def clear(self):
+        """Drops all arrays which are not pinned
+
+        """
+        with self._lock:
+            for fn in list(self._cache.keys()):
+                if fn not in self._pinned:
+                    self.remove(fn)
+
+
 class cacher_pk(object):
     def __init__(self, lib_dir, verbose=False):
         if not os.path.exists(lib_dir):
@@ -71,3 +71,36 @@ class monitor_basic:
 
     def __call__(self, *args):
         return self.criterion(*args)
+
+
+class monitor_block:
+    """Convergence appraiser for block solvers.
+
+    Same as *monitor_basic*, applied to each right-hand-side separately. Convergence is reached when all have converged.
+
+    """
+    def __init__(self, dot_op, iter_max=1000, eps_min=1.0e-10, logger=logger_basic, d0s=None):
+        self.dot_op = dot_op
+        self.iter_max = iter_max
+        self.eps_min = eps_min
+        self.logger = logger
+        self.d0s = d0s
+
+        self.watch = stopwatch()
+
+    def criterion(self, iter, soltns, resids):
+        deltas = np.array([self.dot_op(resid, resid) for resid in resids])
+
+        if (iter == 0) and (self.d0s is None):
+            self.d0s = deltas
+
+        if self.logger is not None: self.logger(iter, np.sqrt(np.max(deltas / self.d0s)), watch=self.watch,
+                                                  soltn=soltns, resid=resids)
+
+        if (iter >= self.iter_max) or np.all(deltas <= self.eps_min ** 2 * self.d0s):
+            return True
+
+        return False
+
+    def __call__(self, *args):
+        return self.criterion(*args)
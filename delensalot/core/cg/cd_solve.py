@@ -12,27 +12,203 @@ tr_cg = (lambda i: i - 1)
 tr_cd = (lambda i: 0)
 
 
+def _nbytes(vec):
+    if hasattr(vec, 'nbytes'):
+        return vec.nbytes
+    return sum([getattr(v, 'nbytes', 0) for v in vars(vec).values()]) # e.g. plancklens eblm or teblm containers
+
+
 class cache_mem(dict):
+    """In-memory cache of the search directions, keeping track of its memory footprint
+
+        *nbytes* is the current size of the cached vectors, *nbytes_peak* and *nentries_peak* the largest
+        size and number of entries since the last reset (cd_solve resets these at the start of each solve).
+
+    """
     def __init__(self):
-        pass
+        super().__init__()
+        self.reset()
+
+    def reset(self):
+        self.clear()
+        self._nbytes = {}
+        self.nbytes = 0
+        self.nbytes_peak = 0
+        self.nentries_peak = 0
 
     def store(self, key, data):
         [dTAd_inv, searchdirs, searchfwds] = data
+        if key in self:
+            self.remove(key)
         self[key] = [dTAd_inv, searchdirs, searchfwds]
+        self._nbytes[key] = sum([_nbytes(vec) for vec in searchdirs + searchfwds])
+        self.nbytes += self._nbytes[key]
+        self.nbytes_peak = max(self.nbytes_peak, self.nbytes)
+        self.nentries_peak = max(self.nentries_peak, len(self))
 
     def restore(self, key):
         return self[key]
 
     def remove(self, key):
         del self[key]
+        self.nbytes -= self._nbytes.pop(key)
 
     def trim(self, keys):
         assert (set(keys).issubset(self.keys()))
         for key in (set(self.keys()) - set(keys)):
-            del self[key]
+            self.remove(key)
+
+    def stats(self):
+        """Returns the current and peak memory footprint of the cache
+
+        """
+        return {'nbytes': self.nbytes, 'nbytes_peak': self.nbytes_peak, 'nentries_peak': self.nentries_peak}
+
+
+class cache_ritz(cache_mem):
+    """Memory cache also harvesting approximate low eigenvectors of the forward operation from the search directions
+
+        Search directions and their forward operations are collected until there are more than *nkeep* of them,
+        at which point they are compressed onto their *nvec* lowest Ritz vectors.
+
+        Args:
+            dot_op (callable)   :Scalar product for two vectors.
+            nvec (int)          :Number of Ritz vectors kept.
+            nkeep (int)         :Number of vectors held in memory before compression.
+            pairs (optional)    :Initial (vectors, forward vectors) pair of lists, e.g. the deflation space of the solve.
+
+    """
+    def __init__(self, dot_op, nvec=4, nkeep=12, pairs=None):
+        super().__init__()
+        assert nkeep > nvec > 0, (nvec, nkeep)
+        self.dot_op = dot_op
+        self.nvec = nvec
+        self.nkeep = nkeep
+        self.dirs = [] if pairs is None else list(pairs[0])
+        self.fwds = [] if pairs is None else list(pairs[1])
+
+    def store(self, key, data):
+        super().store(key, data)
+        self.dirs.extend(data[1])
+        self.fwds.extend(data[2])
+        if len(self.dirs) > self.nkeep:
+            self.dirs, self.fwds = ritz_pairs(self.dirs, self.fwds, self.dot_op, self.nvec)[:2]
+
+    def ritz_pairs(self):
+        """Returns the lowest Ritz vectors, their forward operations and the Ritz values of the harvested space
+
+        """
+        return ritz_pairs(self.dirs, self.fwds, self.dot_op, self.nvec)
+
+
+def ritz_pairs(dirs, fwds, dot_op, nvec, rcond=1e-10):
+    """Rayleigh-Ritz approximation to the lowest eigenvectors of the forward operation within the span of *dirs*
+
+        Args:
+            dirs (list of array-like)   :Vectors spanning the search space.
+            fwds (list of array-like)   :Forward operation applied to these vectors.
+            dot_op (callable)           :Scalar product for two vectors.
+            nvec (int)                  :Number of Ritz vectors to return.
+            rcond (float, optional)     :Relative cutoff on the Gram matrix eigenvalues for linearly dependent vectors.
+
+        Returns:
+            Ritz vectors, their forward operations, and the Ritz values (ascending)
+
+    """
+    n = len(dirs)
+    if n == 0:
+        return [], [], np.zeros(0)
+    dTAd = np.zeros((n, n))
+    dTd = np.zeros((n, n))
+    for i in range(n):
+        for j in range(0, i + 1):
+            dTAd[i, j] = dTAd[j, i] = 0.5 * (dot_op(dirs[i], fwds[j]) + dot_op(dirs[j], fwds[i]))
+            dTd[i, j] = dTd[j, i] = dot_op(dirs[i], dirs[j])
+    s, U = np.linalg.eigh(dTd)
+    ii = s > rcond * s[-1]
+    T = U[:, ii] / np.sqrt(s[ii])
+    theta, V = np.linalg.eigh(T.T @ dTAd @ T)
+    Y = T @ V[:, :nvec]
+    return _combine(dirs, Y), _combine(fwds, Y), theta[:nvec]
+
+
+def _combine(vecs, Y):
+    ret = []
+    for y in Y.T:
+        vec = vecs[0] * y[0]
+        for (v, c) in zip(vecs[1:], y[1:]):
+            vec += v * c
+        ret.append(vec)
+    return ret
+
+
+class recycler:
+    """Deflation space harvested from, and recycled across, successive solves
+
+        Each solve with this recycler is deflated with the Ritz vectors of the previous ones, and its own search
+        directions are compressed together with them into an updated set of Ritz vectors.
+        The forward images of the Ritz vectors are reused as long as the forward operation does not change;
+        call *invalidate* when it does, to have them recomputed on the next solve.
+
+        Args:
+            nvec (int)  :Number of Ritz vectors kept across solves.
+            nkeep (int) :Number of vectors held in memory before compression onto the Ritz vectors.
+
+    """
+    def __init__(self, nvec=8, nkeep=24):
+        assert nkeep > nvec > 0, (nvec, nkeep)
+        self.nvec = nvec
+        self.nkeep = nkeep
+        self.reset()
+
+    def reset(self):
+        """Discards the deflation space
+
+        """
+        self.vecs = []
+        self.fwds = []
+        self.stale = False
+        self.cache_stats = None
+
+    def invalidate(self):
+        """Flags the forward operation as changed
+
+        """
+        self.stale = True
+
+    def get_deflation(self, fwd_op):
+        """Returns the (vectors, forward vectors) deflation space, or None if empty
+
+        """
+        if len(self.vecs) == 0:
+            return None
+        if self.stale:
+            self.fwds = [fwd_op(vec) for vec in self.vecs]
+            self.stale = False
+        return self.vecs, self.fwds
+
+    def get_cache(self, dot_op, deflation):
+        return cache_ritz(dot_op, nvec=self.nvec, nkeep=self.nkeep, pairs=deflation)
+
+    def harvest(self, cache):
+        self.vecs, self.fwds = cache.ritz_pairs()[:2]
+        self.stale = False
+        self.cache_stats = cache.stats()
+
 
+def _deflate(searchdirs, defl_dirs, defl_fwds, defl_inv, dot_op):
+    """Makes the search directions conjugate to the deflation space
 
-def cd_solve(x, b, fwd_op, pre_ops, dot_op, criterion, tr, cache=cache_mem(), roundoff=25):
+    """
+    for searchdir in searchdirs:
+        proj = [dot_op(searchdir, defl_fwd) for defl_fwd in defl_fwds]
+        betas = np.dot(defl_inv, proj)
+        for (beta, defl_dir) in zip(betas, defl_dirs):
+            searchdir -= defl_dir * beta
+
+
+def cd_solve(x, b, fwd_op, pre_ops, dot_op, criterion, tr, cache=None, roundoff=25, deflation=None,
+             recycler=None):
     """customizable conjugate directions loop for x=[fwd_op]^{-1}b.
 
     Args:
@@ -44,8 +220,16 @@ def cd_solve(x, b, fwd_op, pre_ops, dot_op, criterion, tr, cache=cache_mem(), ro
         dot_op (callable)           :Scalar product for two vectors.
         criterion (callable)        :Decides convergence.
         tr                          :Truncation / restart functions. (e.g. use tr_cg for conjugate gradient)
-        cache (optional)            :Cacher for search objects. Defaults to cache in memory 'cache_mem' instance.
+        cache (optional)            :Cacher for search objects. Defaults to a new 'cache_mem' instance for this solve.
+                                     Only the entries the truncation function *tr* can reference are kept during the
+                                     solve, and the cache is emptied at the end (its peak size statistics remain).
         roundoff (int, optional)    :Recomputes residual by brute-force every *roundoff* iterations. Defaults to 25.
+        deflation (optional)        :(vectors, forward vectors) pair of lists spanning a deflation space, e.g. Ritz vectors
+                                     of a previous solve. The starting point is corrected on this space, and the search
+                                     directions are kept conjugate to it. The forward vectors must be exact.
+        recycler (optional)         :'recycler' instance. Deflated mode, where the deflation space is taken from, and
+                                     updated with the search directions of, the previous solves. Replaces *cache* and
+                                     *deflation*.
 
     Note:
         fwd_op, pre_op(s) and dot_op must not modify their arguments!
@@ -54,8 +238,33 @@ def cd_solve(x, b, fwd_op, pre_ops, dot_op, criterion, tr, cache=cache_mem(), ro
 
     n_pre_ops = len(pre_ops)
 
+    if recycler is not None:
+        assert deflation is None, 'recycler and deflation space are exclusive'
+        deflation = recycler.get_deflation(fwd_op)
+        cache = recycler.get_cache(dot_op, deflation)
+    if cache is None:
+        cache = cache_mem()
+    if hasattr(cache, 'reset'): # foreign caches, e.g. plancklens cache_mem, have no statistics to reset
+        cache.reset()
+
     residual = b - fwd_op(x)
+
+    if deflation is not None:
+        defl_dirs, defl_fwds = deflation
+        n_defl = len(defl_dirs)
+        wTAw = np.zeros((n_defl, n_defl))
+        for ip1 in range(0, n_defl):
+            for ip2 in range(0, ip1 + 1):
+                wTAw[ip1, ip2] = wTAw[ip2, ip1] = dot_op(defl_dirs[ip1], defl_fwds[ip2])
+        defl_inv = np.linalg.inv(wTAw)
+        mus = np.dot(defl_inv, [dot_op(defl_dir, residual) for defl_dir in defl_dirs])
+        for (defl_dir, defl_fwd, mu) in zip(defl_dirs, defl_fwds, mus):
+            x += defl_dir * mu
+            residual -= defl_fwd * mu
+
     searchdirs = [op(residual) for op in pre_ops]
+    if deflation is not None:
+        _deflate(searchdirs, defl_dirs, defl_fwds, defl_inv, dot_op)
 
     iter = 0
     while not criterion(iter, x, residual):
@@ -74,8 +283,9 @@ def cd_solve(x, b, fwd_op, pre_ops, dot_op, criterion, tr, cache=cache_mem(), ro
         for (searchdir, alpha) in zip(searchdirs, alphas):
             x += searchdir * alpha
 
-        # append to cache.
+        # append to cache, and drop what the next orthogonalization will not need.
         cache.store(iter, [dTAd_inv, searchdirs, searchfwds])
+        cache.trim(range(tr(iter + 1), iter + 1))
 
         # update residual
         iter += 1
@@ -100,8 +310,93 @@ def cd_solve(x, b, fwd_op, pre_ops, dot_op, criterion, tr, cache=cache_mem(), ro
 
                 for (beta, prev_searchdir) in zip(betas, prev_searchdirs):
                     searchdir -= prev_searchdir * beta
+        if deflation is not None:
+            _deflate(searchdirs, defl_dirs, defl_fwds, defl_inv, dot_op)
 
         # clear old keys from cache
         cache.trim(range(tr(iter + 1), iter))
 
+    if recycler is not None:
+        recycler.harvest(cache)
+    cache.trim([])
+    return iter
+
+
+def _gram(vecs1, vecs2, dot_op):
+    return np.array([[dot_op(v1, v2) for v2 in vecs2] for v1 in vecs1])
+
+
+def _accumulate(vecs, dvecs, coeffs, sign=1.):
+    """vecs[j] += sign * sum_i dvecs[i] coeffs[i, j], in place
+
+    """
+    for j, vec in enumerate(vecs):
+        for i, dvec in enumerate(dvecs):
+            vec += dvec * (sign * coeffs[i, j])
+
+
+def _a_orthonormalize(searchdirs, searchfwds, dot_op, eps=1e-14):
+    """Coefficients of an fwd_op-orthonormal basis of the span of the search directions
+
+    Directions (nearly) linearly dependent on the others, as happens when some of the right-hand-sides have converged,
+    are dropped. The block is first rescaled to unit norms, so that this does not depend on how far each has converged.
+
+    """
+    dTAd = _gram(searchdirs, searchfwds, dot_op)
+    dTAd = 0.5 * (dTAd + dTAd.T)
+    diag = np.diag(dTAd)
+    scal = np.where(diag > 0., 1. / np.sqrt(np.where(diag > 0., diag, 1.)), 0.)
+    eigv, eigvec = np.linalg.eigh(dTAd * np.outer(scal, scal))
+    keep = eigv > eps * np.max(eigv)
+    return scal[:, None] * eigvec[:, keep] / np.sqrt(eigv[keep])
+
+
+def cd_solve_block(xs, bs, fwd_op, pre_op, dot_op, criterion, roundoff=25):
+    """Block preconditioned conjugate gradient loop for the multiple right-hand-sides problem x_i =[fwd_op]^{-1}b_i.
+
+    The search space is built from the residuals of all right-hand-sides at once. The search directions are made
+    fwd_op-orthonormal at each iteration, dropping the (nearly) dependent ones, so that the iterations carry on once some
+    of the right-hand-sides have converged.
+
+    Args:
+        xs (list of array-like)     :Initial guesses. Contain converged solutions at the end (if successful).
+        bs (list of array-like)     :Right-hand-sides.
+        fwd_op (callable)           :Forward operation in x =[fwd_op]^{-1}b.
+        pre_op (callable)           :Pre-conditioner.
+        dot_op (callable)           :Scalar product for two vectors.
+        criterion (callable)        :Decides convergence, from the lists of solutions and residuals (e.g. cd_monitors.monitor_block)
+        roundoff (int, optional)    :Recomputes residuals by brute-force every *roundoff* iterations. Defaults to 25.
+
+    Note:
+        fwd_op, pre_op and dot_op must not modify their arguments!
+
+    """
+    assert len(xs) == len(bs), (len(xs), len(bs))
+    residuals = [b - fwd_op(x) for (b, x) in zip(bs, xs)]
+    searchdirs = [pre_op(residual) for residual in residuals]
+
+    iter = 0
+    while not criterion(iter, xs, residuals):
+        searchfwds = [fwd_op(searchdir) for searchdir in searchdirs]
+        coeffs = _a_orthonormalize(searchdirs, searchfwds, dot_op)
+        searchdirs = _combine(searchdirs, coeffs)
+        searchfwds = _combine(searchfwds, coeffs)
+
+        # search.
+        alphas = _gram(searchdirs, residuals, dot_op)
+        _accumulate(xs, searchdirs, alphas)
+
+        # update residuals
+        iter += 1
+        if np.mod(iter, roundoff) == 0:
+            residuals = [b - fwd_op(x) for (b, x) in zip(bs, xs)]
+        else:
+            _accumulate(residuals, searchfwds, alphas, sign=-1.)
+
+        # new search directions, conjugate to the previous ones.
+        newdirs = [pre_op(residual) for residual in residuals]
+        betas = _gram(searchfwds, newdirs, dot_op)
+        _accumulate(newdirs, searchdirs, betas, sign=-1.)
+        searchdirs = newdirs
+
     return iter
@@ -2,6 +2,9 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import division
 
+import logging
+log = logging.getLogger(__name__)
+
 import sys, re, copy
 import numpy as np
 
@@ -22,7 +25,15 @@ class multigrid_stage(object):
 
 
 class multigrid_chain:
-    def __init__(self, opfilt, chain_descr, s_cls, n_inv_filt, debug_log_prefix=None, plogdepth=0):
+    def __init__(self, opfilt, chain_descr, s_cls, n_inv_filt, debug_log_prefix=None, plogdepth=0, recycle_nvec=0):
+        """Multigrid conjugate-directions solver chain
+
+            Args:
+                recycle_nvec(optional): if set, solves are deflated with this number of Ritz vectors harvested from
+                                        the previous solves (see cd_solve.recycler). This assumes the forward operation
+                                        does not change in between, or that self.recycler.invalidate() is called.
+
+        """
         self.debug_log_prefix = debug_log_prefix
         self.plogdepth = plogdepth
 
@@ -40,8 +51,22 @@ class multigrid_chain:
                                                              s_cls=self.s_cls, n_inv_filt=self.n_inv_filt,
                                                              stages=stages, lmax=lmax, nside=nside, chain=self))
         self.bstage = stages[0]  # these are the pre_ops called in cd_solve
+        self.recycler = cd_solve.recycler(nvec=recycle_nvec, nkeep=2 * recycle_nvec) if recycle_nvec > 0 else None
+        self.iter_solve = 0 # number of iterations of the last solve
+        self.cache_stats = None # search directions cache memory statistics of the last solve, if the cache keeps any
+
+    def solve(self, soltn, tpn_map, apply_fini='', dot_op=None, cache=None, deflation=None):
+        """Solves the top stage of the chain, starting from and updating *soltn*
+
+            Args:
+                cache(optional): search directions cache of this solve (defaults to the top stage cache)
+                deflation(optional): (vectors, forward vectors) deflation space passed to cd_solve
 
-    def solve(self, soltn, tpn_map, apply_fini='', dot_op=None):
+            Note:
+                If neither cache nor deflation is given, the chain recycler (if any) is used
+
+
+        """
         assert hasattr(self.opfilt, 'apply_fini%s' % apply_fini)
         finifunc = getattr(self.opfilt, 'apply_fini%s' % apply_fini)
         if apply_fini != '':
@@ -62,9 +87,19 @@ class multigrid_chain:
 
         fwd_op = self.opfilt.fwd_op(self.s_cls, self.n_inv_filt)
 
-        cd_solve.cd_solve(soltn, tpn_alm,
+        recycler = self.recycler if (cache is None and deflation is None) else None
+        if cache is None:
+            cache = self.bstage.cache if self.bstage.cache is not None else cd_solve.cache_mem()
+        self.iter_solve = cd_solve.cd_solve(soltn, tpn_alm,
                           fwd_op, self.bstage.pre_ops, dot_op, monitor,
-                          tr=self.bstage.tr, cache=self.bstage.cache)
+                          tr=self.bstage.tr, cache=cache, deflation=deflation, recycler=recycler)
+        if recycler is not None:
+            self.cache_stats = recycler.cache_stats
+        else:
+            self.cache_stats = cache.stats() if hasattr(cache, 'stats') else None
+        if self.cache_stats is not None:
+            log.debug('cd_solve cache peak: %d entries, %.1f MB' % (
+                self.cache_stats['nentries_peak'], self.cache_stats['nbytes_peak'] / 1024. ** 2))
         finifunc(soltn, self.s_cls, self.n_inv_filt)
 
     def log(self, stage, iter, eps, **kwargs):
@@ -109,6 +144,87 @@ class multigrid_chain:
             self.prev_elapsed = elapsed
 
 
+class multigrid_context:
+    """Keeps a multigrid chain and a recycled Krylov subspace alive across solves with a slowly varying forward operation
+
+        The preconditioners are built once, and reused for as long as the chain structure is unchanged
+        (the stopping criteria and cache of the top stage may change from one solve to the next).
+        The chain recycler harvests Ritz vectors approximating the lowest eigenvectors of the forward operation,
+        used to deflate the next solves. When the forward operation changes, their forward images are recomputed,
+        at the cost of *nvec* operations.
+
+        Args:
+            opfilt: filtering module
+            s_cls: filter spectra
+            n_inv_filt: inverse-noise filter instance (may have its deflection field updated in between solves)
+            nvec: number of Ritz vectors recycled across solves (0 disables recycling)
+            nkeep: number of search directions held in memory before compression onto the Ritz vectors
+
+    """
+    def __init__(self, opfilt, s_cls, n_inv_filt, nvec=4, nkeep=12, debug_log_prefix=None, plogdepth=0):
+        self.opfilt = opfilt
+        self.s_cls = s_cls
+        self.n_inv_filt = n_inv_filt
+        self.debug_log_prefix = debug_log_prefix
+        self.plogdepth = plogdepth
+
+        self.recycler = cd_solve.recycler(nvec=nvec, nkeep=nkeep) if nvec > 0 else None
+        self.chain = None
+        self.chain_sig = None
+        self.fwd_key = None
+
+    @staticmethod
+    def _signature(chain_descr):
+        sig = []
+        for [stage_id, pre_ops_descr, lmax, nside, iter_max, eps_min, tr, cache] in chain_descr:
+            sig.append((stage_id, tuple(pre_ops_descr), lmax, nside) + (() if stage_id == 0 else (iter_max, eps_min, id(tr))))
+        return sig
+
+    def get_chain(self, chain_descr, fwd_key=None):
+        """Returns the multigrid chain for this description, rebuilding the preconditioners only if needed
+
+            Args:
+                chain_descr: chain description
+                fwd_key: any identifier of the current forward operation. The recycled forward images are recomputed
+                         if this differs from that of the last call, or if None
+
+        """
+        sig = self._signature(chain_descr)
+        if self.chain is None or sig != self.chain_sig:
+            self.chain = multigrid_chain(self.opfilt, chain_descr, self.s_cls, self.n_inv_filt,
+                                         debug_log_prefix=self.debug_log_prefix, plogdepth=self.plogdepth)
+            self.chain_sig = sig
+            if self.recycler is not None:
+                self.recycler.reset()
+        else:
+            for [stage_id, pre_ops_descr, lmax, nside, iter_max, eps_min, tr, cache] in chain_descr:
+                if stage_id == 0:
+                    self.chain.bstage.iter_max = iter_max
+                    self.chain.bstage.eps_min = eps_min
+                    self.chain.bstage.tr = tr
+                    self.chain.bstage.cache = cache
+            self.chain.chain_descr = chain_descr
+        self.chain.recycler = self.recycler
+        if self.recycler is not None and (fwd_key is None or fwd_key != self.fwd_key):
+            self.recycler.invalidate()
+        self.fwd_key = fwd_key
+        return self.chain
+
+    def solve(self, chain_descr, soltn, tpn_map, dot_op=None, fwd_key=None, recycle=True):
+        """Solves the top stage of the chain, deflating with the Ritz vectors of the previous solves
+
+            Args:
+                fwd_key: identifier of the current forward operation (see *get_chain*)
+                recycle: the previous Ritz vectors are discarded if not set (recycling is worth it only if the forward
+                         operation did not change too much since these were harvested)
+
+        """
+        chain = self.get_chain(chain_descr, fwd_key=fwd_key)
+        if self.recycler is not None and not recycle:
+            self.recycler.reset()
+        chain.solve(soltn, tpn_map, dot_op=dot_op)
+
+
 def parse_pre_op_descr(pre_op_descr, **kwargs):
     if re.match("split\((.*),\s*(.*),\s*(.*)\)\Z", pre_op_descr):
         (low_descr, lsplit, hgh_descr) = re.match("split\((.*),\s*(.*),\s*(.*)\)\Z", pre_op_descr).groups()
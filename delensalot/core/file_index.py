@@ -0,0 +1,57 @@
+"""Existence index of the files of a set of directories.
+
+    Job collection checks the existence of many files (simulations x fields x libraries) on every rank, which on shared file systems
+    means as many metadata calls per rank. Instead, rank 0 lists each directory once with os.scandir and broadcasts the listing,
+    and the existence checks are then answered from memory.
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+
+import os
+
+from delensalot.core import mpi
+
+
+def _scan(directory):
+    try:
+        with os.scandir(directory) as entries:
+            return frozenset(entry.name for entry in entries)
+    except (FileNotFoundError, NotADirectoryError):
+        return frozenset()
+
+
+class file_index:
+    def __init__(self, dirs, collective=True):
+        """Lists the files of dirs, with one os.scandir per directory
+
+            Args:
+                dirs: directories to index
+                collective: if set and MPI is enabled, rank 0 lists the directories and broadcasts the listing. Must then be called by all ranks
+
+            Note:
+                The index is a snapshot, files written afterwards are only seen if added with add(), or by building a new index.
+
+        """
+        listing = None
+        if mpi.rank == 0 or not collective:
+            listing = {os.path.abspath(directory): _scan(directory) for directory in set(dirs)}
+        if collective and mpi.size > 1:
+            listing = mpi.bcast(listing)
+        self._listing = {directory: set(names) for directory, names in listing.items()}
+        log.debug('file_index: {} files in {} directories'.format(sum(len(names) for names in self._listing.values()), len(self._listing)))
+
+    def exists(self, path):
+        """Whether path exists. Paths outside the indexed directories are checked on the file system
+
+        """
+        directory, name = os.path.split(os.path.abspath(path))
+        if directory not in self._listing:
+            return os.path.exists(path)
+        return name in self._listing[directory]
+
+    def add(self, path):
+        directory, name = os.path.split(os.path.abspath(path))
+        if directory in self._listing:
+            self._listing[directory].add(name)
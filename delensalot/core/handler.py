@@ -6,7 +6,7 @@
 import os
 from os.path import join as opj
 import hashlib
-import datetime, getpass, copy
+import datetime, getpass
 
 import numpy as np
 import healpy as hp
@@ -28,7 +28,7 @@ from delensalot.utility.utils_hp import Alm, almxfl, alm_copy, gauss_beam, alm2c
 from delensalot.config.visitor import transform, transform3d
 from delensalot.config.metamodel import DEFAULT_NotAValue
 
-from delensalot.core import mpi
+from delensalot.core import mpi, scheduler, meanfield, pipeline, file_index
 from delensalot.core.mpi import check_MPI
 from delensalot.core.ivf import filt_util, filt_cinv, filt_simple
 
@@ -289,18 +289,19 @@ class Sim_generator(Basejob):
                 mpi.receive(None, source=mpi.ANY_SOURCE)
             
             simidxs_ = np.array(list(set(np.concatenate([self.simidxs, self.simidxs_mf]))), dtype=int)
+            index = file_index.file_index([self.libdir, self.libdir_sky])
             check_ = True  
             for simidx in simidxs_: # (2)
                 if self.k in ['p_p', 'p_eb', 'peb', 'p_be', 'pee']: 
-                    if not (os.path.exists(opj(self.libdir, self.fns['E'].format(simidx))) and os.path.exists(opj(self.libdir, self.fns['B'].format(simidx)))):
+                    if not (index.exists(opj(self.libdir, self.fns['E'].format(simidx))) and index.exists(opj(self.libdir, self.fns['B'].format(simidx)))):
                         check_ = False
                         break
                 elif self.k in ['ptt']:
-                    if not os.path.exists(opj(self.libdir, self.fns['T'].format(simidx))):
+                    if not index.exists(opj(self.libdir, self.fns['T'].format(simidx))):
                         check_ = False
                         break
                 elif self.k in ['p']:
-                    if not (os.path.exists(opj(self.libdir, self.fns['T'].format(simidx))) and os.path.exists(opj(self.libdir, self.fns['E'].format(simidx))) and os.path.exists(opj(self.libdir, self.fns['B'].format(simidx)))):
+                    if not (index.exists(opj(self.libdir, self.fns['T'].format(simidx))) and index.exists(opj(self.libdir, self.fns['E'].format(simidx))) and index.exists(opj(self.libdir, self.fns['B'].format(simidx)))):
                         check_ = False
                         break
             if check_: # (3)
@@ -314,15 +315,15 @@ class Sim_generator(Basejob):
                 check_ = True  
                 for simidx in simidxs_: # (2)
                     if self.k in ['p_p', 'p_eb', 'peb', 'p_be', 'pee']: 
-                        if not (os.path.exists(opj(self.libdir_sky, self.fns_sky['E'].format(simidx))) and os.path.exists(opj(self.libdir_sky, self.fns_sky['B'].format(simidx)))):
+                        if not (index.exists(opj(self.libdir_sky, self.fns_sky['E'].format(simidx))) and index.exists(opj(self.libdir_sky, self.fns_sky['B'].format(simidx)))):
                             check_ = False
                             break
                     elif self.k in ['ptt']:
-                        if not os.path.exists(opj(self.libdir_sky, self.fns_sky['T'].format(simidx))):
+                        if not index.exists(opj(self.libdir_sky, self.fns_sky['T'].format(simidx))):
                             check_ = False
                             break
                     elif self.k in ['p']:
-                        if not (os.path.exists(opj(self.libdir_sky, self.fns_sky['T'].format(simidx))) and os.path.exists(opj(self.libdir_sky, self.fns_sky['E'].format(simidx))) and os.path.exists(opj(self.libdir_sky, self.fns_sky['B'].format(simidx)))):
+                        if not (index.exists(opj(self.libdir_sky, self.fns_sky['T'].format(simidx))) and index.exists(opj(self.libdir_sky, self.fns_sky['E'].format(simidx))) and index.exists(opj(self.libdir_sky, self.fns_sky['B'].format(simidx)))):
                             check_ = False
                             break
                 if check_: # (3)
@@ -356,6 +357,7 @@ class Sim_generator(Basejob):
     def collect_jobs(self):
         jobs = list(range(len(['generate_sky', 'generate_obs'])))
         if np.all(self.simulationdata.maps == DEFAULT_NotAValue) and self.simulationdata.flavour != 'obs':
+            index = file_index.file_index([self.libdir, self.libdir_sky])
             for taski, task in enumerate(['generate_sky', 'generate_obs']):
                 _jobs = []
                 simidxs_ = np.array(list(set(np.concatenate([self.simidxs, self.simidxs_mf]))), dtype=int)
@@ -364,17 +366,17 @@ class Sim_generator(Basejob):
                         if self.k in ['p_p', 'p_eb', 'peb', 'p_be', 'pee']:
                             fnQ = opj(self.libdir_sky, self.fns_sky['E'].format(simidx))
                             fnU = opj(self.libdir_sky, self.fns_sky['B'].format(simidx))
-                            if not os.path.isfile(fnQ) or not os.path.isfile(fnU) or not os.path.exists(opj(self.libdir_sky, self.fnsP.format(simidx))):
+                            if not index.exists(fnQ) or not index.exists(fnU) or not index.exists(opj(self.libdir_sky, self.fnsP.format(simidx))):
                                 _jobs.append(simidx)
                         elif self.k in ['ptt']:
                             fnT = opj(self.libdir_sky, self.fns_sky['T'].format(simidx))
-                            if not os.path.isfile(fnT) or not os.path.exists(opj(self.libdir_sky, self.fnsP.format(simidx))):
+                            if not index.exists(fnT) or not index.exists(opj(self.libdir_sky, self.fnsP.format(simidx))):
                                 _jobs.append(simidx)
                         elif self.k in ['p']:
                             fnT = opj(self.libdir_sky, self.fns_sky['T'].format(simidx))
                             fnQ = opj(self.libdir_sky, self.fns_sky['E'].format(simidx))
                             fnU = opj(self.libdir_sky, self.fns_sky['B'].format(simidx))
-                            if not os.path.isfile(fnT) or not os.path.isfile(fnQ) or not os.path.isfile(fnU) or not os.path.exists(opj(self.libdir_sky, self.fnsP.format(simidx))):
+                            if not index.exists(fnT) or not index.exists(fnQ) or not index.exists(fnU) or not index.exists(opj(self.libdir_sky, self.fnsP.format(simidx))):
                                 _jobs.append(simidx)
 
                 if task == 'generate_obs':
@@ -382,17 +384,17 @@ class Sim_generator(Basejob):
                         if self.k in ['p_p', 'p_eb', 'peb', 'p_be', 'pee']:
                             fnQ = opj(self.libdir, self.fns['E'].format(simidx))
                             fnU = opj(self.libdir, self.fns['B'].format(simidx))
-                            if not os.path.isfile(fnQ) or not os.path.isfile(fnU):
+                            if not index.exists(fnQ) or not index.exists(fnU):
                                 _jobs.append(simidx)
                         elif self.k in ['ptt']:
                             fnT = opj(self.libdir, self.fns['T'].format(simidx))
-                            if not os.path.isfile(fnT):
+                            if not index.exists(fnT):
                                 _jobs.append(simidx)
                         elif self.k in ['p']:
                             fnT = opj(self.libdir, self.fns['T'].format(simidx))
                             fnQ = opj(self.libdir, self.fns['E'].format(simidx))
                             fnU = opj(self.libdir, self.fns['B'].format(simidx))
-                            if not os.path.isfile(fnT) or not os.path.isfile(fnQ) or not os.path.isfile(fnU):
+                            if not index.exists(fnT) or not index.exists(fnQ) or not index.exists(fnU):
                                 _jobs.append(simidx)          
                 jobs[taski] = _jobs
             self.jobs = jobs
@@ -405,69 +407,124 @@ class Sim_generator(Basejob):
     @log_on_start(logging.DEBUG, "Sim.run() started")
     @log_on_end(logging.DEBUG, "Sim.run() finished")
     def run(self):
-        for taski, task in enumerate(['generate_sky', 'generate_obs']):
-            for simidx in self.jobs[taski][mpi.rank::mpi.size]:
-                log.info("rank {} (size {}) generating sim {}".format(mpi.rank, mpi.size, simidx))
-                if task == 'generate_sky':
-                    self.generate_sky(simidx)
-                if task == 'generate_obs':
-                    self.generate_obs(simidx)
-                if self.simulationdata.obs_lib.maps == DEFAULT_NotAValue:
-                    self.simulationdata.purgecache()
+        if len(self.jobs[1]) > 0 and hasattr(getattr(self.simulationdata, 'noise_lib', None), 'generate_phases'):
+            self.simulationdata.noise_lib.generate_phases(np.array(list(set(np.concatenate([self.simidxs, self.simidxs_mf]))), dtype=int))
+        graph = scheduler.task_graph()
+        for chunk in range(len(self.get_pipeline_chunks())):
+            graph.add(('generate_pipelined', chunk))
+        scheduler.run(self, graph)
         if np.all(self.simulationdata.maps == DEFAULT_NotAValue):
             self.postrun_sky()
             self.postrun_obs()
 
 
-    @log_on_start(logging.DEBUG, "Sim.generate_sim(simidx={simidx}) started")
-    @log_on_end(logging.DEBUG, "Sim.generate_sim(simidx={simidx}) finished")
-    def generate_sky(self, simidx):
+    @log_on_start(logging.DEBUG, "Sim.run_task(task={task}, simidx={simidx}) started")
+    @log_on_end(logging.DEBUG, "Sim.run_task(task={task}, simidx={simidx}) finished")
+    def run_task(self, task, simidx):
+        log.info("rank {} (size {}) running {} {}".format(mpi.rank, mpi.size, task, simidx))
+        if task == 'generate_sky':
+            self.generate_sky(simidx)
+        if task == 'generate_obs':
+            self.generate_obs(simidx)
+        if task == 'generate_pipelined':
+            self.generate_pipelined(self.get_pipeline_chunks()[simidx])
+
+
+    def get_fields(self):
+        return {'p_p': ['polarization'], 'p_eb': ['polarization'], 'peb': ['polarization'], 'p_be': ['polarization'], 'pee': ['polarization'],
+                'ptt': ['temperature'], 'p': ['polarization', 'temperature']}[self.k]
+
+
+    def get_sky_outputs(self, simidx):
+        """Lensing potential and lensed sky alms of simidx which are not on disk yet, as {path: array}
+
+        """
+        ret = dict()
         if not os.path.exists(opj(self.libdir_sky, self.fnsP.format(simidx))):
-            phi = self.simulationdata.get_sim_phi(simidx, space='alm')
-            np.save(opj(self.libdir_sky, self.fnsP.format(simidx)), phi)
-        if self.k in ['p_p', 'p_eb', 'peb', 'p_be', 'pee']:
-            if not (os.path.exists(opj(self.libdir_sky, self.fns_sky['E'].format(simidx))) and os.path.exists(opj(self.libdir_sky, self.fns_sky['B'].format(simidx)))):
-                EBsky = self.simulationdata.get_sim_sky(simidx, spin=0, space='alm', field='polarization')
-                np.save(opj(self.libdir_sky, self.fns_sky['E'].format(simidx)), EBsky[0])
-                np.save(opj(self.libdir_sky, self.fns_sky['B'].format(simidx)), EBsky[1])
+            ret[opj(self.libdir_sky, self.fnsP.format(simidx))] = self.simulationdata.get_sim_phi(simidx, space='alm')
+        for field in self.get_fields():
+            if field == 'polarization':
+                if not (os.path.exists(opj(self.libdir_sky, self.fns_sky['E'].format(simidx))) and os.path.exists(opj(self.libdir_sky, self.fns_sky['B'].format(simidx)))):
+                    EBsky = self.simulationdata.get_sim_sky(simidx, spin=0, space='alm', field='polarization')
+                    ret[opj(self.libdir_sky, self.fns_sky['E'].format(simidx))] = EBsky[0]
+                    ret[opj(self.libdir_sky, self.fns_sky['B'].format(simidx))] = EBsky[1]
+            elif field == 'temperature':
+                if not os.path.exists(opj(self.libdir_sky, self.fns_sky['T'].format(simidx))):
+                    ret[opj(self.libdir_sky, self.fns_sky['T'].format(simidx))] = self.simulationdata.get_sim_sky(simidx, spin=0, space='alm', field='temperature')
+        return ret
 
-        elif self.k in ['ptt']:
-            if not os.path.exists(opj(self.libdir_sky, self.fns_sky['T'].format(simidx))):
-                Tsky = self.simulationdata.get_sim_sky(simidx, spin=0, space='alm', field='temperature')
-                np.save(opj(self.libdir_sky, self.fns_sky['T'].format(simidx)), Tsky)
 
-        elif self.k in ['p']:
-            if not (os.path.exists(opj(self.libdir_sky, self.fns_sky['E'].format(simidx))) and os.path.exists(opj(self.libdir_sky, self.fns_sky['B'].format(simidx)))):
-                EBsky = self.simulationdata.get_sim_sky(simidx, spin=0, space='alm', field='polarization')
-                np.save(opj(self.libdir_sky, self.fns_sky['E'].format(simidx)), EBsky[0])
-                np.save(opj(self.libdir_sky, self.fns_sky['B'].format(simidx)), EBsky[1])
-            if not os.path.exists(opj(self.libdir_sky, self.fns_sky['T'].format(simidx))):
-                Tsky = self.simulationdata.get_sim_sky(simidx, spin=0, space='alm', field='temperature')
-                np.save(opj(self.libdir_sky, self.fns_sky['T'].format(simidx)), Tsky)
+    def get_obs_outputs(self, simidx):
+        """Observed alms of simidx which are not on disk yet, as {path: array}
+
+        """
+        ret = dict()
+        for field in self.get_fields():
+            if field == 'polarization':
+                if not (os.path.exists(opj(self.libdir, self.fns['E'].format(simidx))) and os.path.exists(opj(self.libdir, self.fns['B'].format(simidx)))):
+                    EBobs = self.simulationdata.get_sim_obs(simidx, spin=0, space='alm', field='polarization')
+                    ret[opj(self.libdir, self.fns['E'].format(simidx))] = EBobs[0]
+                    ret[opj(self.libdir, self.fns['B'].format(simidx))] = EBobs[1]
+            elif field == 'temperature':
+                if not os.path.exists(opj(self.libdir, self.fns['T'].format(simidx))):
+                    ret[opj(self.libdir, self.fns['T'].format(simidx))] = self.simulationdata.get_sim_obs(simidx, spin=0, space='alm', field='temperature')
+        return ret
+
+
+    @log_on_start(logging.DEBUG, "Sim.generate_sim(simidx={simidx}) started")
+    @log_on_end(logging.DEBUG, "Sim.generate_sim(simidx={simidx}) finished")
+    def generate_sky(self, simidx):
+        for path, arr in self.get_sky_outputs(simidx).items():
+            np.save(path, arr)
 
 
     @log_on_start(logging.DEBUG, "Sim.generate_sim(simidx={simidx}) started")
     @log_on_end(logging.DEBUG, "Sim.generate_sim(simidx={simidx}) finished")
     def generate_obs(self, simidx):
-        if self.k in ['p_p', 'p_eb', 'peb', 'p_be', 'pee']:
-            if not (os.path.exists(opj(self.libdir, self.fns['E'].format(simidx))) and os.path.exists(opj(self.libdir, self.fns['B'].format(simidx)))):
-                EBobs = self.simulationdata.get_sim_obs(simidx, spin=0, space='alm', field='polarization')
-                np.save(opj(self.libdir, self.fns['E'].format(simidx)), EBobs[0])
-                np.save(opj(self.libdir, self.fns['B'].format(simidx)), EBobs[1])
+        for path, arr in self.get_obs_outputs(simidx).items():
+            np.save(path, arr)
 
-        elif self.k in ['ptt']:
-            if not os.path.exists(opj(self.libdir, self.fns['T'].format(simidx))):
-                Tobs = self.simulationdata.get_sim_obs(simidx, spin=0, space='alm', field='temperature')
-                np.save(opj(self.libdir, self.fns['T'].format(simidx)), Tobs)
 
-        elif self.k in ['p']:
-            if not (os.path.exists(opj(self.libdir, self.fns['E'].format(simidx))) and os.path.exists(opj(self.libdir, self.fns['B'].format(simidx)))):
-                EBobs = self.simulationdata.get_sim_obs(simidx, spin=0, space='alm', field='polarization')
-                np.save(opj(self.libdir, self.fns['E'].format(simidx)), EBobs[0])
-                np.save(opj(self.libdir, self.fns['B'].format(simidx)), EBobs[1])
-            if not os.path.exists(opj(self.libdir, self.fns['T'].format(simidx))):
-                Tobs = self.simulationdata.get_sim_obs(simidx, spin=0, space='alm', field='temperature')
-                np.save(opj(self.libdir, self.fns['T'].format(simidx)), Tobs)
+    @log_on_start(logging.DEBUG, "Sim.generate_pipelined(simidxs={simidxs}) started")
+    @log_on_end(logging.DEBUG, "Sim.generate_pipelined(simidxs={simidxs}) finished")
+    def generate_pipelined(self, simidxs):
+        """Generates the simulations simidxs through a pipeline of threads: unlensed draw -> lensing -> observation -> write to disk
+
+            The random draws all happen in the first stage. The writes of the last stage overlap with the lensing of the next simulations.
+
+        """
+        sky_jobs, obs_jobs = set(self.jobs[0]), set(self.jobs[1])
+        def draw(simidx, data):
+            for field in self.get_fields():
+                if self.simulationdata.flavour != 'sky':
+                    self.simulationdata.get_sim_phi(simidx, space='alm')
+                    self.simulationdata.get_sim_unl(simidx, space='alm', field=field, spin=0)
+                if simidx in obs_jobs:
+                    self.simulationdata.get_sim_noise(simidx, space='alm', field=field, spin=0)
+            return dict()
+        def lens(simidx, data):
+            if simidx in sky_jobs:
+                data.update(self.get_sky_outputs(simidx))
+            return data
+        def observe(simidx, data):
+            if simidx in obs_jobs:
+                data.update(self.get_obs_outputs(simidx))
+            return data
+        def write(simidx, data):
+            for path, arr in data.items():
+                np.save(path, arr)
+        pipeline.run([pipeline.stage('draw', draw), pipeline.stage('lensing', lens), pipeline.stage('obs', observe), pipeline.stage('write', write)], simidxs)
+
+
+    def get_pipeline_chunks(self):
+        """Simulations to generate, split into one chunk per worker process, each chunk being generated by one pipeline
+
+        """
+        simidxs_ = sorted(set(self.jobs[0]) | set(self.jobs[1]))
+        nworkers = mpi.size - 1 if mpi.size > 1 else (scheduler.nprocs if scheduler.backend == 'pool' else 1)
+        nchunks = max(1, min(nworkers, len(simidxs_)))
+        return [[int(simidx) for simidx in simidxs_[i::nchunks]] for i in range(nchunks)] if len(simidxs_) > 0 else []
+
 
     def postrun_obs(self):
         # we always enter postrun, even from other jobs (like QE_lensrec). So making sure we are not accidently overwriting libdirs and fns
@@ -625,6 +682,11 @@ class QE_lr(Basejob):
                 self.init_aniso_filter()
 
         self.mf = lambda simidx: self.get_meanfield(int(simidx))
+        ## meanfield sum and per-sim QE, for the leave-one-out meanfields
+        if getattr(self, 'mfvar', None) == None:
+            self.mf_store = meanfield.mf_store(self.simidxs_mf, lambda simidx, k: self.qlms_dd.get_sim_qlm(k, simidx), get_mf=lambda k: self.qlms_dd.get_sim_qlm_mf(k, self.simidxs_mf))
+        else:
+            self.mf_store = meanfield.mf_store(self.simidxs_mf, lambda simidx, k: self.qlms_dd_mfvar.get_sim_qlm(k, simidx), get_mf=lambda k: hp.read_alm(self.mfvar))
         self.plm = lambda simidx: self.get_plm(simidx, self.QE_subtract_meanfield)
         self.R_unl = lambda: qresp.get_response(self.k, self.lm_max_ivf[0], self.k[0], self.cls_unl, self.cls_unl,  self.ftebl_unl, lmax_qlm=self.lm_max_qlm[0])[0]
 
@@ -671,6 +733,10 @@ class QE_lr(Basejob):
 
         # qe_tasks overwrites task-list and is needed if MAP lensrec calls QE lensrec
         jobs = list(range(len(self.qe_tasks)))
+        dirs = [opj(self.libdir_QE, 'qlms_dd')]
+        if 'calc_blt' in self.qe_tasks:
+            dirs += [self.libdir_blt(simidx) for simidx in self.simidxs]
+        index = file_index.file_index(dirs)
         for taski, task in enumerate(self.qe_tasks):
             ## task_dependence
             ## calc_mf -> calc_phi, calc_blt -> calc_phi, (calc_mf)
@@ -681,18 +747,18 @@ class QE_lr(Basejob):
                 ## this filename must match plancklens filename
                 fn_mf = opj(self.libdir_QE, 'qlms_dd/simMF_k1%s_%s.fits' % (self.k, pl_utils.mchash(self.simidxs_mf)))
                 ## Skip if meanfield already calculated
-                if not os.path.isfile(fn_mf) or recalc:
+                if not index.exists(fn_mf) or recalc:
                     for simidx in np.array(list(set(np.concatenate([self.simidxs, self.simidxs_mf]))), dtype=int):
                         fn_qlm = opj(opj(self.libdir_QE, 'qlms_dd'), 'sim_%s_%04d.fits'%(self.k, simidx) if simidx != -1 else 'dat_%s.fits'%self.k)
-                        if not os.path.isfile(fn_qlm) or recalc:
+                        if not index.exists(fn_qlm) or recalc:
                             _jobs.append(simidx)
 
             if task == 'calc_meanfield':
                 fn_mf = opj(self.libdir_QE, 'qlms_dd/simMF_k1%s_%s.fits' % (self.k, pl_utils.mchash(self.simidxs_mf)))
-                if not os.path.isfile(fn_mf) or recalc:
+                if not index.exists(fn_mf) or recalc:
                     for simidx in self.simidxs_mf:
                         fn_qlm = opj(opj(self.libdir_QE, 'qlms_dd'), 'sim_%s_%04d.fits'%(self.k, simidx) if simidx != -1 else 'dat_%s.fits'%self.k)
-                        if not os.path.isfile(fn_qlm) or recalc:
+                        if not index.exists(fn_qlm) or recalc:
                             _jobs.append(int(simidx))
 
             ## Calculate B-lensing template
@@ -700,7 +766,7 @@ class QE_lr(Basejob):
                 for simidx in self.simidxs:
                     ## this filename must match the one created in get_template_blm()
                     fn_blt = opj(self.libdir_blt(simidx), 'blt_%s_%04d_p%03d_e%03d_lmax%s'%(self.k, simidx, 0, 0, self.lm_max_blt[0]) + 'perturbative' * self.blt_pert + '.npy')
-                    if not os.path.isfile(fn_blt) or recalc:
+                    if not index.exists(fn_blt) or recalc:
                         _jobs.append(simidx)
 
             jobs[taski] = _jobs
@@ -741,38 +807,42 @@ class QE_lr(Basejob):
                 self.init_aniso_filter()
                         
         _tasks = self.qe_tasks if task is None else [task]
+        ## task dependence: calc_plm -> calc_qlm (all, if meanfield subtracted), calc_meanfield -> calc_qlm (meanfield sims), calc_blt -> calc_plm, calc_meanfield
+        graph = scheduler.task_graph()
         for taski, task in enumerate(_tasks):
-            log.info('{}, task {} started'.format(mpi.rank, task))
-
+            log.info('{}, task {} scheduled'.format(mpi.rank, task))
             if task == 'calc_phi':
-                for idx in self.jobs[taski][mpi.rank::mpi.size]:
-                    self.qlms_dd.get_sim_qlm(self.k, int(idx))
-                    if self.simulationdata.obs_lib.maps == DEFAULT_NotAValue:
-                        self.simulationdata.purgecache()
-                mpi.barrier()
-                for idx in self.jobs[taski][mpi.rank::mpi.size]:
-                    self.get_plm(idx, self.QE_subtract_meanfield)
-                    if self.simulationdata.obs_lib.maps == DEFAULT_NotAValue:
-                        self.simulationdata.purgecache()
-                
+                for idx in self.jobs[taski]:
+                    graph.add(('calc_qlm', int(idx)))
+                for idx in self.jobs[taski]:
+                    graph.add(('calc_plm', int(idx)), deps=graph.select('calc_qlm') if self.QE_subtract_meanfield else [('calc_qlm', int(idx))])
 
             if task == 'calc_meanfield':
                 if len(self.jobs[taski])>0:
-                    log.debug('{} finished qe ivfs tasks. Waiting for all ranks to start mf calculation'.format(mpi.rank))
-                    mpi.barrier()
-                    log.debug("Done waiting. Rank 0 going to calculate meanfield-file.. everyone else waiting.")
-                    if mpi.rank == 0:
-                        self.get_meanfield(int(idx))
-                        log.debug("rank 0 finished calculating meanfield-file.. everyone else waiting.")
-                    mpi.barrier()
+                    graph.add(('calc_meanfield', int(self.jobs[taski][-1])), deps=[('calc_qlm', int(simidx)) for simidx in self.simidxs_mf])
 
             if task == 'calc_blt':
-                for simidx in self.jobs[taski][mpi.rank::mpi.size]:
-                    # ## Faking here MAP filters
-                    self.itlib_iterator = transform(self.MAP_job, iterator_transformer(self.MAP_job, simidx, self.dlensalot_model))
-                    self.get_blt(simidx)
-                    if self.simulationdata.obs_lib.maps == DEFAULT_NotAValue:
-                        self.simulationdata.purgecache()
+                for simidx in self.jobs[taski]:
+                    graph.add(('calc_blt', int(simidx)), deps=[('calc_plm', int(simidx))] + graph.select('calc_meanfield'))
+        scheduler.run(self, graph)
+
+
+    @log_on_start(logging.DEBUG, "QE.run_task(task={task}, simidx={simidx}) started")
+    @log_on_end(logging.DEBUG, "QE.run_task(task={task}, simidx={simidx}) finished")
+    def run_task(self, task, simidx):
+        if task == 'calc_qlm':
+            self.qlms_dd.get_sim_qlm(self.k, simidx)
+
+        if task == 'calc_plm':
+            self.get_plm(simidx, self.QE_subtract_meanfield)
+
+        if task == 'calc_meanfield':
+            self.get_meanfield(simidx)
+
+        if task == 'calc_blt':
+            # ## Faking here MAP filters
+            self.itlib_iterator = transform(self.MAP_job, iterator_transformer(self.MAP_job, simidx, self.dlensalot_model))
+            self.get_blt(simidx)
 
 
     # @base_exception_handler
@@ -807,19 +877,9 @@ class QE_lr(Basejob):
     @log_on_start(logging.DEBUG, "QE.get_meanfield(simidx={simidx}) started")
     @log_on_end(logging.DEBUG, "QE.get_meanfield(simidx={simidx}) finished")
     def get_meanfield(self, simidx):
-        ret = np.zeros_like(self.qlms_dd.get_sim_qlm(self.k, 0))
         if self.Nmf > 1:
-            if self.mfvar == None:
-                ret = self.qlms_dd.get_sim_qlm_mf(self.k, [int(simidx_mf) for simidx_mf in self.simidxs_mf])
-                if simidx in self.simidxs_mf:    
-                    ret = (ret - self.qlms_dd.get_sim_qlm(self.k, int(simidx)) / self.Nmf) * (self.Nmf / (self.Nmf - 1))
-            else:
-                ret = hp.read_alm(self.mfvar)
-                if simidx in self.simidxs_mf:    
-                    ret = (ret - self.qlms_dd_mfvar.get_sim_qlm(self.k, int(simidx)) / self.Nmf) * (self.Nmf / (self.Nmf - 1))
-            return ret
-        
-        return ret
+            return self.mf_store.get_mf_loo(simidx, self.k)
+        return np.zeros_like(self.qlms_dd.get_sim_qlm(self.k, 0))
         
 
     # @base_exception_handler
@@ -884,7 +944,7 @@ class QE_lr(Basejob):
     @log_on_start(logging.DEBUG, "QE.get_meanfield_normalized(simidx={simidx}) started")
     @log_on_end(logging.DEBUG, "QE.get_meanfield_normalized(simidx={simidx}) finished")
     def get_meanfield_normalized(self, simidx):
-        mf_QE = copy.deepcopy(self.get_meanfield(simidx))
+        mf_QE = self.get_meanfield(simidx) # a new array, safe to modify inplace
         R = qresp.get_response(self.k, self.lm_max_ivf[0], 'p', self.cls_len, self.cls_len, self.ftebl_len, lmax_qlm=self.lm_max_qlm[0])[0]
         WF = self.cpp * pl_utils.cli(self.cpp + pl_utils.cli(R))
         almxfl(mf_QE, pl_utils.cli(R), self.lm_max_qlm[1], True) # Normalized QE
@@ -894,16 +954,21 @@ class QE_lr(Basejob):
         return mf_QE
 
 
+    def fn_blt(self, simidx):
+        return opj(self.libdir_blt(simidx), 'blt_%s_%04d_p%03d_e%03d_lmax%s'%(self.k, simidx, 0, 0, self.lm_max_blt[0]) + 'perturbative' * self.blt_pert + '.npy')
+
+
     # @base_exception_handler
     @log_on_start(logging.DEBUG, "QE.get_blt({simidx}) started")
     @log_on_end(logging.DEBUG, "QE.get_blt({simidx}) finished")
     def get_blt(self, simidx):
-        fn_blt = opj(self.libdir_blt(simidx), 'blt_%s_%04d_p%03d_e%03d_lmax%s'%(self.k, simidx, 0, 0, self.lm_max_blt[0]) + 'perturbative' * self.blt_pert + '.npy')
+        fn_blt = self.fn_blt(simidx)
         if not os.path.exists(fn_blt):
             ## For QE, dlm_mod by construction doesn't do anything, because mean-field had already been subtracted from plm and we don't want to repeat that.
             dlm_mod = np.zeros_like(self.qlms_dd.get_sim_qlm(self.k, int(simidx)))
             blt = self.itlib_iterator.get_template_blm(0, 0, lmaxb=self.lm_max_blt[0], lmin_plm=self.Lmin, dlm_mod=dlm_mod, perturbative=self.blt_pert, k=self.k)
             np.save(fn_blt, blt)
+            return blt
         return np.load(fn_blt)
     
 
@@ -982,6 +1047,10 @@ class MAP_lr(Basejob):
         if "calc_meanfield" in self.it_tasks or 'calc_blt' in self.it_tasks:
             if not os.path.isdir(self.mf_dirname) and mpi.rank == 0:
                 os.makedirs(self.mf_dirname)
+            ## meanfield sum, for the leave-one-out meanfields. The per-sim plms are read from the cumulative plm checkpoints of the iterator
+            self.mf_store = meanfield.mf_store(self.simidxs_mf, lambda simidx, it: rec.load_plms(self.libdir_MAP(self.k, simidx, self.version), [it])[0], get_mf=self.get_meanfield_it)
+        else:
+            self.mf_store = None
 
         # sims -> sims_MAP
         if self.it_filter_directional == 'anisotropic':
@@ -1038,43 +1107,63 @@ class MAP_lr(Basejob):
     @log_on_start(logging.DEBUG, "MAP.run() started")
     @log_on_end(logging.DEBUG, "MAP.run() finished")
     def run(self):
+        ## task dependence: calc_meanfield -> calc_phi (meanfield sims), calc_blt -> calc_phi, calc_meanfield
+        graph = scheduler.task_graph()
         for taski, task in enumerate(self.it_tasks):
-            log.info('{}, task {} started, jobs: {}'.format(mpi.rank, task, self.jobs[taski]))
+            log.info('{}, task {} scheduled, jobs: {}'.format(mpi.rank, task, self.jobs[taski]))
             if task == 'calc_phi':
-                for simidx in self.jobs[taski][mpi.rank::mpi.size]:
-                    libdir_MAPidx = self.libdir_MAP(self.k, simidx, self.version)
-                    if self.itmax >= 0 and rec.maxiterdone(libdir_MAPidx) < self.itmax:
-                        itlib_iterator = transform(self, iterator_transformer(self, simidx, self.dlensalot_model))
-                        for it in range(self.itmax + 1):
-                            itlib_iterator.chain_descr = self.it_chain_descr(self.lm_max_unl[0], self.it_cg_tol(it))
-                            itlib_iterator.soltn_cond = self.soltn_cond(it)
-                            itlib_iterator.iterate(it, 'p')
-                            log.info('{}, simidx {} done with it {}'.format(mpi.rank, simidx, it))
-                    # If data is in memory only, don't purge simslib
-                    if type(self.simulationdata.obs_lib.maps) == np.array:
-                        pass
-                    else:
-                        if self.simulationdata.obs_lib.maps == DEFAULT_NotAValue:
-                            self.simulationdata.purgecache()
+                for simidx in self.jobs[taski]:
+                    graph.add(('calc_phi', int(simidx)))
 
-            if task == 'calc_meanfield':
-                # TODO I don't like barriers and not sure if they are still needed
-                mpi.barrier()
-                self.get_meanfields_it(np.arange(self.itmax+1), calc=True)
-                mpi.barrier()
+            if task == 'calc_meanfield' and len(self.simidxs_mf) > 0:
+                ## partial sums over chunks of the meanfield sims, then a single task combining them for all iterations
+                nchunks = self.get_meanfield_nchunks()
+                for chunk in range(nchunks):
+                    graph.add(('calc_meanfield_partial', chunk), deps=[('calc_phi', int(simidx)) for simidx in self.simidxs_mf[chunk::nchunks]])
+                graph.add(('calc_meanfield', nchunks), deps=graph.select('calc_meanfield_partial'))
 
             if task == 'calc_blt':
-                for simidx in self.jobs[taski][mpi.rank::mpi.size]:
-                    self.libdir_MAPidx = self.libdir_MAP(self.k, simidx, self.version)
-                    self.itlib_iterator = transform(self, iterator_transformer(self, simidx, self.dlensalot_model))
-                    for it in range(self.itmax + 1):
-                        self.get_blt_it(simidx, it)
-                    # If data is in memory only, don't purge simslib
-                    if type(self.simulationdata.obs_lib.maps) == np.array:
-                        pass
-                    else:
-                        if self.simulationdata.obs_lib.maps == DEFAULT_NotAValue:
-                            self.simulationdata.purgecache()
+                for simidx in self.jobs[taski]:
+                    graph.add(('calc_blt', int(simidx)), deps=[('calc_phi', int(simidx))] + graph.select('calc_meanfield'))
+        scheduler.run(self, graph)
+
+
+    @log_on_start(logging.DEBUG, "MAP.run_task(task={task}, simidx={simidx}) started")
+    @log_on_end(logging.DEBUG, "MAP.run_task(task={task}, simidx={simidx}) finished")
+    def run_task(self, task, simidx):
+        """Executes a single task. For calc_meanfield_partial, *simidx* is the chunk index, and for calc_meanfield the number of chunks.
+
+        """
+        if task == 'calc_phi':
+            libdir_MAPidx = self.libdir_MAP(self.k, simidx, self.version)
+            if self.itmax >= 0 and rec.maxiterdone(libdir_MAPidx) < self.itmax:
+                itlib_iterator = transform(self, iterator_transformer(self, simidx, self.dlensalot_model))
+                for it in range(self.itmax + 1):
+                    itlib_iterator.chain_descr = self.it_chain_descr(self.lm_max_unl[0], self.it_cg_tol(it))
+                    itlib_iterator.soltn_cond = self.soltn_cond(it)
+                    itlib_iterator.iterate(it, 'p')
+                    log.info('{}, simidx {} done with it {}'.format(mpi.rank, simidx, it))
+
+        if task == 'calc_meanfield_partial':
+            its = np.arange(self.itmax + 1)
+            np.save(self.fn_meanfield_partial(simidx), self.get_meanfield_partial(self.simidxs_mf[simidx::self.get_meanfield_nchunks()], its))
+            return
+
+        if task == 'calc_meanfield':
+            its = np.arange(self.itmax + 1)
+            mf = None
+            for chunk in range(simidx):
+                partial = np.load(self.fn_meanfield_partial(chunk))
+                mf = partial if mf is None else mf + partial
+            self.save_meanfields(its, mf)
+            for chunk in range(simidx):
+                os.remove(self.fn_meanfield_partial(chunk))
+            return
+
+        if task == 'calc_blt':
+            self.libdir_MAPidx = self.libdir_MAP(self.k, simidx, self.version)
+            self.itlib_iterator = transform(self, iterator_transformer(self, simidx, self.dlensalot_model))
+            self.get_blts_it(simidx, np.arange(self.itmax + 1))
 
 
     # # @base_exception_handler
@@ -1087,64 +1176,157 @@ class MAP_lr(Basejob):
         return plms
     
 
+    def get_meanfield_nchunks(self):
+        """Number of partial sums the meanfield calculation of MAP.run() is split into, i.e. about the number of processes working on it
+
+        """
+        if mpi.size > 1:
+            nprocs = mpi.size - 1
+        elif scheduler.backend == 'pool':
+            nprocs = scheduler.nprocs
+        else:
+            nprocs = 1
+        return max(1, min(nprocs, len(self.simidxs_mf)))
+
+
+    def fn_meanfield(self, it):
+        return opj(self.mf_dirname, 'mf%03d_it%03d.npy'%(self.Nmf, it))
+
+
+    def fn_meanfield_partial(self, chunk):
+        return opj(self.mf_dirname, 'mf%03d_partial%03d.npy'%(self.Nmf, chunk))
+
+
+    @log_on_start(logging.DEBUG, "MAP.get_meanfield_partial(simidxs={simidxs}, its={its}) started")
+    @log_on_end(logging.DEBUG, "MAP.get_meanfield_partial(simidxs={simidxs}, its={its}) finished")
+    def get_meanfield_partial(self, simidxs, its):
+        """Sum of the plms of *simidxs*, for all iterations *its* at once
+
+            Each simulation is read in a single pass over its BFGS steps.
+
+            Returns:
+                array of shape (len(its), nalm)
+
+        """
+        its = np.atleast_1d(its)
+        mf = None
+        for simidx in simidxs:
+            log.info("its {}: adding sim {:03d}/{}".format(list(its), simidx, self.Nmf-1))
+            plms = rec.load_plms(self.libdir_MAP(self.k, simidx, self.version), its)
+            assert len(plms) == len(its), "sim {}: could only load {} of iterations {}".format(simidx, len(plms), list(its))
+            if mf is None:
+                mf = np.zeros((len(its), *plms[0].shape), dtype=np.complex128)
+            for iti, plm in enumerate(plms):
+                mf[iti] += plm
+        return mf
+
+
+    def save_meanfields(self, its, mf):
+        """Stores the sums *mf* of the Nmf meanfield sims as the meanfields of iterations *its*
+
+        """
+        for iti, it in enumerate(its):
+            np.save(self.fn_meanfield(it), mf[iti]/self.Nmf)
+            if self.mf_store is not None:
+                self.mf_store.purge(it)
+
+
     # # @base_exception_handler
     @log_on_start(logging.DEBUG, "MAP.get_meanfield_it(it={it}, calc={calc}) started")
     @log_on_end(logging.DEBUG, "MAP.get_meanfield_it(it={it}, calc={calc}) finished")
     def get_meanfield_it(self, it, calc=False):
-        fn = opj(self.mf_dirname, 'mf%03d_it%03d.npy'%(self.Nmf, it))
-        if not calc:
-            if os.path.isfile(fn):
-                mf = np.load(fn)
-            else:
-                mf = self.get_meanfield_it(self, it, calc=True)
-        else:
-            plm = rec.load_plms(self.libdir_MAP(self.k, self.simidxs[0], self.version), [0])[-1]
-            mf = np.zeros_like(plm)
-            for simidx in self.simidxs_mf:
-                log.info("it {:02d}: adding sim {:03d}/{}".format(it, simidx, self.Nmf-1))
-                mf += rec.load_plms(self.libdir_MAP(self.k, simidx, self.version), [it])[-1]
-            np.save(fn, mf/self.Nmf)
+        fn = self.fn_meanfield(it)
+        if not calc and os.path.isfile(fn):
+            return np.load(fn)
+        mf = self.get_meanfield_partial(self.simidxs_mf, [it])
+        self.save_meanfields([it], mf)
 
-        return mf
+        return mf[0]/self.Nmf
 
 
     # @base_exception_handler
     @log_on_start(logging.DEBUG, "MAP.get_meanfields_it(its={its}, calc={calc}) started")
     @log_on_end(logging.DEBUG, "MAP.get_meanfields_it(its={its}, calc={calc}) finished")
     def get_meanfields_it(self, its, calc=False):
-        plm = rec.load_plms(self.libdir_MAP(self.k, self.simidxs[0], self.version), [0])[-1]
-        mfs = np.zeros(shape=(len(its),*plm.shape), dtype=np.complex128)
-        if calc==True:
-            for iti, it in enumerate(its[mpi.rank::mpi.size]):
-                mfs[iti] = self.get_meanfield_it(it, calc=calc)
+        """Meanfields of iterations *its*, as array of shape (len(its), nalm)
+
+            With calc=True, this must be called by all ranks: each rank sums up its share of the meanfield sims for all *its*,
+            and the partial sums are reduced onto rank 0, which stores all meanfields at once.
+
+        """
+        its = np.atleast_1d(its)
+        if calc:
+            mf = self.get_meanfield_partial(self.simidxs_mf[mpi.rank::mpi.size], its)
+            if mf is None:
+                plm = rec.load_plms(self.libdir_MAP(self.k, self.simidxs_mf[0], self.version), [0])[-1]
+                mf = np.zeros((len(its), *plm.shape), dtype=np.complex128)
+            mf = mpi.reduce_sum(mf, root=0)
+            if mpi.rank == 0:
+                self.save_meanfields(its, mf)
             mpi.barrier()
-        for iti, it in enumerate(its[mpi.rank::mpi.size]):
-            mfs[iti] = self.get_meanfield_it(it, calc=False)
 
-        return mfs
+        return np.array([self.get_meanfield_it(it, calc=False) for it in its])
 
 
     # @base_exception_handler
     @log_on_start(logging.DEBUG, "MAP.get_blt_it(simidx={simidx}, it={it}) started")
     @log_on_end(logging.DEBUG, "MAP.get_blt_it(simidx={simidx}, it={it}) finished")
-    def get_blt_it(self, simidx, it):
+    def get_blt_it(self, simidx, it, maxiterdone=None):
+        """B-lensing template of *simidx* at iteration *it*, calculated if missing
+
+            Args:
+                maxiterdone(optional): last iteration done for simidx, if known already to the caller
+
+        """
         if it == 0:
-            self.qe.itlib_iterator = transform(self, iterator_transformer(self, simidx, self.dlensalot_model))
+            if not os.path.exists(self.qe.fn_blt(simidx)): # the QE iterator is only needed to calculate the template
+                self.qe.itlib_iterator = transform(self, iterator_transformer(self, simidx, self.dlensalot_model))
             return self.qe.get_blt(simidx)
         fn_blt = opj(self.libdir_blt(simidx), 'blt_%s_%04d_p%03d_e%03d_lmax%s'%(self.k, simidx, it, it, self.lm_max_blt[0]) + '.npy')
         if not os.path.exists(fn_blt):     
             self.libdir_MAPidx = self.libdir_MAP(self.k, simidx, self.version)
-            dlm_mod = np.zeros_like(rec.load_plms(self.libdir_MAPidx, [0])[0])
-            if self.dlm_mod_bool and it>0 and it<=rec.maxiterdone(self.libdir_MAPidx):
-                dlm_mod = self.get_meanfields_it([it], calc=False)
-                if simidx in self.simidxs_mf:
-                    dlm_mod = (dlm_mod - np.array(rec.load_plms(self.libdir_MAPidx, [it]))/self.Nmf) * self.Nmf/(self.Nmf - 1)
-            if it<=rec.maxiterdone(self.libdir_MAPidx):
+            if maxiterdone is None:
+                maxiterdone = rec.maxiterdone(self.libdir_MAPidx)
+            if self.dlm_mod_bool and it>0 and it<=maxiterdone:
+                dlm_mod = self.mf_store.get_mf_loo(simidx, it)
+            else:
+                dlm_mod = np.zeros_like(rec.load_plms(self.libdir_MAPidx, [0])[0])
+            if it<=maxiterdone:
                 blt = self.itlib_iterator.get_template_blm(it, it-1, lmaxb=self.lm_max_blt[0], lmin_plm=np.max([self.Lmin,5]), dlm_mod=dlm_mod, perturbative=False, k=self.k)
                 np.save(fn_blt, blt)
         return np.load(fn_blt)
 
 
+    # @base_exception_handler
+    @log_on_start(logging.DEBUG, "MAP.get_blts_it(simidx={simidx}, its={its}) started")
+    @log_on_end(logging.DEBUG, "MAP.get_blts_it(simidx={simidx}, its={its}) finished")
+    def get_blts_it(self, simidx, its):
+        """Calculates the missing B-lensing templates of *simidx* for all iterations *its* in a single pass, and stores them
+
+            Iterations beyond the last one done are skipped.
+
+            Returns:
+                dict of the templates calculated by this call, by iteration. The stored ones are read with get_blt_it
+
+        """
+        self.libdir_MAPidx = self.libdir_MAP(self.k, simidx, self.version)
+        fn_blt = lambda it: opj(self.libdir_blt(simidx), 'blt_%s_%04d_p%03d_e%03d_lmax%s'%(self.k, simidx, it, it, self.lm_max_blt[0]) + '.npy')
+        maxiterdone = rec.maxiterdone(self.libdir_MAPidx)
+        blts = dict()
+        if 0 in its and not os.path.exists(self.qe.fn_blt(simidx)):
+            blts[0] = self.get_blt_it(simidx, 0)
+        todo = [int(it) for it in its if 0 < it <= maxiterdone and not os.path.exists(fn_blt(it))]
+        if len(todo) > 0:
+            if self.dlm_mod_bool:
+                dlm_mods = [self.mf_store.get_mf_loo(simidx, it) for it in todo]
+            else:
+                dlm_mods = None
+            for it, blt in zip(todo, self.itlib_iterator.get_template_blms(todo, [it-1 for it in todo], lmaxb=self.lm_max_blt[0], lmin_plm=np.max([self.Lmin,5]), dlm_mods=dlm_mods, perturbative=False, k=self.k)):
+                np.save(fn_blt(it), blt)
+                blts[it] = blt
+        return blts
+
+
     @log_on_start(logging.DEBUG, "get_filter() started")
     @log_on_end(logging.DEBUG, "get_filter() finished")
     def get_filter(self): 
@@ -1193,20 +1375,38 @@ class Map_delenser(Basejob):
     @log_on_start(logging.DEBUG, "run() started")
     @log_on_end(logging.DEBUG, "run() finished")
     def run(self):
-        outputdata = self._prepare_job()
-        if self.jobs != []:
-            for simidx in self.jobs[mpi.rank::mpi.size]:
-                log.debug('will store file at: {}'.format(self.fns.format(simidx)))
-                self.delens(simidx, outputdata)
+        self.outputdata = self._prepare_job()
+        graph = scheduler.task_graph()
+        for simidx in self.jobs:
+            graph.add(('delens', int(simidx)))
+        scheduler.run(self, graph)
+
+
+    @log_on_start(logging.DEBUG, "run_task(task={task}, simidx={simidx}) started")
+    @log_on_end(logging.DEBUG, "run_task(task={task}, simidx={simidx}) finished")
+    def run_task(self, task, simidx):
+        log.debug('will store file at: {}'.format(self.fns.format(simidx)))
+        self.delens(simidx, self.outputdata)
 
 
     def _prepare_job(self):
         if self.binning == 'binned':
             outputdata = np.zeros(shape=(2, 2+len(self.its), len(self.nlevels)+len(self.masks_fromfn), len(self.edges)-1))
-            for maskflavour, masks in self.binmasks.items():
-                for maskid, mask in masks.items():
-                    ## for a future me: ell-max of clc_templ must be edges[-1], lmax_mask can be anything...
-                    self.lib[maskflavour].update({maskid: self.cl_calc.map2cl_binned(mask, self.clc_templ, self.edges, self.lmax_mask)})
+            ## coupling matrices are cached on disk if configured: rank 0 calculates them, the other ranks then read them
+            kwargs = dict()
+            if self.cache_couplings:
+                kwargs['lib_dir'] = opj(self.libdir_delenser, 'couplings')
+            def build_libs():
+                for maskflavour, masks in self.binmasks.items():
+                    for maskid, mask in masks.items():
+                        ## for a future me: ell-max of clc_templ must be edges[-1], lmax_mask can be anything...
+                        self.lib[maskflavour].update({maskid: self.cl_calc.map2cl_binned(mask, self.clc_templ, self.edges, self.lmax_mask, **kwargs)})
+            if kwargs and mpi.rank == 0:
+                build_libs()
+            if kwargs:
+                mpi.barrier()
+            if not kwargs or mpi.rank != 0:
+                build_libs()
         elif self.binning == 'unbinned':
             for maskflavour, masks in self.binmasks.items():
                 for maskid, mask in masks.items():
@@ -1234,32 +1434,32 @@ class Map_delenser(Basejob):
 
     
 
+    def map2cls(self, bmap):
+        """Spectra of *bmap* for all masks, in the order of the outputdata mask axis
+
+            Binned spectra of all masks are calculated in one batched pass, with the map2cl_binned_masks() of the spectrum calculator.
+
+        """
+        libs = [self.lib[maskflavour][maskid] for maskflavour, masks in self.binmasks.items() for maskid in masks]
+        if self.binning == 'binned':
+            return self.cl_calc.map2cl_binned_masks(libs, bmap)
+        return [lib.map2cl(bmap) for lib in libs]
+
+
     @log_on_start(logging.DEBUG, "_delens() started")
     @log_on_end(logging.DEBUG, "_delens() finished")
     def delens(self, simidx, outputdata):
+        ## Each residual map (lensed B, QE- and MAP-delensed B) is synthesized once, and the spectra of all masks are calculated from it.
         blm_L = self.get_basemap(simidx)
-        blt_QE = self.get_blt_it(simidx, 0)
-        
-        bdel_QE = self.nivjob_geomlib.alm2map(blm_L-blt_QE, *self.lm_max_blt, nthreads=4)
-        maskcounter = 0
-        for maskflavour, masks in self.binmasks.items():
-            for maskid, mask in masks.items():
-                log.debug("starting mask {} {}".format(maskflavour, maskid))
-                
-                bcl_L = self.lib[maskflavour][maskid].map2cl(self.nivjob_geomlib.alm2map(blm_L, *self.lm_max_blt, nthreads=4))
-                outputdata[0][0][maskcounter] = bcl_L
-
-                blt_L_QE = self.lib[maskflavour][maskid].map2cl(bdel_QE)
-                outputdata[0][1][maskcounter] = blt_L_QE
-
-                for iti, it in enumerate(self.its):
-                    blt_MAP = self.get_blt_it(simidx, it)
-                    bdel_MAP = self.nivjob_geomlib.alm2map(blm_L-blt_MAP, *self.lm_max_blt, nthreads=4)
-                    log.info("starting MAP delensing for iteration {}".format(it))
-                    blt_L_MAP = self.lib[maskflavour][maskid].map2cl(bdel_MAP)    
-                    outputdata[0][2+iti][maskcounter] = blt_L_MAP
-
-                maskcounter+=1
+        for i, it in enumerate([None, 0] + list(self.its)):
+            if it is None:
+                bmap = self.nivjob_geomlib.alm2map(blm_L, *self.lm_max_blt, nthreads=4)
+            else:
+                log.info("starting {} delensing for iteration {}".format('QE' if i == 1 else 'MAP', it))
+                bmap = self.nivjob_geomlib.alm2map(blm_L-self.get_blt_it(simidx, it), *self.lm_max_blt, nthreads=4)
+            for maskcounter, cl in enumerate(self.map2cls(bmap)):
+                outputdata[0][i][maskcounter] = cl
+            del bmap
 
         np.save(self.fns.format(simidx), outputdata)
             
@@ -46,52 +46,66 @@ class BFGS_Hessian(object):
         if dot_op is None:
             dot_op = np.sum
         self.dot_op = dot_op
+        self._rhos = dict()
 
     def y(self, n):
-        return self.cacher.load(self.paths2ys[n])
+        """Read-only view on y vector n (memory-mapped if the cacher supports it)
+
+        """
+        return self.cacher.load_view(self.paths2ys[n])
 
     def s(self, n):
-        return self.cacher.load(self.paths2ss[n])
+        """Read-only view on s vector n (memory-mapped if the cacher supports it)
+
+        """
+        return self.cacher.load_view(self.paths2ss[n])
+
+    def rho(self, n):
+        """1 / (s_n^t y_n), computed once per pair of vectors
+
+        """
+        if n not in self._rhos:
+            self._rhos[n] = 1. / self.dot_op(self.s(n), self.y(n))
+        return self._rhos[n]
 
     def add_ys(self, path2y, path2s, k):
         assert self.cacher.is_cached(path2y), path2y
         assert self.cacher.is_cached(path2s), path2s
         self.paths2ys[k] = path2y
         self.paths2ss[k] = path2s
+        self._rhos.pop(k, None)
         if self.verbose:
             log.debug('Linked y vector {} to Hessian'.format(str(path2y)))
             log.debug('Linked s vector {} to Hessian'.format(str(path2s)))
 
-    def _save_alpha(self, alpha, i):
-        fname = 'temp_alpha_%s'%i
-        self.cacher.cache(fname, alpha)
-        return
-
-    def _load_alpha(self, i):
-        """Loads, and remove, bfgs alpha from disk.
+    def _two_loop(self, x, k, k0, kH0):
+        """L-BFGS two-loop recursion applying the updates k0 to k - 1 and H_0 at kH0 to x
 
         """
-        fname = 'temp_alpha_%s'%i
-        assert self.cacher.is_cached(fname)
-        ret = self.cacher.load(fname)
-        self.cacher.remove(fname)
-        return ret
+        q = x.copy()
+        alphas = dict()
+        for i in range(k - 1, k0 - 1, -1):
+            alphas[i] = self.rho(i) * self.dot_op(self.s(i), q)
+            q -= alphas[i] * self.y(i)
+        r = self.applyH0k(q, kH0)
+        for i in range(k0, k):
+            beta = self.rho(i) * self.dot_op(self.y(i), r)
+            r += self.s(i) * (alphas[i] - beta)
+        return r
 
     def applyH(self, x, k, _depth=0):
         """
-        Recursive calculation of H_k x, for any x.
-        This uses the product form update H_new = (1 - rho s y^t) H (1 - rho y s^t) + rho ss^t
+        Calculation of H_k x, for any x.
+        This uses the product form update H_new = (1 - rho s y^t) H (1 - rho y s^t) + rho ss^t,
+        unrolled into the two-loop recursion, so that each vector is loaded twice rather than once per depth.
         :param x: vector to apply the inverse Hessian to
         :param k: iter level. Output is H_k x.
-        :param _depth : internal, for internal bookkeeping.
+        :param _depth : internal, number of updates already applied by the caller.
         :return:
         """
         if k <= 0 or _depth >= self.L or self.L == 0: return self.applyH0k(x, k)
-        s = self.s(k - 1)
-        y = self.y(k - 1)
-        rho = 1. / self.dot_op(s, y)
-        Hv = self.applyH(x - rho * y * self.dot_op(x, s), k - 1, _depth=_depth + 1)
-        return Hv - s * (rho * self.dot_op(y, Hv)) + rho * s * self.dot_op(s, x)
+        k0 = max(0, k - (self.L - _depth))
+        return self._two_loop(x, k, k0, k0)
 
     def get_gk(self, k, alpha_k0):
         """
@@ -125,17 +139,7 @@ class BFGS_Hessian(object):
         If output_fname is set then output is saved in file and nothing is returned.
         Should be fine with k == 0
         """
-        q = gk.copy()
-        rho = lambda i: 1. / self.dot_op(self.s(i), self.y(i))
-        for i in range(k - 1, np.max([-1, k - self.L - 1]), -1):
-            alpha_i = rho(i) * self.dot_op(self.s(i), q)
-            q -= alpha_i * self.y(i)
-            self._save_alpha(alpha_i, i)
-
-        r = self.applyH0k(q, k)
-        for i in range(np.max([0, k - self.L]), k):
-            beta = rho(i) * self.dot_op(self.y(i), r)
-            r += self.s(i) * (self._load_alpha(i) - beta)
+        r = self._two_loop(gk, k, np.max([0, k - self.L]), k)
         if output_fname is None: return -r
         self.cacher.cache(output_fname, -r)
         return
@@ -150,7 +154,7 @@ class BFGS_Hessian(object):
         :return:
         """
         ret = x_0.copy()
-        rho = lambda j: 1. / self.dot_op(self.s(j), self.y(j))
+        rho = self.rho
         if rng_state is not None: np.random.set_state(rng_state)
         eps = np.random.standard_normal((len(range(np.max([0, k - self.L]), k)), 1))
 
@@ -18,7 +18,7 @@
 
 import os
 from os.path import join as opj
-import shutil, time, sys
+import shutil, time, sys, json
 import numpy as np
 
 import logging
@@ -30,13 +30,14 @@ from lenspyx.remapping.utils_geom import pbdGeometry, pbounds
 from lenspyx.remapping.deflection_028 import rtype
 
 from delensalot.utils import cli, read_map
-from delensalot.utility.utils_hp import Alm, almxfl, alm2cl
+from delensalot.utility.utils_hp import Alm, almxfl, alm2cl, rng_streams
 from delensalot.utility import utils_qe
 
 from delensalot.core import cachers
 from delensalot.core.cg import multigrid
 from delensalot.core.opfilt import opfilt_base
 from delensalot.core.iterator import bfgs, steps
+from delensalot.core.iterator.statics import rec
 
 
 @log_on_start(logging.DEBUG, " Start of prt_time()")
@@ -58,7 +59,8 @@ class qlm_iterator(object):
                  k_geom:utils_geom.Geom,
                  chain_descr, stepper:steps.nrstep,
                  logger=None,
-                 NR_method=100, tidy=0, verbose=True, soltn_cond=True, wflm0=None, _usethisE=None):
+                 NR_method=100, tidy=0, verbose=True, soltn_cond=True, wflm0=None, _usethisE=None,
+                 cacher_type=cachers.cacher_npy, hess_cache_bytes=2 ** 30, wf_recycle_nvec=4, wf_recycle_tol=0.1):
         """Lensing map iterator
 
             The bfgs hessian updates are called 'hlm's and are either in plm, dlm or klm space
@@ -71,6 +73,13 @@ class qlm_iterator(object):
                 k_geom: lenspyx geometry for once-per-iterations operations (like checking for invertibility etc, QE evals...)
                 stepper: custom calculation of NR-step
                 wflm0(optional): callable with Wiener-filtered CMB map search starting point
+                cacher_type(optional): callable building the cachers from their directory (defaults to cachers.cacher_npy,
+                                       e.g. a functools.partial of cachers.cacher_h5 for compressed storage)
+                hess_cache_bytes(optional): memory budget of the in-memory LRU layer on the BFGS vectors (0 disables it)
+                wf_recycle_nvec(optional): number of approximate low eigenvectors of the WF operator kept in memory
+                                           to deflate the next WF solve (0 disables it)
+                wf_recycle_tol(optional): the WF solve is deflated only if the deflection field changed by less than
+                                          this fraction (in norm) since the previous solve
 
         """
         assert h in ['k', 'p', 'd']
@@ -82,10 +91,13 @@ class qlm_iterator(object):
         self.h = h
 
         self.lib_dir = lib_dir
-        self.cacher = cachers.cacher_npy(lib_dir)
-        self.hess_cacher = cachers.cacher_npy(opj(self.lib_dir, 'hessian'))
-        self.wf_cacher = cachers.cacher_npy(opj(self.lib_dir, 'wflms'))
-        self.blt_cacher = cachers.cacher_npy(opj(self.lib_dir, 'BLT/'))
+        self.cacher = cacher_type(lib_dir)
+        rec.set_cacher_type(lib_dir, cacher_type) # the static helpers then read this directory with the same cachers
+        self.hess_cacher = cacher_type(opj(self.lib_dir, 'hessian'))
+        if hess_cache_bytes > 0:
+            self.hess_cacher = cachers.cacher_lru(self.hess_cacher, maxbytes=hess_cache_bytes)
+        self.wf_cacher = cacher_type(opj(self.lib_dir, 'wflms'))
+        self.blt_cacher = cacher_type(opj(self.lib_dir, 'BLT/'))
         if logger is None:
             from delensalot.core.iterator import loggers
             logger = loggers.logger_norms(opj(lib_dir, 'history_increment.txt'))
@@ -114,6 +126,10 @@ class qlm_iterator(object):
 
         self.filter = ninv_filt
         self.k_geom = k_geom
+        # WF solver state (preconditioners, Ritz vectors) kept across iterations
+        self.wf_context = multigrid.multigrid_context(self.opfilt, cls_filt, ninv_filt, nvec=wf_recycle_nvec)
+        self.wf_recycle_tol = wf_recycle_tol
+        self._wf_dlm = None
         # Defining a trial newton step length :
 
         self.wflm0 = wflm0
@@ -153,11 +169,21 @@ class qlm_iterator(object):
 
     def _sk2plm(self, itr):
         sk_fname = lambda k: 'rlm_sn_%s_%s' % (k, 'p')
-        rlm = self.cacher.load('phi_%slm_it000'%self.h)
-        for i in range(itr):
+        it0, rlm = rec.load_plm_checkpoint(self.lib_dir, itr, self.h)
+        if it0 <= 0:
+            it0 = 0
+            rlm = self.cacher.load('phi_%slm_it000'%self.h)
+        for i in range(it0, itr):
             rlm += self.hess_cacher.load(sk_fname(i))
         return rlm
 
+    def _cache_plm_checkpoint(self, itr):
+        """Caches the cumulative estimate at iteration 'itr', once its last BFGS step is available
+
+        """
+        if itr > 0:
+            rec.cache_plm_checkpoint(self.lib_dir, itr, self._sk2plm(itr), self.h)
+
     def _yk2grad(self, itr):
         yk_fname = lambda k: 'rlm_yn_%s_%s' % (k, 'p')
         rlm = self.load_gradient(0, 'p')
@@ -204,59 +230,103 @@ class qlm_iterator(object):
                 It can be a real lot better to keep the same L range as the iterations
 
         """
+        dlm_mods = None if dlm_mod is None else [dlm_mod]
+        return self.get_template_blms([it], [it_e], lmaxb=lmaxb, lmin_plm=lmin_plm, elm_wf=elm_wf, dlm_mods=dlm_mods, perturbative=perturbative, k=k, pwithn1=pwithn1)[0]
+
+
+    @log_on_start(logging.DEBUG, "get_template_blms(its={its}) started")
+    @log_on_end(logging.DEBUG, "get_template_blms(its={its}) finished")
+    def get_template_blms(self, its, its_e, lmaxb=1024, lmin_plm=1, elm_wf:None or np.ndarray=None, dlm_mods=None, perturbative=False, k='p_p', pwithn1=False):
+        """Builds the template B-mode maps of several iterations in one pass
+
+            Same as get_template_blm, for each pair (it, it_e) of *its*, *its_e*. The estimates are built up in a single pass
+            over the BFGS steps, each Wiener-filtered E-mode is loaded once, and the templates are cached once all are done.
+
+            Args:
+                its: iteration indices of the lensing tracer
+                its_e: iteration indices of the E-tracer, one for each of *its*
+                dlm_mods: field to subtract from the lensing tracer, one for each of *its* (or None)
+
+            Returns:
+                list of blm healpy arrays, one for each of *its*
+
+        """
+        assert len(its) == len(its_e), (its, its_e)
+        assert dlm_mods is None or len(dlm_mods) == len(its), (its, len(dlm_mods))
         cache_cond = (lmin_plm >= 1) and (elm_wf is None)
 
-        fn_blt = 'blt_p%03d_e%03d_lmax%s'%(it, it_e, lmaxb)
-        if dlm_mod is None:
-            pass
-        else:
-            fn_blt += '_dlmmod' * dlm_mod.any()
-        fn_blt += 'perturbative' * perturbative
-        fn_blt += '_wN1' * pwithn1
-        
-        if self.blt_cacher.is_cached(fn_blt):
-            return self.blt_cacher.load(fn_blt)
-        if elm_wf is None:
-            if it_e > 0:
+        fn_blts = []
+        for i, (it, it_e) in enumerate(zip(its, its_e)):
+            fn_blt = 'blt_p%03d_e%03d_lmax%s'%(it, it_e, lmaxb)
+            if dlm_mods is not None and dlm_mods[i] is not None:
+                fn_blt += '_dlmmod' * dlm_mods[i].any()
+            fn_blt += 'perturbative' * perturbative
+            fn_blt += '_wN1' * pwithn1
+            fn_blts.append(fn_blt)
+
+        blms = [self.blt_cacher.load(fn_blt) if self.blt_cacher.is_cached(fn_blt) else None for fn_blt in fn_blts]
+        todo = [i for i, blm in enumerate(blms) if blm is None]
+        if len(todo) == 0:
+            return blms
+
+        elm_wfs = dict() # it_e -> Wiener-filtered E-mode
+        def get_elm_wf(it_e):
+            if elm_wf is not None:
+                ret = elm_wf
+            elif it_e in elm_wfs:
+                return elm_wfs[it_e]
+            elif it_e > 0:
                 e_fname = 'wflm_%s_it%s' % ('p', it_e - 1)
                 assert self.wf_cacher.is_cached(e_fname)
-                elm_wf = self.wf_cacher.load(e_fname)
+                ret = self.wf_cacher.load(e_fname)
             elif it_e == 0:
-                elm_wf = self.wflm0()
+                ret = self.wflm0()
             else:
                 assert 0,'dont know what to do with it_e = ' + str(it_e)
-        if len(elm_wf) == 2 and k == 'p':
-            elm_wf = elm_wf[1]
-        assert Alm.getlmax(elm_wf.size, self.mmax_filt) == self.lmax_filt, "{}, {}, {}, {}".format(elm_wf.size, self.mmax_filt, Alm.getlmax(elm_wf.size, self.mmax_filt), self.lmax_filt)
-        mmaxb = lmaxb
-        dlm = self.get_hlm(it, 'p', pwithn1)
-
-        # subtract field from phi
-        if dlm_mod is not None:
-            dlm = dlm - dlm_mod
+            if len(ret) == 2 and k == 'p':
+                ret = ret[1]
+            assert Alm.getlmax(ret.size, self.mmax_filt) == self.lmax_filt, "{}, {}, {}, {}".format(ret.size, self.mmax_filt, Alm.getlmax(ret.size, self.mmax_filt), self.lmax_filt)
+            elm_wfs[it_e] = ret
+            return ret
 
-        self.hlm2dlm(dlm, inplace=True)
-        almxfl(dlm, np.arange(self.lmax_qlm + 1, dtype=int) >= lmin_plm, self.mmax_qlm, True)
-        if perturbative: # Applies perturbative remapping
-            get_alm = lambda a: elm_wf if a == 'e' else np.zeros_like(elm_wf)
-            geom, sht_tr = self.filter.ffi.geom, self.filter.ffi.sht_tr
-            d1_c = np.empty((geom.npix(),), dtype=elm_wf.dtype)
-            d1_r = d1_c.view(rtype[d1_c.dtype]).reshape((d1_c.size, 2)).T  # real view onto complex array
-            geom.synthesis(dlm, 1, self.lmax_qlm, self.mmax_qlm, sht_tr, map=d1_r, mode='GRAD_ONLY')
-            dp = utils_qe.qeleg_multi([2], +3, [utils_qe.get_spin_raise(2, self.lmax_filt)])(get_alm, geom, sht_tr)
-            dm = utils_qe.qeleg_multi([2], +1, [utils_qe.get_spin_lower(2, self.lmax_filt)])(get_alm, geom, sht_tr)
-            dlens_c = -0.5 * ((d1_c.conj()) * dp + d1_c * dm)
-            dlens_r = dlens_c.view(rtype[dlens_c.dtype]).reshape((dlens_c.size, 2)).T  # real view onto complex array
-            del dp, dm, d1_c
-            blm = geom.adjoint_synthesis(dlens_r, 2, lmaxb, mmaxb, sht_tr)[1]
-        else: # Applies full remapping (this will re-calculate the angles)
-            ffi = self.filter.ffi.change_dlm([dlm, None], self.mmax_qlm)
-            blm = ffi.lensgclm(elm_wf, self.mmax_filt, 2, lmaxb, mmaxb)[1]
+        mmaxb = lmaxb
+        fl_lmin = np.arange(self.lmax_qlm + 1, dtype=int) >= lmin_plm
+        dlms = self.get_hlms([its[i] for i in todo], 'p', pwithn1)
+        dpdms = dict() # it_e -> perturbative remapping legs of the E-mode
+        for i, dlm in zip(todo, dlms):
+            elm_wf_ = get_elm_wf(its_e[i])
+            # subtract field from phi
+            if dlm_mods is not None and dlm_mods[i] is not None:
+                dlm = dlm - dlm_mods[i]
+            else:
+                dlm = dlm.copy()
+            self.hlm2dlm(dlm, inplace=True)
+            almxfl(dlm, fl_lmin, self.mmax_qlm, True)
+            if perturbative: # Applies perturbative remapping
+                geom, sht_tr = self.filter.ffi.geom, self.filter.ffi.sht_tr
+                if its_e[i] not in dpdms:
+                    get_alm = lambda a: elm_wf_ if a == 'e' else np.zeros_like(elm_wf_)
+                    dp = utils_qe.qeleg_multi([2], +3, [utils_qe.get_spin_raise(2, self.lmax_filt)])(get_alm, geom, sht_tr)
+                    dm = utils_qe.qeleg_multi([2], +1, [utils_qe.get_spin_lower(2, self.lmax_filt)])(get_alm, geom, sht_tr)
+                    dpdms[its_e[i]] = (dp, dm)
+                dp, dm = dpdms[its_e[i]]
+                d1_c = np.empty((geom.npix(),), dtype=elm_wf_.dtype)
+                d1_r = d1_c.view(rtype[d1_c.dtype]).reshape((d1_c.size, 2)).T  # real view onto complex array
+                geom.synthesis(dlm, 1, self.lmax_qlm, self.mmax_qlm, sht_tr, map=d1_r, mode='GRAD_ONLY')
+                dlens_c = -0.5 * ((d1_c.conj()) * dp + d1_c * dm)
+                dlens_r = dlens_c.view(rtype[dlens_c.dtype]).reshape((dlens_c.size, 2)).T  # real view onto complex array
+                del d1_c
+                blms[i] = geom.adjoint_synthesis(dlens_r, 2, lmaxb, mmaxb, sht_tr)[1]
+            else: # Applies full remapping (this will re-calculate the angles)
+                ffi = self.filter.ffi.change_dlm([dlm, None], self.mmax_qlm)
+                blms[i] = ffi.lensgclm(elm_wf_, self.mmax_filt, 2, lmaxb, mmaxb)[1]
+        del dpdms
 
         if cache_cond:
-            self.blt_cacher.cache(fn_blt, blm)
+            for i in todo:
+                self.blt_cacher.cache(fn_blts[i], blms[i])
 
-        return blm
+        return blms
 
 
     def get_lik(self, itr, cache=False):
@@ -301,14 +371,39 @@ class qlm_iterator(object):
         if itr < 0:
             return np.zeros(Alm.getsize(self.lmax_qlm, self.mmax_qlm), dtype=complex)
         assert key.lower() in ['p', 'o'], key  # potential or curl potential.
-        if pwithn1:
-            fn = '%s_%slm_it%03d' % ({'p': 'phi', 'o': 'om'}[key.lower()], self.h, itr)
-        else:
-            fn = '%s_%slm_it%03d_wN1' % ({'p': 'phi', 'o': 'om'}[key.lower()], self.h, itr)
+        fn = self._hlm_fname(itr, key, pwithn1)
         if self.cacher.is_cached(fn):
             return self.cacher.load(fn)
         return self._sk2plm(itr)
 
+    def _hlm_fname(self, itr, key, pwithn1):
+        if pwithn1:
+            return '%s_%slm_it%03d' % ({'p': 'phi', 'o': 'om'}[key.lower()], self.h, itr)
+        return '%s_%slm_it%03d_wN1' % ({'p': 'phi', 'o': 'om'}[key.lower()], self.h, itr)
+
+    def get_hlms(self, itrs, key, pwithn1=False):
+        """Loads the estimates of iterations 'itrs', building them up in a single pass over the BFGS steps
+
+        """
+        assert key.lower() in ['p', 'o'], key  # potential or curl potential.
+        sk_fname = lambda k: 'rlm_sn_%s_%s' % (k, 'p')
+        ret = dict()
+        rlm, at = None, -1
+        for itr in sorted(set(itrs)):
+            if itr < 0 or self.cacher.is_cached(self._hlm_fname(itr, key, pwithn1)):
+                ret[itr] = self.get_hlm(itr, key, pwithn1)
+                continue
+            it0, plm = rec.load_plm_checkpoint(self.lib_dir, itr, self.h, itmin=at + 1)
+            if it0 > 0:
+                rlm, at = plm, it0
+            elif rlm is None:
+                rlm, at = self.cacher.load('phi_%slm_it000'%self.h), 0
+            for i in range(at, itr):
+                rlm = rlm + self.hess_cacher.load(sk_fname(i))
+            at = itr
+            ret[itr] = rlm
+        return [ret[itr] for itr in itrs]
+
 
     def load_soltn(self, itr, key):
         """Load starting point for the conjugate gradient inversion.
@@ -356,6 +451,19 @@ class qlm_iterator(object):
     def calc_norm(self, qlm):
         return np.sqrt(np.sum(alm2cl(qlm, qlm, self.lmax_qlm, self.mmax_qlm, self.lmax_qlm)))
 
+    def _wf_recycle(self, dlm):
+        """Decides whether the WF solve may be deflated with the Ritz vectors of the previous one
+
+            This is the case if the deflection field did not change too much since then.
+
+        """
+        prev_dlm, self._wf_dlm = self._wf_dlm, dlm.copy()
+        if prev_dlm is None:
+            return False
+        change = self.calc_norm(dlm - prev_dlm) / max(self.calc_norm(dlm), 1e-30)
+        log.info("WF solver: relative deflection change %.3e (recycling: %s)" % (change, change <= self.wf_recycle_tol))
+        return change <= self.wf_recycle_tol
+
 
     @log_on_start(logging.DEBUG, "get_hessian(k={k}, key={key}) started")
     @log_on_end(logging.DEBUG, "get_hessian(k={k}, key={key}) finished")
@@ -433,10 +541,13 @@ class qlm_iterator(object):
             almxfl(glm, self.chh > 0, self.mmax_qlm, True) # kills all modes where prior is set to zero
             self.build_incr(itr, key, glm)
             del glm
+            self._cache_plm_checkpoint(itr)
             self.logger.on_iterdone(itr, key, self)
             if self.tidy > 2:  # Erasing deflection databases
                 if os.path.exists(opj(self.lib_dir, 'ffi_%s_it%s'%(key, itr))):
                     shutil.rmtree(opj(self.lib_dir, 'ffi_%s_it%s'%(key, itr)))
+        if key.lower() == 'p':
+            rec.update_manifest(self.lib_dir, itr)
 
 
     @log_on_start(logging.DEBUG, "calc_gradlik(it={itr}, key={key}) started")
@@ -454,7 +565,6 @@ class qlm_iterator(object):
             self.hlm2dlm(dlm, True)
             ffi = self.filter.ffi.change_dlm([dlm, None], self.mmax_qlm, cachers.cacher_mem(safe=False))
             self.filter.set_ffi(ffi)
-            mchain = multigrid.multigrid_chain(self.opfilt, self.chain_descr, self.cls_filt, self.filter)
             if self._usethisE is not None:
                 if callable(self._usethisE):
                     log.info("iterator: using custom WF E")
@@ -465,8 +575,8 @@ class qlm_iterator(object):
                 soltn, it_soltn = self.load_soltn(itr, key)
                 if it_soltn < itr - 1:
                     soltn *= self.soltn_cond
-                    
-                    mchain.solve(soltn, self.dat_maps, dot_op=self.filter.dot_op())
+                    self.wf_context.solve(self.chain_descr, soltn, self.dat_maps, dot_op=self.filter.dot_op(),
+                                          fwd_key=itr - 1, recycle=self._wf_recycle(dlm))
                     fn_wf = 'wflm_%s_it%s' % (key.lower(), itr - 1)
                     log.info("caching "  + fn_wf)
                     self.wf_cacher.cache(fn_wf, soltn)
@@ -559,16 +669,57 @@ class iterator_pertmf(qlm_iterator):
 class iterator_simf(qlm_iterator):
     """Monte-Carlo evaluation of mean-field
 
+        The random phases of MC realization *i* at iteration *itr* are drawn from the stream (mf_simidx, itr, i) of
+        utils_hp.rng_streams(mf_seed), and can be regenerated at any time with get_mf_rng(itr, i).
+
+        Args (in addition to qlm_iterator):
+            mf_seed(optional): entropy of the phase streams. If None, the entropy recorded in lib_dir by a previous run is used,
+                               else fresh entropy is drawn and recorded there, such that restarted runs draw the same phases
+            mf_simidx(optional): index of the simulation, to keep the phases of different simulations independent
+            mf_nsims(optional): number of MC realizations averaged per iteration
 
     """
 
     def __init__(self, lib_dir:str, h:str, lm_max_dlm:tuple,
                  dat_maps:list or np.ndarray, plm0:np.ndarray, mf_key:int, pp_h0:np.ndarray,
                  cpp_prior:np.ndarray, cls_filt:dict, ninv_filt:opfilt_base.alm_filter_wl, k_geom:utils_geom.Geom,
-                 chain_descr, stepper:steps.nrstep, **kwargs):
+                 chain_descr, stepper:steps.nrstep, mf_seed:int or None=None, mf_simidx:int=0, mf_nsims:int=1, **kwargs):
         super(iterator_simf, self).__init__(lib_dir, h, lm_max_dlm, dat_maps, plm0, pp_h0, cpp_prior, cls_filt,
                                              ninv_filt, k_geom, chain_descr, stepper, **kwargs)
+        assert mf_nsims > 0, mf_nsims
         self.mf_key = mf_key
+        self.mf_streams = rng_streams(self._load_mf_seed() if mf_seed is None else mf_seed)
+        self._save_mf_seed(self.mf_streams.entropy)
+        self.mf_simidx = mf_simidx
+        self.mf_nsims = mf_nsims
+
+    def _fn_mf_seed(self):
+        return opj(self.lib_dir, 'mf_seed.json')
+
+    def _load_mf_seed(self):
+        if not os.path.exists(self._fn_mf_seed()):
+            return None
+        with open(self._fn_mf_seed(), 'r') as f:
+            return int(json.load(f)['entropy'])
+
+    def _save_mf_seed(self, entropy):
+        """Records the entropy of the phase streams in lib_dir, replacing any previous one
+
+        """
+        if self._load_mf_seed() == entropy:
+            return
+        if os.path.exists(self._fn_mf_seed()):
+            log.warning('mf_seed differs from the one recorded in {}, replacing it'.format(self.lib_dir))
+        fn_tmp = self._fn_mf_seed() + '.%s.tmp' % os.getpid()
+        with open(fn_tmp, 'w') as f:
+            json.dump({'entropy': str(entropy)}, f) # may exceed 64 bits
+        os.replace(fn_tmp, self._fn_mf_seed())
+
+    def get_mf_rng(self, itr:int, i:int):
+        """Random generator of the phases of MC realization *i* of the mean-field at iteration *itr*
+
+        """
+        return self.mf_streams(self.mf_simidx, itr, i)
 
 
     @log_on_start(logging.DEBUG, "calc_graddet(it={itr}, key={key}) started")
@@ -581,12 +732,21 @@ class iterator_simf(qlm_iterator):
         self.hlm2dlm(dlm, True)
         ffi = self.filter.ffi.change_dlm([dlm, None], self.mmax_qlm, cachers.cacher_mem(safe=False))
         self.filter.set_ffi(ffi)
-        mchain = multigrid.multigrid_chain(self.opfilt, self.chain_descr, self.cls_filt, self.filter)
+        mchain = self.wf_context.get_chain(self.chain_descr, fwd_key=itr - 1) # MF solves recycle the WF solve vectors
         t0 = time.time()
         q_geom = pbdGeometry(self.k_geom, pbounds(0., 2 * np.pi))
-        G, C = self.filter.get_qlms_mf(self.mf_key, q_geom, mchain, cls_filt=self.cls_filt)
+        for i in range(self.mf_nsims):
+            G_i, C_i = self.filter.get_qlms_mf(self.mf_key, q_geom, mchain, cls_filt=self.cls_filt, rng=self.get_mf_rng(itr, i))
+            if i == 0:
+                G, C = G_i, C_i
+            else:
+                G += G_i
+                C += C_i
+        if self.mf_nsims > 1:
+            G /= self.mf_nsims
+            C /= self.mf_nsims
         almxfl(G if key.lower() == 'p' else C, self._h2p(self.lmax_qlm), self.mmax_qlm, True)
-        log.info('get_qlm_mf calculation done; (%.0f secs)' % (time.time() - t0))
+        log.info('get_qlm_mf calculation done, %s realizations; (%.0f secs)' % (self.mf_nsims, time.time() - t0))
         if itr == 1:  # We need the gradient at 0 and the yk's to be able to rebuild all gradients
             fn_lik = '%slm_grad%sdet_it%03d' % (self.h, key.lower(), 0)
             self.cacher.cache(fn_lik, -G if key.lower() == 'p' else -C)
@@ -20,7 +20,6 @@ from logdecorator import log_on_start, log_on_end
 from delensalot.utils import cli
 from delensalot.utility.utils_hp import Alm, almxfl
 from delensalot.core import cachers
-from delensalot.core.cg import multigrid
 from delensalot.core.iterator import steps
 from delensalot.core.opfilt import opfilt_base
 import delensalot.core.iterator.cs_iterator
@@ -86,16 +85,14 @@ class iterator_cstmf(delensalot.core.iterator.cs_iterator.qlm_iterator):
                 delT = ffi.lensgclm(delT, self.filter.mmax_len, 0, self.filter.lmax_len, self.filter.mmax_len, backwards=True, nomagn=True)
                 almxfl(delT, self.filter.transf, mmax, True)
             self.filter.set_ffi(self.filter.ffi.change_dlm([np.zeros_like(dlm), None], self.mmax_qlm, cachers.cacher_mem(safe=False)))
-            mchain = multigrid.multigrid_chain(self.opfilt, self.chain_descr, self.cls_filt, self.filter)
             soltn, it_soltn = self.load_soltn(itr, key)
 
             if it_soltn < itr - 1:
                 soltn *= self.soltn_cond
                 assert soltn.ndim == 1, 'Fix following lines'
-                if PorT:
-                    mchain.solve(soltn, delEB, dot_op=self.filter.dot_op())
-                else:
-                    mchain.solve(soltn, delT, dot_op=self.filter.dot_op())
+                # The filter is undeflected at all iterations, so the Ritz vectors can always be recycled as they are
+                self.wf_context.solve(self.chain_descr, soltn, delEB if PorT else delT, dot_op=self.filter.dot_op(),
+                                      fwd_key=0)
                 fn_wf = 'wflm_%s_it%s' % (key.lower(), itr - 1)
                 log.info("caching "  + fn_wf)
                 self.wf_cacher.cache(fn_wf, soltn)
@@ -1,4 +1,5 @@
-import os
+import os, json, hashlib
+import pickle as pk
 import numpy as np
 from delensalot.core import cachers
 
@@ -13,36 +14,270 @@ rlm2alm = lambda x : x.copy()
 class rec:
     """Static methods to reach for iterated lensing maps etc
 
+        The files of an iterator directory are read with the cacher type the iterator was built with (see set_cacher_type),
+        and with cachers.cacher_npy if none was recorded.
 
     """
+    manifest_fname = 'iterations_done.json'
+    _manifests = dict() # in-process cache of the manifests, lib_dir -> (mtime, maxiterdone, checked against the iteration files)
+    cacher_type_fname = 'cacher_type.pk'
+    _cacher_types = dict() # in-process cache of the cacher types, lib_dir -> cacher type
+
+    @staticmethod
+    def set_cacher_type(lib_dir, cacher_type):
+        """Records the cacher type of the iterator of 'lib_dir' (a callable building a cacher from a directory), for the other methods of rec
+
+            The cacher type is also stored in lib_dir if it can be pickled (e.g. a class, or a functools.partial of one),
+            such that it is found by other processes.
+
+        """
+        lib_dir = os.path.abspath(lib_dir)
+        rec._cacher_types[lib_dir] = cacher_type
+        fn = os.path.join(lib_dir, rec.cacher_type_fname)
+        fn_tmp = fn + '.%s.tmp' % os.getpid()
+        try:
+            with open(fn_tmp, 'wb') as f:
+                pk.dump(cacher_type, f)
+        except (pk.PicklingError, AttributeError, TypeError):
+            log.warning('cannot store cacher type {} in {}, other processes will read npy files'.format(cacher_type, lib_dir))
+            os.remove(fn_tmp)
+            return
+        os.replace(fn_tmp, fn)
+
+    @staticmethod
+    def get_cacher_type(lib_dir):
+        """Cacher type recorded for iterator directory 'lib_dir', cachers.cacher_npy if none was recorded
+
+        """
+        lib_dir = os.path.abspath(lib_dir)
+        if lib_dir not in rec._cacher_types:
+            cacher_type = cachers.cacher_npy
+            fn = os.path.join(lib_dir, rec.cacher_type_fname)
+            if os.path.exists(fn):
+                with open(fn, 'rb') as f:
+                    cacher_type = pk.load(f)
+            rec._cacher_types[lib_dir] = cacher_type
+        return rec._cacher_types[lib_dir]
+
+    @staticmethod
+    def get_cacher(lib_dir, subdir=''):
+        """Cacher of the folder 'subdir' of iterator directory 'lib_dir', of the cacher type recorded for lib_dir
+
+        """
+        lib_dir = os.path.abspath(lib_dir)
+        return rec.get_cacher_type(lib_dir)(os.path.join(lib_dir, subdir) if subdir else lib_dir)
+
+    @staticmethod
+    def load_manifest(lib_dir):
+        """Returns the last iteration recorded in the iteration manifest of 'lib_dir', or None if there is no manifest
+
+            The manifest is only re-read if it changed on disk since the last call in this process.
+
+        """
+        lib_dir = os.path.abspath(lib_dir)
+        fn = os.path.join(lib_dir, rec.manifest_fname)
+        try:
+            mtime = os.stat(fn).st_mtime_ns
+        except OSError:
+            rec._manifests.pop(lib_dir, None)
+            return None
+        cached = rec._manifests.get(lib_dir, None)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(fn, 'r') as f:
+            itr = int(json.load(f)['maxiterdone'])
+        rec._manifests[lib_dir] = (mtime, itr, False)
+        return itr
+
+    @staticmethod
+    def update_manifest(lib_dir, itr):
+        """Records iteration 'itr' as done in the iteration manifest of 'lib_dir'
+
+            The manifest never moves back to a lower iteration here, see maxiterdone for stale manifests.
+
+        """
+        lib_dir = os.path.abspath(lib_dir)
+        current = rec.load_manifest(lib_dir)
+        if current is not None and current >= itr:
+            return
+        rec._write_manifest(lib_dir, itr)
+
+    @staticmethod
+    def _write_manifest(lib_dir, itr):
+        """Replaces the iteration manifest of 'lib_dir' atomically
+
+        """
+        fn = os.path.join(lib_dir, rec.manifest_fname)
+        fn_tmp = fn + '.%s.tmp' % os.getpid()
+        with open(fn_tmp, 'w') as f:
+            json.dump({'maxiterdone': int(itr)}, f)
+        os.replace(fn_tmp, fn)
+        rec._manifests[lib_dir] = (os.stat(fn).st_mtime_ns, int(itr), True)
 
     @staticmethod
     def maxiterdone(lib_dir):
+        """Returns the last iteration performed in 'lib_dir'
+
+            This reads the iteration manifest written by the iterator, and only probes the iteration files after its last iteration.
+            The last iteration of a manifest is checked against the iteration files once per process and manifest version,
+            and the iteration files are probed from the start if it is stale (e.g. iterations deleted for a rerun) or if there is
+            no manifest (e.g. for runs made before the manifest existed). A stale manifest is then rewritten.
+
+        """
         lib_dir = os.path.abspath(lib_dir)
-        itr = -2
-        isdone = True
-        while isdone:
+        manifest = rec.load_manifest(lib_dir)
+        itr = -1
+        if manifest is not None:
+            if rec._manifests[lib_dir][2] or rec.is_iter_done(lib_dir, manifest):
+                itr = manifest
+            else:
+                log.warning('iteration manifest of {} is stale (iteration {} not found), scanning the iterations'.format(lib_dir, manifest))
+        while rec.is_iter_done(lib_dir, itr + 1):
             itr += 1
-            isdone = rec.is_iter_done(lib_dir, itr + 1)
+        if manifest is not None:
+            if itr != manifest:
+                rec._write_manifest(lib_dir, itr)
+            else:
+                rec._manifests[lib_dir] = rec._manifests[lib_dir][:2] + (True,)
         return itr
 
+    @staticmethod
+    def plm_checkpoint_fname(itr, h='p'):
+        """Name of the cumulative plm checkpoint at iteration 'itr', relative to the 'hessian' folder
+
+        """
+        return 'phi_%slm_cum_it%03d' % (h, itr)
+
+    @staticmethod
+    def _plm_sources(lib_dir, itmax, h='p'):
+        """Cacher stamps (e.g. sizes and modification times) of the arrays building up the plms, up to iteration 'itmax'
+
+            Entry 0 is phi_plm_it000, entry k > 0 the BFGS step k - 1. Missing arrays, and all entries after them, are None.
+
+        """
+        cacher, hess_cacher = rec.get_cacher(lib_dir), rec.get_cacher(lib_dir, 'hessian')
+        ret = [cacher.stamp('phi_%slm_it000' % h)]
+        for k in range(itmax):
+            if ret[-1] is None:
+                break
+            ret.append(hess_cacher.stamp('rlm_sn_%s_%s' % (k, 'p')))
+        return ret + [None] * (itmax + 1 - len(ret))
+
+    @staticmethod
+    def _plm_hash(plm):
+        return hashlib.sha1(np.ascontiguousarray(plm).tobytes()).hexdigest()
+
+    @staticmethod
+    def _plm_checkpoint_meta(lib_dir, itr, h='p'):
+        try:
+            with open(os.path.join(lib_dir, 'hessian', rec.plm_checkpoint_fname(itr, h) + '.json'), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def is_plm_checkpoint_valid(lib_dir, itr, h='p', _sources=None):
+        """Returns True if the cumulative plm checkpoint at 'itr' exists and was built from the current files of all the steps it sums up
+
+        """
+        lib_dir = os.path.abspath(lib_dir)
+        sources = rec._plm_sources(lib_dir, itr, h) if _sources is None else _sources
+        if itr >= len(sources) or sources[itr] is None:
+            return False
+        meta = rec._plm_checkpoint_meta(lib_dir, itr, h)
+        if meta is None or meta.get('sources', None) != sources[:itr + 1]:
+            return False
+        return rec.get_cacher(lib_dir, 'hessian').is_cached(rec.plm_checkpoint_fname(itr, h))
+
+    @staticmethod
+    def plm_checkpoint_start(lib_dir, itr, h='p', itmin=0, _sources=None):
+        """Returns the largest iteration in [itmin, itr] with a valid cumulative plm checkpoint, or -1 if there is none
+
+        """
+        lib_dir = os.path.abspath(lib_dir)
+        sources = rec._plm_sources(lib_dir, itr, h) if _sources is None else _sources
+        for i in range(itr, max(itmin, 1) - 1, -1):
+            if rec.is_plm_checkpoint_valid(lib_dir, i, h, _sources=sources):
+                return i
+        return -1
+
+    @staticmethod
+    def load_plm_checkpoint(lib_dir, itr, h='p', itmin=0, _sources=None):
+        """Loads the latest valid cumulative plm checkpoint in [itmin, itr]
+
+            The content of the checkpoint is checked against the hash recorded with it, corrupted checkpoints are skipped.
+
+            Returns:
+                (iteration of the checkpoint, plm), or (-1, None) if there is none
+
+        """
+        lib_dir = os.path.abspath(lib_dir)
+        sources = rec._plm_sources(lib_dir, itr, h) if _sources is None else _sources
+        cacher = rec.get_cacher(lib_dir, 'hessian')
+        start = rec.plm_checkpoint_start(lib_dir, itr, h, itmin=itmin, _sources=sources)
+        while start >= 0:
+            plm = cacher.load(rec.plm_checkpoint_fname(start, h))
+            if rec._plm_hash(plm) == rec._plm_checkpoint_meta(lib_dir, start, h).get('sha1', None):
+                return start, plm
+            log.warning('plm checkpoint {} of {} does not match its hash, skipping it'.format(start, lib_dir))
+            start = rec.plm_checkpoint_start(lib_dir, start - 1, h, itmin=itmin, _sources=sources) if start > itmin else -1
+        return -1, None
+
+    @staticmethod
+    def cache_plm_checkpoint(lib_dir, itr, plm, h='p'):
+        """Stores the cumulative plm at iteration 'itr', so that this iterate can later be loaded with a single read
+
+            The hash of the plm and the sizes and modification times of the files it was built from are recorded along with it.
+
+        """
+        lib_dir = os.path.abspath(lib_dir)
+        cacher = rec.get_cacher(lib_dir, 'hessian')
+        cacher.cache(rec.plm_checkpoint_fname(itr, h), plm)
+        fn = os.path.join(lib_dir, 'hessian', rec.plm_checkpoint_fname(itr, h) + '.json')
+        fn_tmp = fn + '.%s.tmp' % os.getpid()
+        with open(fn_tmp, 'w') as f:
+            json.dump({'sha1': rec._plm_hash(plm), 'sources': rec._plm_sources(lib_dir, itr, h)}, f)
+        os.replace(fn_tmp, fn)
+
     @staticmethod
     def load_plms(lib_dir, itrs):
-        """Loads plms for the requested itrs"""
+        """Loads plms for the requested itrs, in the order of itrs
+
+            Starts from the latest valid cumulative checkpoint below each requested iteration, and only sums up
+            the BFGS steps from there on. Without any checkpoint, this rebuilds the plms from phi_plm_it000.
+            If some steps are missing, only the plms of the leading requested iterations that could be built are returned.
+
+        """
         lib_dir = os.path.abspath(lib_dir)
-        cacher = cachers.cacher_npy(lib_dir)
-        itmax = np.max(itrs)
-        sk_fname = lambda k: os.path.join(lib_dir, 'hessian', 'rlm_sn_%s_%s' % (k, 'p'))
-        rlm = alm2rlm(cacher.load(os.path.join(lib_dir, 'phi_plm_it000')))
-        ret = [] if 0 not in itrs else [rlm2alm(rlm)]
-        for i in range(itmax):
-            if cacher.is_cached(sk_fname(i)):
-                rlm += cacher.load(sk_fname(i))
-                if (i + 1) in itrs:
-                    ret.append(rlm2alm(rlm))
-            else:
-                log.info("*** Could only build up to itr number %s"%i)
-                return ret
+        cacher, hess_cacher = rec.get_cacher(lib_dir), rec.get_cacher(lib_dir, 'hessian')
+        itrs = [int(i) for i in np.atleast_1d(itrs)]
+        if len(itrs) == 0:
+            return []
+        sk_fname = lambda k: 'rlm_sn_%s_%s' % (k, 'p')
+        sources = rec._plm_sources(lib_dir, max(itrs))
+        rlm, at = None, -1
+        done = dict()
+        for itr in sorted(set(itrs)):
+            start, plm = rec.load_plm_checkpoint(lib_dir, itr, itmin=at + 1, _sources=sources)
+            if start >= 0:
+                rlm, at = alm2rlm(plm), start
+            elif rlm is None:
+                rlm, at = alm2rlm(cacher.load('phi_plm_it000')), 0
+            for i in range(at, itr):
+                if not hess_cacher.is_cached(sk_fname(i)):
+                    log.info("*** Could only build up to itr number %s"%i)
+                    break
+                rlm += hess_cacher.load(sk_fname(i))
+                at = i + 1
+            if at < itr:
+                break
+            done[itr] = rlm2alm(rlm)
+        ret, seen = [], set()
+        for itr in itrs:
+            if itr not in done:
+                break
+            ret.append(done[itr].copy() if itr in seen else done[itr])
+            seen.add(itr)
         return ret
 
     @staticmethod
@@ -51,8 +286,8 @@ class rec:
 
         """
         lib_dir = os.path.abspath(lib_dir)
-        cacher = cachers.cacher_npy(lib_dir)
-        e_fname = os.path.join(lib_dir, 'wflms', 'wflm_%s_it%s' % ('p', itr))
+        cacher = rec.get_cacher(lib_dir, 'wflms')
+        e_fname = 'wflm_%s_it%s' % ('p', itr)
         assert cacher.is_cached(e_fname), 'cant load ' + e_fname
         return cacher.load(e_fname)
 
@@ -62,20 +297,24 @@ class rec:
 
         """
         lib_dir = os.path.abspath(lib_dir)
-        if not os.path.exists(lib_dir): return False
-        cacher = cachers.cacher_npy(lib_dir)
         if itr <= 0:
-            return cacher.is_cached('%s_plm_it000' % ({'p': 'phi', 'o': 'om'}['p']))
-        sk_fname = lambda k: os.path.join(lib_dir, 'hessian', 'rlm_sn_%s_%s' % (k, 'p'))
-        return cacher.is_cached(sk_fname(itr - 1))
+            subdir, fn = '', '%s_plm_it000' % ({'p': 'phi', 'o': 'om'}['p'])
+        else:
+            sk_fname = lambda k: 'rlm_sn_%s_%s' % (k, 'p')
+            subdir, fn = 'hessian', sk_fname(itr - 1)
+        if rec.get_cacher_type(lib_dir) is cachers.cacher_npy: # a single metadata call, without building a cacher
+            return os.path.exists(os.path.join(lib_dir, subdir, fn + '.npy'))
+        if not os.path.isdir(os.path.join(lib_dir, subdir)):
+            return False
+        return rec.get_cacher(lib_dir, subdir).is_cached(fn)
 
     @staticmethod
     def load_grad(lib_dir, itr):
         #FIXME: load gradient at zero
         assert 0, 'fix gradient load at 0'
         lib_dir = os.path.abspath(lib_dir)
-        cacher = cachers.cacher_npy(lib_dir)
-        yk_fname = lambda k: os.path.join(lib_dir, 'hessian','rlm_yn_%s_%s' % (k, 'p'))
+        cacher = rec.get_cacher(lib_dir, 'hessian')
+        yk_fname = lambda k: 'rlm_yn_%s_%s' % (k, 'p')
         rlm = alm2rlm(load_gradient(0, 'p'))
         for i in range(itr):
             rlm += cacher.load(yk_fname(i))
@@ -63,6 +63,8 @@ class cinv_t(cinv):
             transf: CMB maps transfer function (array)
             ninv: inverse pixel variance map. Must be a list of paths or of healpy maps with consistent nside.
             rescal_cl: isotropic rescaling of the map prior the cg inversion. This just makes the convergence criterium change a bit
+            recycle_nvec(optional): number of approximate low eigenvectors of the cg operator harvested from each solve
+                                    to deflate the next ones (0 disables this)
 
         Note:
 
@@ -71,7 +73,7 @@ class cinv_t(cinv):
 
     """
     def __init__(self, lib_dir, lmax, nside, cl, transf, ninv, rescal_cl='default',
-                 marge_monopole=True, marge_dipole=True, marge_maps=(), pcf='default', chain_descr=None):
+                 marge_monopole=True, marge_dipole=True, marge_maps=(), pcf='default', chain_descr=None, recycle_nvec=0):
 
         assert lib_dir is not None and lmax >= 1024 and nside >= 512, (lib_dir, lmax, nside)
         assert isinstance(ninv, list)
@@ -116,7 +118,7 @@ class cinv_t(cinv):
 
         n_inv_filt = util.jit(opfilt_tt.alm_filter_ninv, ninv, transf_dl,
                         marge_monopole=marge_monopole, marge_dipole=marge_dipole, marge_maps=marge_maps)
-        self.chain = util.jit(multigrid.multigrid_chain, opfilt_tt, chain_descr, dl, n_inv_filt)
+        self.chain = util.jit(multigrid.multigrid_chain, opfilt_tt, chain_descr, dl, n_inv_filt, recycle_nvec=recycle_nvec)
         if mpi.rank == 0:
             if not os.path.exists(lib_dir):
                 os.makedirs(lib_dir)
@@ -213,13 +215,15 @@ class cinv_p(cinv):
             ninv: inverse pixel variance maps. Must be a list of either 3 (QQ, QU, UU) or 1 (QQ = UU noise) elements.
                   These element are themselves list of paths or of healpy maps with consistent nside.
             transf_blm(optional): B-polarization transfer function (if different from E-mode one)
+            recycle_nvec(optional): number of approximate low eigenvectors of the cg operator harvested from each solve
+                                    to deflate the next ones (0 disables this)
 
         Note:
             This implementation now supports template projection
 
     """
     def __init__(self, lib_dir, lmax, nside, cl, transf, ninv, pcf='default',
-                 chain_descr=None, transf_blm=None, marge_qmaps=(), marge_umaps=()):
+                 chain_descr=None, transf_blm=None, marge_qmaps=(), marge_umaps=(), recycle_nvec=0):
         assert lib_dir is not None and lmax >= 1024 and nside >= 512, (lib_dir, lmax, nside)
         super(cinv_p, self).__init__(lib_dir, lmax)
 
@@ -237,7 +241,7 @@ class cinv_p(cinv):
              [0, ["split(stage(1), 1024, diag_cl)"], lmax, nside, np.inf, 1.0e-5, cd_solve.tr_cg, cd_solve.cache_mem()]]
         n_inv_filt = util.jit(opfilt_pp.alm_filter_ninv, ninv, transf[0:lmax + 1],
                               b_transf_b=transf_blm, marge_umaps=marge_umaps, marge_qmaps=marge_qmaps)
-        self.chain = util.jit(multigrid.multigrid_chain, opfilt_pp, chain_descr, cl, n_inv_filt)
+        self.chain = util.jit(multigrid.multigrid_chain, opfilt_pp, chain_descr, cl, n_inv_filt, recycle_nvec=recycle_nvec)
 
         if mpi.rank == 0:
             if not os.path.exists(lib_dir):
@@ -0,0 +1,63 @@
+"""Mean-field store, for leave-one-out mean-fields at O(1) reads.
+
+    The mean-field of Nmf simulations is kept in memory as its sum over the simulations, and the contribution of a simulation is read on demand.
+    The leave-one-out mean-field of a simulation is then (sum - contribution) / (Nmf - 1), without re-reading all other simulations.
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class mf_store:
+    def __init__(self, simidxs_mf, get_sim, get_mf=None):
+        """Mean-field sum and per-simulation contributions, for any key (e.g. the QE key, or the iteration index)
+
+            Args:
+                simidxs_mf: indices of the simulations the mean-field is estimated from
+                get_sim: function (simidx, key) -> contribution of simulation simidx to the mean-field of key
+                get_mf(optional): function (key) -> mean-field of key, if available elsewhere. Otherwise the sum is built from get_sim
+
+            Note:
+                Contributions are not stored again here, get_sim should be a cheap read (e.g. of the cumulative plm checkpoints of the iterator).
+
+        """
+        self.simidxs_mf = [int(simidx) for simidx in simidxs_mf]
+        self.Nmf = len(self.simidxs_mf)
+        self._get_sim = get_sim
+        self._get_mf = get_mf
+        self._sums = dict() # key -> sum over all simidxs_mf, kept in memory
+
+    def get_sim(self, simidx, key):
+        return self._get_sim(int(simidx), key)
+
+    def get_sum(self, key):
+        if key not in self._sums:
+            if self._get_mf is not None:
+                self._sums[key] = self._get_mf(key) * self.Nmf
+            else:
+                ret = None
+                for simidx in self.simidxs_mf:
+                    ret = self.get_sim(simidx, key) if ret is None else ret + self.get_sim(simidx, key)
+                self._sums[key] = ret
+        return self._sums[key]
+
+    def get_mf(self, key):
+        return self.get_sum(key) / self.Nmf
+
+    def get_mf_loo(self, simidx, key):
+        """Mean-field of key, leaving out simulation simidx if it is one of the mean-field simulations
+
+        """
+        if int(simidx) not in self.simidxs_mf or self.Nmf < 2:
+            return self.get_mf(key)
+        return (self.get_sum(key) - self.get_sim(simidx, key)) / (self.Nmf - 1)
+
+    def purge(self, key=None):
+        """Drops the in-memory sums, e.g. after the mean-field on disk changed
+
+        """
+        if key is None:
+            self._sums.clear()
+        else:
+            self._sums.pop(key, None)
@@ -77,33 +77,49 @@ def enable():
 
 
 
+_local_size = None # number of ranks on this node, computed once
+
 def disable():
     
-    global barrier, send, receive, bcast, ANY_SOURCE, name, rank, size, finalize, disabled
+    global barrier, send, receive, bcast, reduce_sum, ANY_SOURCE, name, rank, size, local_size, finalize, disabled
     print('disabling mpi')
     barrier = lambda: -1
     send = lambda _, dest: 0
     receive = lambda _, source: 0
     bcast = lambda _: 0
+    reduce_sum = lambda arr, root=0: arr
     ANY_SOURCE = 0
     disabled = True
     rank = 0
     size = 1
+    local_size = 1
     finalize = lambda: -1
     log.info('mpi.py : disabled, rank %s in %s' % (rank, size))
 
 def init():
 
-    global barrier, send, receive, bcast, ANY_SOURCE, name, rank, size, finalize, disabled
+    global barrier, send, receive, bcast, reduce_sum, ANY_SOURCE, name, rank, size, local_size, finalize, disabled, _local_size
     print('enabling mpi')
     from mpi4py import MPI
+    import numpy as np
     rank = MPI.COMM_WORLD.Get_rank()
     size = MPI.COMM_WORLD.Get_size()
+    if _local_size is None:
+        # collective call: only done in the first init(), which all ranks go through at import.
+        # Later enable() calls may happen on a single rank (e.g. rank 0 re-enabling while the others wait in receive)
+        _local_size = MPI.COMM_WORLD.Split_type(MPI.COMM_TYPE_SHARED).Get_size() # number of ranks on this node
+    local_size = _local_size
     barrier = MPI.COMM_WORLD.Barrier
     ANY_SOURCE = MPI.ANY_SOURCE
     send = MPI.COMM_WORLD.send
     receive = MPI.COMM_WORLD.recv
     bcast = MPI.COMM_WORLD.bcast
+    def reduce_sum(arr, root=0):
+        # element-wise sum of numpy arrays over all ranks, returned on root (None elsewhere)
+        arr = np.ascontiguousarray(arr)
+        ret = np.empty_like(arr) if rank == root else None
+        MPI.COMM_WORLD.Reduce(arr, ret, op=MPI.SUM, root=root)
+        return ret
     finalize = MPI.Finalize
     log.info('mpi.py : setup OK, rank %s in %s' % (rank, size))
 
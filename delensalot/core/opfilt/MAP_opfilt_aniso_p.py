@@ -14,7 +14,7 @@ from lenspyx.remapping import utils_geom
 from lenspyx.remapping.deflection_028 import rtype, ctype
 
 from delensalot.utils import clhash, cli, read_map, timer
-from delensalot.utility.utils_hp import almxfl, Alm, alm2cl, synalm, default_rng
+from delensalot.utility.utils_hp import almxfl, Alm, synalm, default_rng
 from delensalot.core.opfilt import opfilt_base, QE_opfilt_aniso_p, bmodes_ninv as bni
 
 apply_fini = QE_opfilt_aniso_p.apply_fini
@@ -170,7 +170,7 @@ class alm_filter_ninv_wl(opfilt_base.alm_filter_wl):
         if self.verbose:
             print(tim)
 
-    def synalm(self, unlcmb_cls:dict, cmb_phas=None, get_unlelm=False):
+    def synalm(self, unlcmb_cls:dict, cmb_phas=None, get_unlelm=False, rng:np.random.Generator or None=None):
         """Generate some dat maps consistent with noise filter fiducial ingredients
 
             Note:
@@ -179,7 +179,8 @@ class alm_filter_ninv_wl(opfilt_base.alm_filter_wl):
 
 
         """
-        elm = synalm(unlcmb_cls['ee'], self.lmax_sol, self.mmax_sol) if cmb_phas is None else cmb_phas
+        rng = default_rng() if rng is None else rng
+        elm = synalm(unlcmb_cls['ee'], self.lmax_sol, self.mmax_sol, rng=rng) if cmb_phas is None else cmb_phas
         assert Alm.getlmax(elm.size, self.mmax_sol) == self.lmax_sol, (Alm.getlmax(elm.size, self.mmax_sol), self.lmax_sol)
         eblm = self.ffi.lensgclm(elm, self.mmax_sol, 2, self.lmax_len, self.mmax_len)
         almxfl(eblm[0], self.b_transf_elm, self.mmax_len, True)
@@ -189,8 +190,8 @@ class alm_filter_ninv_wl(opfilt_base.alm_filter_wl):
         del eblm # Adding noise
         if len(self.n_inv) == 1: # QQ = UU
             pixnoise = np.sqrt(cli(self.n_inv[0]))
-            QU[0] += default_rng().standard_normal(utils_geom.Geom.npix(self.ninv_geom)) * pixnoise
-            QU[1] += default_rng().standard_normal(utils_geom.Geom.npix(self.ninv_geom)) * pixnoise
+            QU[0] += rng.standard_normal(utils_geom.Geom.npix(self.ninv_geom)) * pixnoise
+            QU[1] += rng.standard_normal(utils_geom.Geom.npix(self.ninv_geom)) * pixnoise
         elif len(self.n_inv) == 3: #QQ UU QU
             assert 0, 'this is not implemented at the moment, but this is easy'
         else:
@@ -262,7 +263,7 @@ class alm_filter_ninv_wl(opfilt_base.alm_filter_wl):
         almxfl(gc[1], fl, mmax_qlm, True)
         return gc
 
-    def get_qlms_mf(self, mfkey, q_pbgeom:utils_geom.pbdGeometry, mchain, phas=None, cls_filt:dict or None=None):
+    def get_qlms_mf(self, mfkey, q_pbgeom:utils_geom.pbdGeometry, mchain, phas=None, cls_filt:dict or None=None, rng:np.random.Generator or None=None):
         """Mean-field estimate using tricks of Carron Lewis appendix
 
 
@@ -270,8 +271,9 @@ class alm_filter_ninv_wl(opfilt_base.alm_filter_wl):
         if mfkey in [1]: # This should be B^t x, D dC D^t B^t Covi x, x random phases in pixel space here
             if phas is None:
                 # unit variance phases in Q U space
-                phas = np.array([default_rng().standard_normal(utils_geom.Geom.npix(self.ninv_geom)),
-                                 default_rng().standard_normal(utils_geom.Geom.npix(self.ninv_geom))])
+                rng = default_rng() if rng is None else rng
+                phas = np.array([rng.standard_normal(utils_geom.Geom.npix(self.ninv_geom)),
+                                 rng.standard_normal(utils_geom.Geom.npix(self.ninv_geom))])
             assert phas[0].size == utils_geom.Geom.npix(self.ninv_geom)
             assert phas[1].size == utils_geom.Geom.npix(self.ninv_geom)
 
@@ -291,7 +293,7 @@ class alm_filter_ninv_wl(opfilt_base.alm_filter_wl):
 
         elif mfkey in [0]: # standard gQE, quite inefficient but simple
             assert phas is None, 'discarding this phase anyways'
-            QUdat = np.array(self.synalm(cls_filt))
+            QUdat = np.array(self.synalm(cls_filt, rng=rng))
             elm_wf = np.zeros(Alm.getsize(self.lmax_sol, self.mmax_sol), dtype=complex)
             mchain.solve(elm_wf, QUdat, dot_op=self.dot_op())
             return self.get_qlms(QUdat, elm_wf, q_pbgeom)
@@ -418,11 +420,12 @@ class dot_op:
         self.lmax = lmax
         self.mmax = min(mmax, lmax)
         self.lmin = int(lmin)
+        self.layout = Alm.layout(self.lmax, self.mmax)
 
     def __call__(self, elm1, elm2):
         assert elm1.size == Alm.getsize(self.lmax, self.mmax), (elm1.size, Alm.getsize(self.lmax, self.mmax))
         assert elm2.size == Alm.getsize(self.lmax, self.mmax), (elm2.size, Alm.getsize(self.lmax, self.mmax))
-        return np.sum(alm2cl(elm1, elm2, self.lmax, self.mmax, None)[self.lmin:] * (2 * np.arange(self.lmin, self.lmax + 1) + 1))
+        return self.layout.dot(elm1, elm2, self.lmin)
 
 
 class fwd_op:
@@ -448,4 +451,4 @@ class fwd_op:
         self.ninv_filt.apply_alm(nlm)
         nlm += almxfl(elm, self.iclee, self.mmax_sol, False)
         almxfl(nlm, self.iclee > 0., self.mmax_sol, True)
-        return nlm
\ No newline at end of file
+        return nlm
@@ -12,7 +12,7 @@ from lenspyx import remapping
 from lenspyx.remapping import utils_geom
 
 from delensalot.utils import clhash, cli, read_map, timer
-from delensalot.utility.utils_hp import almxfl, Alm, alm2cl, synalm, default_rng
+from delensalot.utility.utils_hp import almxfl, Alm, synalm, default_rng
 from delensalot.core.opfilt import opfilt_base, tmodes_ninv as tni
 
 from delensalot.core.opfilt import MAP_opfilt_iso_t
@@ -152,7 +152,7 @@ class alm_filter_ninv_wl(opfilt_base.alm_filter_wl):
         if self.verbose:
             print(tim)
 
-    def synalm(self, unlcmb_cls:dict, cmb_phas=None):
+    def synalm(self, unlcmb_cls:dict, cmb_phas=None, rng:np.random.Generator or None=None):
         """Generate some dat maps consistent with noise filter fiducial ingredients
 
             Note:
@@ -161,14 +161,15 @@ class alm_filter_ninv_wl(opfilt_base.alm_filter_wl):
 
 
         """
-        tlm = synalm(unlcmb_cls['tt'], self.lmax_sol, self.mmax_sol) if cmb_phas is None else cmb_phas
+        rng = default_rng() if rng is None else rng
+        tlm = synalm(unlcmb_cls['tt'], self.lmax_sol, self.mmax_sol, rng=rng) if cmb_phas is None else cmb_phas
         assert Alm.getlmax(tlm.size, self.mmax_sol) == self.lmax_sol, (Alm.getlmax(tlm.size, self.mmax_sol), self.lmax_sol)
         tlm_len = self.ffi.lensgclm(tlm, self.mmax_sol, 0, self.lmax_len, self.mmax_len, backwards=False)
         almxfl(tlm_len, self.b_transf_tlm, self.mmax_len, True)
         # cant use here geom_ since it is using the unit weight transforms
         T = self.ninv_geom.alm2map(tlm_len, self.lmax_len, self.mmax_len, self.ffi.sht_tr, (-1., 1.))
         pixnoise = np.sqrt(cli(self.n_inv))
-        T += default_rng().standard_normal(utils_geom.Geom.npix(self.ninv_geom)) * pixnoise
+        T += rng.standard_normal(utils_geom.Geom.npix(self.ninv_geom)) * pixnoise
         return T
 
     def get_qlms(self, tlm_dat: np.ndarray, tlm_wf: np.ndarray, q_pbgeom: utils_geom.pbdGeometry, alm_wf_leg2=None):
@@ -293,9 +294,10 @@ class dot_op:
         self.lmax = lmax
         self.mmax = min(mmax, lmax)
         self.lmin = int(lmin)
+        self.layout = Alm.layout(self.lmax, self.mmax)
 
     def __call__(self, tlm1, tlm2):
         assert tlm1.size == Alm.getsize(self.lmax, self.mmax), (tlm1.size, Alm.getsize(self.lmax, self.mmax))
         assert tlm2.size == Alm.getsize(self.lmax, self.mmax), (tlm2.size, Alm.getsize(self.lmax, self.mmax))
-        return np.sum(alm2cl(tlm1, tlm2, self.lmax, self.mmax, None)[self.lmin:] * (2 * np.arange(self.lmin, self.lmax + 1) + 1))
+        return self.layout.dot(tlm1, tlm2, self.lmin)
 
@@ -201,7 +201,7 @@ class alm_filter_ninv_wl(opfilt_base.alm_filter_wl):
         if self.verbose:
             print(tim)
 
-    def synalm(self, unlcmb_cls:dict, cmb_phas=None, get_unlelm=False):
+    def synalm(self, unlcmb_cls:dict, cmb_phas=None, get_unlelm=False, rng:np.random.Generator or None=None):
         """Generate some dat maps consistent with noise filter fiducial ingredients
 
             Note:
@@ -211,7 +211,8 @@ class alm_filter_ninv_wl(opfilt_base.alm_filter_wl):
 
         """
         assert 0, 'fix this'
-        elm = synalm(unlcmb_cls['ee'], self.lmax_sol, self.mmax_sol) if cmb_phas is None else cmb_phas
+        rng = default_rng() if rng is None else rng
+        elm = synalm(unlcmb_cls['ee'], self.lmax_sol, self.mmax_sol, rng=rng) if cmb_phas is None else cmb_phas
         assert Alm.getlmax(elm.size, self.mmax_sol) == self.lmax_sol, (Alm.getlmax(elm.size, self.mmax_sol), self.lmax_sol)
         eblm = self.ffi.lensgclm(elm, self.mmax_sol, 2, self.lmax_len, self.mmax_len)
         almxfl(eblm[0], self.b_transf_elm, self.mmax_len, True)
@@ -221,8 +222,8 @@ class alm_filter_ninv_wl(opfilt_base.alm_filter_wl):
         del eblm # Adding noise
         if len(self.n_inv) == 1: # QQ = UU
             pixnoise = np.sqrt(cli(self.n_inv[0]))
-            QU[0] += default_rng().standard_normal(utils_geom.Geom.npix(self.ninv_geom)) * pixnoise
-            QU[1] += default_rng().standard_normal(utils_geom.Geom.npix(self.ninv_geom)) * pixnoise
+            QU[0] += rng.standard_normal(utils_geom.Geom.npix(self.ninv_geom)) * pixnoise
+            QU[1] += rng.standard_normal(utils_geom.Geom.npix(self.ninv_geom)) * pixnoise
         elif len(self.n_inv) == 3: #QQ UU QU
             assert 0, 'this is not implemented at the moment, but this is easy'
         else:
@@ -308,7 +309,7 @@ class alm_filter_ninv_wl(opfilt_base.alm_filter_wl):
         almxfl(gc[1], fl, mmax_qlm, True)
         return gc
 
-    def get_qlms_mf(self, mfkey, q_pbgeom:utils_geom.pbdGeometry, mchain, phas=None, cls_filt:dict or None=None):
+    def get_qlms_mf(self, mfkey, q_pbgeom:utils_geom.pbdGeometry, mchain, phas=None, cls_filt:dict or None=None, rng:np.random.Generator or None=None):
         """Mean-field estimate using tricks of Carron Lewis appendix
 
 
@@ -317,8 +318,9 @@ class alm_filter_ninv_wl(opfilt_base.alm_filter_wl):
         if mfkey in [1]: # This should be B^t x, D dC D^t B^t Covi x, x random phases in pixel space here
             if phas is None:
                 # unit variance phases in Q U space
-                phas = np.array([default_rng().standard_normal(utils_geom.Geom.npix(self.ninv_geom)),
-                                 default_rng().standard_normal(utils_geom.Geom.npix(self.ninv_geom))])
+                rng = default_rng() if rng is None else rng
+                phas = np.array([rng.standard_normal(utils_geom.Geom.npix(self.ninv_geom)),
+                                 rng.standard_normal(utils_geom.Geom.npix(self.ninv_geom))])
             assert phas[0].size == utils_geom.Geom.npix(self.ninv_geom)
             assert phas[1].size == utils_geom.Geom.npix(self.ninv_geom)
 
@@ -338,7 +340,7 @@ class alm_filter_ninv_wl(opfilt_base.alm_filter_wl):
 
         elif mfkey in [0]: # standard gQE, quite inefficient but simple
             assert phas is None, 'discarding this phase anyways'
-            QUdat = np.array(self.synalm(cls_filt))
+            QUdat = np.array(self.synalm(cls_filt, rng=rng))
             elm_wf = np.zeros(Alm.getsize(self.lmax_sol, self.mmax_sol), dtype=complex)
             mchain.solve(elm_wf, QUdat, dot_op=self.dot_op())
             return self.get_qlms(QUdat, elm_wf, q_pbgeom)
@@ -13,7 +13,8 @@ import numpy as np
 
 from lenspyx import remapping
 from lenspyx.utils import timer, cli
-from lenspyx.utils_hp import almxfl, Alm, synalm
+from lenspyx.utils_hp import almxfl, Alm
+from delensalot.utility.utils_hp import synalm
 from lenspyx.remapping.utils_geom import pbdGeometry
 
 from delensalot.core.opfilt import opfilt_base, MAP_opfilt_aniso_p
@@ -111,7 +112,7 @@ class alm_filter_nlev_wl(opfilt_base.alm_filter_wl):
         """Applies noise operator in place"""
         almxfl(elm.squeeze(), self.inoise_1_elm * cli(self.transf_elm), self.mmax_len, True)
 
-    def synalm(self, unlcmb_cls:dict, cmb_phas=None, get_unlelm=True):
+    def synalm(self, unlcmb_cls:dict, cmb_phas=None, get_unlelm=True, rng:np.random.Generator or None=None):
         """Generate some dat maps consistent with noise filter fiducial ingredients
 
             Note:
@@ -120,12 +121,12 @@ class alm_filter_nlev_wl(opfilt_base.alm_filter_wl):
 
 
         """
-        elm = synalm(unlcmb_cls['ee'], self.lmax_sol, self.mmax_sol) if cmb_phas is None else cmb_phas
+        elm = synalm(unlcmb_cls['ee'], self.lmax_sol, self.mmax_sol, rng=rng) if cmb_phas is None else cmb_phas
         assert Alm.getlmax(elm.size, self.mmax_sol) == self.lmax_sol, (Alm.getlmax(elm.size, self.mmax_sol), self.lmax_sol)
         elm = self.ffi.lensgclm(np.atleast_2d(elm), self.mmax_sol, 2, self.lmax_len, self.mmax_len, False,
                                 out_sht_mode='GRAD_ONLY').squeeze()
         almxfl(elm, self.transf_elm, self.mmax_len, True)
-        elm += synalm((np.ones(self.lmax_len + 1) * (self.nlev_elm / 180 / 60 * np.pi) ** 2) * (self.transf_elm > 0), self.lmax_len, self.mmax_len)
+        elm += synalm((np.ones(self.lmax_len + 1) * (self.nlev_elm / 180 / 60 * np.pi) ** 2) * (self.transf_elm > 0), self.lmax_len, self.mmax_len, rng=rng)
         return elm
 
     def get_qlms(self, elm_dat: np.ndarray or list, elm_wf: np.ndarray, q_pbgeom: pbdGeometry, alm_wf_leg2:None or np.ndarray =None):
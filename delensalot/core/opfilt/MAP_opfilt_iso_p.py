@@ -12,7 +12,8 @@ import numpy as np
 from scipy.interpolate import UnivariateSpline as spl
 
 from lenspyx import remapping
-from lenspyx.utils_hp import almxfl,   Alm, synalm
+from lenspyx.utils_hp import almxfl,   Alm
+from delensalot.utility.utils_hp import synalm
 from lenspyx.utils import timer, cli
 from lenspyx.remapping.utils_geom import pbdGeometry
 from lenspyx.remapping.deflection_028 import rtype, ctype
@@ -132,7 +133,7 @@ class alm_filter_nlev_wl(opfilt_base.alm_filter_wl):
         almxfl(eblm[0], self.inoise_1_elm * cli(self.transf_elm), self.mmax_len, True)
         almxfl(eblm[1], self.inoise_1_blm * cli(self.transf_elm), self.mmax_len, True)
 
-    def synalm(self, unlcmb_cls:dict, cmb_phas=None, get_unlelm=True):
+    def synalm(self, unlcmb_cls:dict, cmb_phas=None, get_unlelm=True, rng:np.random.Generator or None=None):
         """Generate some dat maps consistent with noise filter fiducial ingredients
 
             Note:
@@ -141,13 +142,13 @@ class alm_filter_nlev_wl(opfilt_base.alm_filter_wl):
 
 
         """
-        elm = synalm(unlcmb_cls['ee'], self.lmax_sol, self.mmax_sol) if cmb_phas is None else cmb_phas
+        elm = synalm(unlcmb_cls['ee'], self.lmax_sol, self.mmax_sol, rng=rng) if cmb_phas is None else cmb_phas
         assert Alm.getlmax(elm.size, self.mmax_sol) == self.lmax_sol, (Alm.getlmax(elm.size, self.mmax_sol), self.lmax_sol)
         eblm = self.ffi.lensgclm(np.atleast_2d(elm), self.mmax_sol, 2, self.lmax_len, self.mmax_len)
         almxfl(eblm[0], self.transf_elm, self.mmax_len, True)
         almxfl(eblm[1], self.transf_blm, self.mmax_len, True)
-        eblm[0] += synalm((np.ones(self.lmax_len + 1) * (self.nlev_elm / 180 / 60 * np.pi) ** 2) * (self.transf_elm > 0), self.lmax_len, self.mmax_len)
-        eblm[1] += synalm((np.ones(self.lmax_len + 1) * (self.nlev_blm / 180 / 60 * np.pi) ** 2) * (self.transf_blm > 0), self.lmax_len, self.mmax_len)
+        eblm[0] += synalm((np.ones(self.lmax_len + 1) * (self.nlev_elm / 180 / 60 * np.pi) ** 2) * (self.transf_elm > 0), self.lmax_len, self.mmax_len, rng=rng)
+        eblm[1] += synalm((np.ones(self.lmax_len + 1) * (self.nlev_blm / 180 / 60 * np.pi) ** 2) * (self.transf_blm > 0), self.lmax_len, self.mmax_len, rng=rng)
         return elm, eblm if get_unlelm else eblm
 
     def _get_qlms_old(self, eblm_dat: np.ndarray or list, elm_wf: np.ndarray, q_pbgeom: pbdGeometry, alm_wf_leg2:None or np.ndarray =None):
@@ -215,15 +216,15 @@ class alm_filter_nlev_wl(opfilt_base.alm_filter_wl):
         almxfl(gc[1], fl, mmax_qlm, True)
         return gc
 
-    def get_qlms_mf(self, mfkey, q_pbgeom:pbdGeometry, mchain, phas=None, cls_filt:dict or None=None):
+    def get_qlms_mf(self, mfkey, q_pbgeom:pbdGeometry, mchain, phas=None, cls_filt:dict or None=None, rng:np.random.Generator or None=None):
         """Mean-field estimate using tricks of Carron Lewis appendix
 
 
         """
         if mfkey in [1]: # This should be B^t x, D dC D^t B^t Covi x, x random phases in alm space
             if phas is None:
-                phas = np.array([synalm(np.ones(self.lmax_len + 1, dtype=float), self.lmax_len, self.mmax_len),
-                                 synalm(np.ones(self.lmax_len + 1, dtype=float), self.lmax_len, self.mmax_len)])
+                phas = np.array([synalm(np.ones(self.lmax_len + 1, dtype=float), self.lmax_len, self.mmax_len, rng=rng),
+                                 synalm(np.ones(self.lmax_len + 1, dtype=float), self.lmax_len, self.mmax_len, rng=rng)])
             assert Alm.getlmax(phas[0].size, self.mmax_len) == self.lmax_len
             assert Alm.getlmax(phas[1].size, self.mmax_len) == self.lmax_len
 
@@ -241,7 +242,7 @@ class alm_filter_nlev_wl(opfilt_base.alm_filter_wl):
             del repmap, impmap, Gs, Cs
         elif mfkey in [0]: # standard gQE, quite inefficient but simple
             assert phas is None, 'discarding this phase anyways'
-            elm_pha, eblm_dat = self.synalm(cls_filt)
+            elm_pha, eblm_dat = self.synalm(cls_filt, rng=rng)
             eblm_dat = np.array(eblm_dat)
             elm_wf = np.zeros(Alm.getsize(self.lmax_sol, self.mmax_sol), dtype=complex)
             mchain.solve(elm_wf, eblm_dat, dot_op=self.dot_op())
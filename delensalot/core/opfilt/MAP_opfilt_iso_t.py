@@ -143,14 +143,14 @@ class alm_filter_nlev_wl(opfilt_base.alm_filter_wl):
         almxfl(C, fl, self.ffi.mmax_dlm, True)
         return G, C
 
-    def get_qlms_mf(self, mfkey, q_pbgeom:utils_geom.pbdGeometry, mchain, phas=None, cls_filt:dict or None=None):
+    def get_qlms_mf(self, mfkey, q_pbgeom:utils_geom.pbdGeometry, mchain, phas=None, cls_filt:dict or None=None, rng:np.random.Generator or None=None):
         """Mean-field estimate using tricks of Carron Lewis appendix
 
 
         """
         if mfkey in [1]: # This should be B^t x, D dC D^t B^t Covi x, x random phases in alm space
             if phas is None:
-                phas = synalm(np.ones(self.lmax_len + 1, dtype=float), self.lmax_len, self.mmax_len)
+                phas = synalm(np.ones(self.lmax_len + 1, dtype=float), self.lmax_len, self.mmax_len, rng=rng)
             assert Alm.getlmax(phas.size, self.mmax_len) == self.lmax_len
 
             soltn = np.zeros(Alm.getsize(self.lmax_sol, self.mmax_sol), dtype=complex)
@@ -12,7 +12,7 @@ from scipy.interpolate import UnivariateSpline as spl
 from lenspyx.remapping import utils_geom
 
 from delensalot.utils import timer, cli, clhash, read_map
-from delensalot.utility.utils_hp import almxfl, Alm, alm2cl
+from delensalot.utility.utils_hp import almxfl, Alm
 from delensalot.core.opfilt import bmodes_ninv as bni
 
 
@@ -299,14 +299,15 @@ class dot_op:
         if mmax is None or mmax < 0: mmax = lmax
         self.lmax = lmax
         self.mmax = min(mmax, lmax)
+        self.layout = Alm.layout(self.lmax, self.mmax)
 
     def __call__(self, eblm1, eblm2):
         assert eblm1[0].size == Alm.getsize(self.lmax, self.mmax), (eblm1[0].size, Alm.getsize(self.lmax, self.mmax))
         assert eblm2[0].size == Alm.getsize(self.lmax, self.mmax), (eblm2[0].size, Alm.getsize(self.lmax, self.mmax))
         assert eblm1[1].size == Alm.getsize(self.lmax, self.mmax), (eblm1[1].size, Alm.getsize(self.lmax, self.mmax))
         assert eblm2[1].size == Alm.getsize(self.lmax, self.mmax), (eblm2[1].size, Alm.getsize(self.lmax, self.mmax))
-        ret  = np.sum(alm2cl(eblm1[0], eblm2[0], self.lmax, self.mmax, None) * (2 * np.arange(self.lmax + 1) + 1))
-        ret += np.sum(alm2cl(eblm1[1], eblm2[1], self.lmax, self.mmax, None) * (2 * np.arange(self.lmax + 1) + 1))
+        ret  = self.layout.dot(eblm1[0], eblm2[0])
+        ret += self.layout.dot(eblm1[1], eblm2[1])
         return ret
 
 class fwd_op:
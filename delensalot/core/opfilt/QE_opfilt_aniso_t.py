@@ -11,7 +11,7 @@ from scipy.interpolate import UnivariateSpline as spl
 from lenspyx.remapping import utils_geom
 
 from delensalot.utils import timer, cli, clhash, read_map
-from delensalot.utility.utils_hp import almxfl, Alm, alm2cl
+from delensalot.utility.utils_hp import almxfl, Alm
 from delensalot.core.opfilt import tmodes_ninv as tni
 
 
@@ -216,11 +216,12 @@ class dot_op:
         self.lmax = lmax
         self.mmax = min(mmax, lmax)
         self.lmin = int(lmin)
+        self.layout = Alm.layout(self.lmax, self.mmax)
 
     def __call__(self, tlm1, tlm2):
         assert tlm1.size == Alm.getsize(self.lmax, self.mmax), (tlm1.size, Alm.getsize(self.lmax, self.mmax))
         assert tlm2.size == Alm.getsize(self.lmax, self.mmax), (tlm2.size, Alm.getsize(self.lmax, self.mmax))
-        return np.sum(alm2cl(tlm1, tlm2, self.lmax, self.mmax, None)[self.lmin:] * (2 * np.arange(self.lmin, self.lmax + 1) + 1))
+        return self.layout.dot(tlm1, tlm2, self.lmin)
 
 
 
@@ -33,7 +33,7 @@ class alm_filter_wl(object):
         """Estimate of the quadratic likelihood piece, for data dat_map and alm_wf wiener filtered estimate"""
         assert 0, 'sub-class this'
 
-    def get_qlms_mf(self, mfkey, q_pbgeom:pbdGeometry, mchain, phas=None, cls_filt:dict or None=None):
+    def get_qlms_mf(self, mfkey, q_pbgeom:pbdGeometry, mchain, phas=None, cls_filt:dict or None=None, rng:np.random.Generator or None=None):
         """Estimate of the quadratic likelihood piece, for data dat_map and alm_wf wiener filtered estimate"""
         assert 0, 'sub-class this'
 
@@ -41,5 +41,5 @@ class alm_filter_wl(object):
         """This must give the scalar product instance betweem two cg-solution estimates"""
         assert 0, 'sub-class this'
 
-    def synalm(self, cmbcls:dict, cmb_phas=None):
+    def synalm(self, cmbcls:dict, cmb_phas=None, rng:np.random.Generator or None=None):
         assert 0, 'subclass this'
\ No newline at end of file
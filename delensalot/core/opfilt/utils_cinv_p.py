@@ -33,13 +33,15 @@ class cinv_p(filt_cinv.cinv):
             transf: CMB maps transfer function (array)
             ninv: inverse pixel variance maps. Must be a list of either 3 (QQ, QU, UU) or 1 (QQ = UU noise) elements.
                   These element are themselves list of paths or of healpy maps with consistent nside.
+            recycle_nvec(optional): number of approximate low eigenvectors of the cg operator harvested from each solve
+                                    to deflate the next ones (0 disables this)
 
         Note:
             this implementation does not support template projection
 
     """
     def __init__(self, lib_dir, lmax, nside, cl, transf, ninv, geom,
-                 pcf='default', chain_descr=None, _bmarg_lib_dir=None, _bmarg_rescal=1., zbounds=(-1., 1.), bmarg_lmax=0, sht_threads=8):
+                 pcf='default', chain_descr=None, _bmarg_lib_dir=None, _bmarg_rescal=1., zbounds=(-1., 1.), bmarg_lmax=0, sht_threads=8, recycle_nvec=0):
         assert lib_dir is not None and lmax >= 1024 and nside >= 512, (lib_dir, lmax, nside)
         super(cinv_p, self).__init__(lib_dir, lmax)
         
@@ -55,7 +57,7 @@ class cinv_p(filt_cinv.cinv):
              [0, ["split(stage(1), 1024, diag_cl)"], lmax, nside, np.inf, 1.0e-5, cd_solve.tr_cg, cd_solve.cache_mem()]]
         self.n_inv_filt = util.jit(bmodes_ninv.eblm_filter_ninv, geom, ninv, transf[0:lmax + 1],
                               lmax_marg=bmarg_lmax, zbounds=zbounds, _bmarg_lib_dir=_bmarg_lib_dir, _bmarg_rescal=_bmarg_rescal, sht_threads=sht_threads)
-        self.chain = util.jit(multigrid.multigrid_chain, opfilt_pp, chain_descr, cl, self.n_inv_filt)
+        self.chain = util.jit(multigrid.multigrid_chain, opfilt_pp, chain_descr, cl, self.n_inv_filt, recycle_nvec=recycle_nvec)
 
         if not os.path.exists(lib_dir):
             os.makedirs(lib_dir)
@@ -0,0 +1,91 @@
+"""Producer/consumer pipelines of threads.
+
+    Items pass a sequence of stages, each stage running in its own thread and handing its results to the next stage through a bounded queue.
+    The SHTs, the lensing and the disk writes release the GIL, so that e.g. the lensing of one simulation overlaps with the writes of the previous ones,
+    while the bounded queues keep at most a few items in flight between any two stages.
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+
+import time, threading, queue, traceback
+
+_STOP = object() # end-of-stream marker
+
+
+class stage:
+    def __init__(self, name, func):
+        """One step of a pipeline
+
+            Args:
+                name: name of the stage, for the logs
+                func: function (item, data) -> data passed on to the next stage. data is None for the first stage
+
+        """
+        self.name = name
+        self.func = func
+        self.nitems = 0
+        self.busy = 0. # seconds spent in func
+        self.wall = 0. # seconds from start of the pipeline to the last item done
+
+    def throughput(self):
+        return self.nitems / self.busy if self.busy > 0 else float('inf')
+
+    def __str__(self):
+        return "stage {}: {} items, {:.1f} secs busy ({:.2f} items/sec), {:.0f}% of the {:.1f} secs wall time".format(
+            self.name, self.nitems, self.busy, self.throughput(), 100 * self.busy / max(self.wall, 1e-12), self.wall)
+
+
+def run(stages, items, maxsize=2):
+    """Passes all items through the stages, in order, and returns when the last stage is done with all of them
+
+        Args:
+            stages: list of stage instances
+            items: items fed to the first stage
+            maxsize: capacity of the queues between the stages
+
+        The first exception raised by a stage is re-raised here, after the remaining items are drained.
+
+    """
+    queues = [queue.Queue(maxsize=maxsize) for _ in stages]
+    failed = []
+    t0 = time.time()
+
+    def work(i, _stage):
+        while True:
+            entry = queues[i].get()
+            if entry is _STOP:
+                break
+            if failed: # drain, so that the upstream stages never block
+                continue
+            item, data = entry
+            t1 = time.time()
+            try:
+                data = _stage.func(item, data)
+            except Exception as e:
+                log.error("pipeline stage {} failed on item {}:\n{}".format(_stage.name, item, traceback.format_exc()))
+                failed.append(e)
+                continue
+            _stage.busy += time.time() - t1
+            _stage.nitems += 1
+            _stage.wall = time.time() - t0
+            if i + 1 < len(stages):
+                queues[i + 1].put((item, data))
+        if i + 1 < len(stages):
+            queues[i + 1].put(_STOP)
+
+    threads = [threading.Thread(target=work, args=(i, _stage), name='pipeline-' + _stage.name, daemon=True) for i, _stage in enumerate(stages)]
+    for thread in threads:
+        thread.start()
+    for item in items:
+        if failed:
+            break
+        queues[0].put((item, None))
+    queues[0].put(_STOP)
+    for thread in threads:
+        thread.join()
+    for _stage in stages:
+        log.info(str(_stage))
+    if failed:
+        raise failed[0]
@@ -3,12 +3,15 @@
     Based on plancklens wigners implementation
 
 """
+import os, hashlib
 import healpy as hp
 import numpy as np
 
 from plancklens.wigners import wigners
 from plancklens import utils
 
+from delensalot.utility.utils_hp import alm2cl
+
 
 def map2alm(tmap, lmax=None, mmax=None, zbounds=np.array([-1., 1.]), iter=0):
     return hp.map2alm(tmap, lmax=lmax, mmax=mmax, iter=0)
@@ -39,6 +42,40 @@ def _wwi(ww, verbose=False):
     ret[ii] = 1. / ww[ii]
     return ret
 
+def _coupling_hash(*keys):
+    """Hash of the arrays and parameters defining a coupling matrix
+
+    """
+    h = hashlib.sha1()
+    for key in keys:
+        if isinstance(key, (list, tuple, np.ndarray)) and np.asarray(key).dtype.kind in 'biufc':
+            key = np.ascontiguousarray(key)
+            h.update(str((key.dtype, key.shape)).encode())
+            h.update(key.tobytes())
+        else:
+            # scalars, None and anything else by value. Never as object arrays, whose bytes are memory addresses
+            h.update(repr(key.item() if isinstance(key, np.generic) else key).encode())
+    return h.hexdigest()
+
+def _cached_coupling(lib_dir, keys, calc):
+    """Returns the dict of arrays *calc()*, cached as npz file in *lib_dir* under the hash of *keys*
+
+        Without lib_dir, this just calls calc(). The file is written atomically, so that concurrent processes can share the cache.
+
+    """
+    if lib_dir is None:
+        return calc()
+    fn = os.path.join(lib_dir, 'coupling_%s.npz'%_coupling_hash(*keys))
+    if os.path.exists(fn):
+        with np.load(fn) as f:
+            return {k: f[k] for k in f.files}
+    ret = calc()
+    os.makedirs(lib_dir, exist_ok=True)
+    fn_tmp = fn[:-len('.npz')] + '_%d_tmp.npz'%os.getpid()
+    np.savez(fn_tmp, **ret)
+    os.replace(fn_tmp, fn)
+    return ret
+
 def map2cl(tmap, mask, lmax, lmax_mask, tmap2=None, npts=None, ww=None, zbounds=np.array([-1.,1.])):
     """Position space 2pcf deconvolver for spin-0 maps.
 
@@ -241,9 +278,101 @@ def map2cls(tqumap, tmask, pmask, lmax, lmax_mask, tqumap2=None,
 
 
 
+def _masked_alms(tmaps, mask, lmax):
+    """alms of a stack of masked spin-0 maps, from a single healpy call
+
+        Returns:
+            array of shape (nmaps, nalm)
+
+    """
+    return np.atleast_2d(hp.map2alm(np.atleast_2d(tmaps) * mask, lmax=lmax, iter=0, pol=False))
+
+def _masked_alms_spin(qumaps, spin, mask, lmax, zbounds=np.array([-1.,1.])):
+    """gradient and curl alms of a stack of masked spin-weight maps
+
+        Returns:
+            two arrays of shape (nmaps, nalm)
+
+    """
+    alms = np.array([hph.map2alm_spin([qumap[0] * mask, qumap[1] * mask], spin, lmax=lmax, zbounds=zbounds) for qumap in qumaps])
+    return alms[:, 0], alms[:, 1]
+
+def _get_xgwg_wwi(mask, lmax, lmax_mask, npts=None, ww=None):
+    """Gauss-Legendre points, and weights times inverse mask 2pcf, shared by all maps with the same mask
+
+    """
+    if npts is None:
+        npts = min(15000, 2 * max(lmax, lmax_mask))
+    xg, wg = wigners.get_xgwg(-1., 1., npts)
+    if ww is None:
+        ww = wigners.wignerpos(hp.alm2cl(hph.map2alm(mask, lmax=lmax_mask)), xg, 0, 0) # mask 2pcf
+    return xg, _wwi(ww, verbose=True) * wg
+
+def map2cl_stack(tmaps, mask, lmax, lmax_mask, tmaps2=None, npts=None, ww=None):
+    """Position space 2pcf deconvolver for a stack of spin-0 maps with the same mask (e.g. many simulations or iterations)
+
+        Same as map2cl for each map, but the mask 2pcf and quadrature are calculated once,
+        all masked maps are transformed in a single call and all pseudo-spectra in one vectorized pass.
+
+        Args:
+            tmaps: healpy maps, of shape (nmaps, npix)
+            tmaps2: second maps of same shape, in case of cross-spectra
+
+        Returns:
+            spectra, of shape (nmaps, lmax + 1)
+
+    """
+    tmaps = np.atleast_2d(tmaps)
+    assert mask.size == tmaps.shape[-1], (mask.size, tmaps.shape)
+    nside = hp.npix2nside(mask.size)
+    xg, wwi_wg = _get_xgwg_wwi(mask, lmax, lmax_mask, npts=npts, ww=ww)
+    lmax_alm = min(3 * nside - 1, lmax + lmax_mask)
+    palms = _masked_alms(tmaps, mask, lmax_alm)
+    palms2 = None if tmaps2 is None else _masked_alms(tmaps2, mask, lmax_alm)
+    pcls = alm2cl(palms, palms2, lmax_alm, lmax_alm, lmax_alm)
+    return np.array([wigners.wignercoeff(wigners.wignerpos(pcl, xg, 0, 0) * wwi_wg, xg, 0, 0, lmax=lmax) for pcl in pcls])
+
+def map2cl_spin_stack(qumaps, spin, mask, lmax, lmax_mask, qumaps2=None, npts=None, ww=None, zbounds=np.array([-1.,1.])):
+    """Position space 2pcf deconvolver for a stack of spin-weight maps with the same mask
+
+        Same as map2cl_spin for each map (no EB and BE spectra), with the mask 2pcf and quadrature calculated once,
+        and all pseudo-spectra in one vectorized pass.
+
+        Args:
+            qumaps: real and imag. parts of the maps, of shape (nmaps, 2, npix)
+            qumaps2: second maps of same shape and spin, in case of cross-spectra
+
+        Returns:
+            gradient and curl spectra, each of shape (nmaps, lmax + 1)
+
+    """
+    assert spin > 0, spin
+    qumaps = np.asarray(qumaps)
+    assert qumaps.ndim == 3 and qumaps.shape[1] == 2, qumaps.shape
+    assert mask.size == qumaps.shape[-1], (mask.size, qumaps.shape)
+    nside = hp.npix2nside(mask.size)
+    xg, wwi_wg = _get_xgwg_wwi(mask, lmax, lmax_mask, npts=npts, ww=ww)
+    lmax_alm = min(3 * nside - 1, lmax + lmax_mask)
+    elms, blms = _masked_alms_spin(qumaps, spin, mask, lmax_alm, zbounds=zbounds)
+    if qumaps2 is None:
+        ees, bbs = alm2cl(elms, None, lmax_alm, lmax_alm, lmax_alm), alm2cl(blms, None, lmax_alm, lmax_alm, lmax_alm)
+    else:
+        elms2, blms2 = _masked_alms_spin(qumaps2, spin, mask, lmax_alm, zbounds=zbounds)
+        ees, bbs = alm2cl(elms, elms2, lmax_alm, lmax_alm, lmax_alm), alm2cl(blms, blms2, lmax_alm, lmax_alm, lmax_alm)
+        del elms2, blms2
+    del elms, blms
+    ret_ee, ret_bb = np.zeros((len(qumaps), lmax + 1)), np.zeros((len(qumaps), lmax + 1))
+    for i, (ee, bb) in enumerate(zip(ees, bbs)):
+        ret_p = wigners.wignercoeff(wigners.wignerpos(ee + bb, xg,  spin, spin) * wwi_wg, xg,  spin, spin, lmax)
+        ret_m = wigners.wignercoeff(wigners.wignerpos(ee - bb, xg, -spin, spin) * wwi_wg, xg, -spin, spin, lmax)
+        ret_ee[i] = 0.5 * (ret_p + ret_m)
+        ret_bb[i] = 0.5 * (ret_p - ret_m)
+    return ret_ee, ret_bb
+
+
 class map2cl_binned:
 
-    def __init__(self, mask, cl_templ, edges, lmax_mask, npts=None, zbounds=(-1., 1.)):
+    def __init__(self, mask, cl_templ, edges, lmax_mask, npts=None, zbounds=(-1., 1.), lib_dir=None):
         """Binned coupling matrix for polspice-like approach to deconvolution of spin-0 spectrum estimate
 
             The number of bins is expected to be reasonable (cost is that of nbins wigner transforms)
@@ -257,6 +386,7 @@ class map2cl_binned:
                 edges     : multipoles defining the bins
                 lmax_mask : highest multipole considered for the mask
                 zbounds   : uses latitude bounded shts if set
+                lib_dir   : if set, the coupling matrix is cached there, keyed on the mask, lmax_mask, edges, template and npts
 
             #FIXME: check modifs to apport if non-boolean mask (if at all?)
 
@@ -275,12 +405,15 @@ class map2cl_binned:
         self.lmax_mask = lmax_mask
 
         self.zbounds=zbounds
-        M, xg_0, ww, xg, wg = self._get_mab(self.mask, lmax_mask)
+        def calc():
+            M, xg_0, ww, xg, wg = self._get_mab(self.mask, lmax_mask)
+            return {'M': M, 'Mi': np.linalg.inv(M), 'xg_0': xg_0, 'ww': ww, 'xg': xg, 'wg': wg}
+        mab = _cached_coupling(lib_dir, [self.mask, lmax_mask, self.edges, self.cl_templ, self.npts], calc)
 
-        self.xg_0 = xg_0
-        self.Mi = np.linalg.inv(M)
-        self.wwi_wg = _wwi(ww) * wg
-        self.xg = xg
+        self.xg_0 = float(mab['xg_0'])
+        self.Mi = mab['Mi']
+        self.wwi_wg = _wwi(mab['ww']) * mab['wg']
+        self.xg = mab['xg']
 
         self.fsky2 = np.mean(self.mask ** 2)
 
@@ -361,7 +494,6 @@ class map2cl_binned:
 
         """
         nside = hp.npix2nside(tmap.size)
-        Nb = len(self.edges) - 1
         if tmap2 is None:
             pcl = hp.alm2cl(hph.map2alm(tmap * self.mask, lmax=min(3 * nside - 1, self.lmax), zbounds=self.zbounds))
         else:
@@ -369,6 +501,13 @@ class map2cl_binned:
             alm2 = hph.map2alm(tmap2 * self.mask, lmax=min(3 * nside - 1, self.lmax), zbounds=self.zbounds)
             pcl = hp.alm2cl(alm1, alms2=alm2)
             del alm1, alm2
+        return self._pcl2bcl(pcl)
+
+    def _pcl2bcl(self, pcl):
+        """Deconvolved and binned spectra amplitudes from pseudo-spectrum *pcl*, before the coupling matrix
+
+        """
+        Nb = len(self.edges) - 1
         cl = wigners.wignercoeff(wigners.wignerpos(pcl, self.xg, 0, 0) * self.wwi_wg, self.xg, 0, 0, lmax=self.lmax)
         ret = np.zeros(Nb)
         for ia, (bl, bu) in enumerate(zip(self.edges[:-1], self.edges[1:] - 1)):
@@ -388,10 +527,49 @@ class map2cl_binned:
         """
         return np.dot(self.Mi, self._map2pcl(tmap, tmap2=tmap2))
 
+    def map2cls(self, tmaps, tmaps2=None):
+        """Same as map2cl for a stack of maps, of shape (nmaps, npix), with a single transform call and one vectorized pseudo-spectra pass
+
+            Returns:
+                binned spectra, of shape (nmaps, nbins)
+
+        """
+        nside = hp.npix2nside(self.mask.size)
+        lmax = min(3 * nside - 1, self.lmax)
+        palms = _masked_alms(tmaps, self.mask, lmax)
+        palms2 = None if tmaps2 is None else _masked_alms(tmaps2, self.mask, lmax)
+        pcls = alm2cl(palms, palms2, lmax, lmax, lmax)
+        return np.array([self._pcl2bcl(pcl) for pcl in pcls]) @ self.Mi.T
+
+
+def map2cl_binned_masks(libs, tmap):
+    """Binned spectra of a spin-0 map for several masks at once
+
+        The masked maps are transformed in a single (batched) map2alm call, and each spectrum is then deconvolved as in *map2cl*.
+
+        Args:
+            libs: list of map2cl_binned instances, one for each mask
+            tmap: healpy map to get the spectra of
+
+        Returns:
+            list of binned spectra, one for each of *libs*
+
+    """
+    nside = hp.npix2nside(tmap.size)
+    lmax = min(3 * nside - 1, max(lib.lmax for lib in libs))
+    alms = hp.map2alm(np.array([tmap * lib.mask for lib in libs]), lmax=lmax, iter=0, pol=False)
+    if len(libs) == 1:
+        alms = [alms]
+    ret = []
+    for lib, alm in zip(libs, alms):
+        pcl = hp.alm2cl(alm)[:min(3 * nside - 1, lib.lmax) + 1]
+        ret.append(np.dot(lib.Mi, lib._pcl2bcl(pcl)))
+    return ret
+
 
 class map2cl_spin_binned:
 
-    def __init__(self, mask, spin, clg_templ, clc_templ, edges, lmax_mask, npts=None, zbounds=(-1., 1.)):
+    def __init__(self, mask, spin, clg_templ, clc_templ, edges, lmax_mask, npts=None, zbounds=(-1., 1.), lib_dir=None):
         """Binned coupling matrix for polspice-like approach to deconvolution of spin-0 spectrum estimate
 
             The number of bins is expected to be reasonable (cost is that of nbins wigner transforms)
@@ -407,6 +585,7 @@ class map2cl_spin_binned:
                 edges     : multipoles defining the bins
                 lmax_mask : highest multipole considered for the mask
                 zbounds   : uses latitude bounded shts if set
+                lib_dir   : if set, the coupling matrices are cached there, keyed on the mask, spin, lmax_mask, edges, templates and npts
 
             Note:
                 No pure estimator here
@@ -438,14 +617,17 @@ class map2cl_spin_binned:
         self.lmax_mask = lmax_mask
 
         self.zbounds=zbounds
-        Mp, Mm, xg_0, ww, xg, wg = self._get_mab(self.mask, lmax_mask)
+        def calc():
+            Mp, Mm, xg_0, ww, xg, wg = self._get_mab(self.mask, lmax_mask)
+            return {'Mp': Mp, 'Mm': Mm, 'Mpi': np.linalg.inv(Mp), 'Mmi': np.linalg.inv(Mm), 'xg_0': xg_0, 'ww': ww, 'xg': xg, 'wg': wg}
+        mab = _cached_coupling(lib_dir, [self.mask, spin, lmax_mask, self.edges, self.clg_templ, self.clc_templ, self.npts], calc)
 
-        self.xg_0 = xg_0
-        self.Mpi = np.linalg.inv(Mp)
-        self.Mmi = np.linalg.inv(Mm)
+        self.xg_0 = float(mab['xg_0'])
+        self.Mpi = mab['Mpi']
+        self.Mmi = mab['Mmi']
 
-        self.wwi_wg = _wwi(ww) * wg
-        self.xg = xg
+        self.wwi_wg = _wwi(mab['ww']) * mab['wg']
+        self.xg = mab['xg']
 
         self.fsky2 = np.mean(self.mask ** 2)
 
@@ -546,7 +728,6 @@ class map2cl_spin_binned:
 
         """
         nside = hp.npix2nside(qumap1[0].size)
-        Nb = len(self.edges) - 1
         s = self.spin
         lmax =min(3 * nside - 1, self.lmax)
         if qumap2 is None:
@@ -560,7 +741,14 @@ class map2cl_spin_binned:
             pcle = hp.alm2cl(elm1, alms2=elm2)
             pclb = hp.alm2cl(blm1, alms2=blm2)
             del elm1, elm2, blm1, blm2
+        return self._pcl2bcl(pcle, pclb)
+
+    def _pcl2bcl(self, pcle, pclb):
+        """Deconvolved and binned gg + cc and gg - cc amplitudes from the pseudo-spectra, before the coupling matrices
 
+        """
+        Nb = len(self.edges) - 1
+        s = self.spin
         clp = wigners.wignercoeff(wigners.wignerpos(pcle + pclb, self.xg, s, +s) * self.wwi_wg, self.xg, s, +s, lmax=self.lmax)
         clm = wigners.wignercoeff(wigners.wignerpos(pcle - pclb, self.xg, s, -s) * self.wwi_wg, self.xg, s, -s, lmax=self.lmax)
 
@@ -585,9 +773,29 @@ class map2cl_spin_binned:
 
         """
         Ap, Am = self._map2pcl(qumap, qumap2=qumap2)
-        Ap = np.dot(self.Mpi, Ap)
-        Am = np.dot(self.Mmi, Am)
+        return self._bcl2amplitudes(np.dot(self.Mpi, Ap), np.dot(self.Mmi, Am))
 
+    def map2cls(self, qumaps, qumaps2=None):
+        """Same as map2cl for a stack of maps, of shape (nmaps, 2, npix), with one vectorized pseudo-spectra pass
+
+            Returns:
+                Binned gradient and curl mode template amplitudes, each of shape (nmaps, nbins)
+
+        """
+        nside = hp.npix2nside(self.mask.size)
+        lmax = min(3 * nside - 1, self.lmax)
+        elms, blms = _masked_alms_spin(qumaps, self.spin, self.mask, lmax, zbounds=self.zbounds)
+        if qumaps2 is None:
+            pcles, pclbs = alm2cl(elms, None, lmax, lmax, lmax), alm2cl(blms, None, lmax, lmax, lmax)
+        else:
+            elms2, blms2 = _masked_alms_spin(qumaps2, self.spin, self.mask, lmax, zbounds=self.zbounds)
+            pcles, pclbs = alm2cl(elms, elms2, lmax, lmax, lmax), alm2cl(blms, blms2, lmax, lmax, lmax)
+            del elms2, blms2
+        del elms, blms
+        Aps, Ams = np.array([self._pcl2bcl(pcle, pclb) for pcle, pclb in zip(pcles, pclbs)]).transpose(1, 0, 2)
+        return self._bcl2amplitudes(Aps @ self.Mpi.T, Ams @ self.Mmi.T)
+
+    def _bcl2amplitudes(self, Ap, Am):
         eef, bbf = self.get_fid_bandpowers()
         Ag = 0.5 * (Ap + Am) + 0.5 * bbf * utils.cli(eef) * (Ap - Am)
         Ac = 0.5 * (Ap + Am) + 0.5 * eef * utils.cli(bbf) * (Ap - Am)
@@ -0,0 +1,194 @@
+"""Dynamic scheduling of the delensalot computing-jobs.
+
+    A job describes its work as a graph of tasks, each task a tuple (task, simidx) executed via job.run_task(task, simidx),
+    together with the tasks it depends on (e.g. calc_phi -> calc_meanfield -> calc_blt).
+    Tasks are dispatched as soon as their dependencies are done and a process is free:
+        * with MPI, rank 0 is the master and hands out ready tasks to the other ranks, one at a time,
+        * without MPI, tasks are executed in this process ('serial' backend), or on a pool of forked local processes ('pool' backend).
+    Tasks must not use MPI collectives (barriers, bcasts), as the ranks are working on different tasks at any time.
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+
+import time, traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from delensalot.core import mpi
+
+backend = 'serial' # backend used for non-MPI runs, 'serial' or 'pool'
+nprocs = multiprocessing.cpu_count() # number of local processes of the 'pool' backend
+
+_TAG_DONE, _TAG_FAILED = 'done', 'failed'
+
+
+class task_graph:
+    """Set of tasks with dependencies.
+
+        Tasks must be added after the tasks they depend on, which makes the insertion order a valid execution order.
+
+    """
+    def __init__(self):
+        self.tasks = []
+        self.deps = {}
+
+    def add(self, task, deps=()):
+        """Adds a task depending on *deps*. Dependencies not part of the graph are ignored.
+
+            Returns:
+                the task
+
+        """
+        assert task not in self.deps, "task {} added twice".format(task)
+        self.tasks.append(task)
+        self.deps[task] = [dep for dep in deps if dep in self.deps]
+        return task
+
+    def __contains__(self, task):
+        return task in self.deps
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def select(self, name):
+        """All tasks of a given name (first entry of the task tuple)
+
+        """
+        return [task for task in self.tasks if task[0] == name]
+
+    def ready(self, done, started):
+        """Tasks not started yet which have all dependencies done, in insertion order
+
+        """
+        return [task for task in self.tasks if task not in started and all(dep in done for dep in self.deps[task])]
+
+    def skipped(self, failed):
+        """Tasks which cannot be run as one of their (recursive) dependencies failed
+
+        """
+        ret = set(failed)
+        for task in self.tasks:
+            if any(dep in ret for dep in self.deps[task]):
+                ret.add(task)
+        return ret - set(failed)
+
+
+def run(job, graph):
+    """Executes all tasks of *graph* with job.run_task(*task), using the MPI master/worker scheme if MPI is enabled.
+
+        Must be called by all ranks. Returns on all ranks when all tasks are done.
+
+    """
+    if mpi.size > 1:
+        failed = _run_master(graph) if mpi.rank == 0 else _run_worker(job)
+        failed = mpi.bcast(failed)
+    elif backend == 'pool' and nprocs > 1 and len(graph) > 1:
+        failed = _run_pool(job, graph)
+    else:
+        failed = _run_serial(job, graph)
+    assert not failed, "tasks failed: {}".format(failed)
+
+
+def _execute(job, task):
+    t0 = time.time()
+    job.run_task(*task)
+    log.info("rank {} (size {}) finished task {} in {:.1f} secs".format(mpi.rank, mpi.size, task, time.time() - t0))
+
+
+def _run_serial(job, graph):
+    failed = []
+    for task in graph.tasks:
+        if task in graph.skipped(failed):
+            continue
+        try:
+            _execute(job, task)
+        except Exception:
+            log.error("task {} failed:\n{}".format(task, traceback.format_exc()))
+            failed.append(task)
+    return failed
+
+
+def _run_master(graph):
+    """Dispatches the tasks to ranks 1..size-1, as they report back
+
+    """
+    done, started, failed = set(), set(), []
+    idle = list(range(1, mpi.size))
+    nbusy = 0
+    while True:
+        skipped = graph.skipped(failed)
+        started |= skipped
+        for task in graph.ready(done | skipped, started):
+            if not idle:
+                break
+            mpi.send(task, dest=idle.pop(0))
+            started.add(task)
+            nbusy += 1
+        if nbusy == 0:
+            break
+        tag, source, task = mpi.receive(None, source=mpi.ANY_SOURCE)
+        nbusy -= 1
+        idle.append(source)
+        if tag == _TAG_DONE:
+            done.add(task)
+        else:
+            failed.append(task)
+    for dest in range(1, mpi.size):
+        mpi.send(None, dest=dest)
+    if len(started) < len(graph):
+        log.error("tasks {} could not be scheduled".format([task for task in graph.tasks if task not in started]))
+    return failed
+
+
+def _run_worker(job):
+    """Executes the tasks sent by rank 0, until receiving None
+
+    """
+    while True:
+        task = mpi.receive(None, source=0)
+        if task is None:
+            return []
+        try:
+            _execute(job, task)
+            mpi.send((_TAG_DONE, mpi.rank, task), dest=0)
+        except Exception:
+            log.error("task {} failed:\n{}".format(task, traceback.format_exc()))
+            mpi.send((_TAG_FAILED, mpi.rank, task), dest=0)
+
+
+_job = None # job instance inherited by the forked pool processes
+
+def _execute_forked(task):
+    _execute(_job, task)
+    return task
+
+
+def _run_pool(job, graph):
+    """Executes the tasks on forked local processes, submitting them as their dependencies complete
+
+    """
+    global _job
+    _job = job
+    done, started, failed = set(), set(), []
+    futures = {}
+    with ProcessPoolExecutor(max_workers=nprocs, mp_context=multiprocessing.get_context('fork')) as executor:
+        while True:
+            skipped = graph.skipped(failed)
+            started |= skipped
+            for task in graph.ready(done | skipped, started):
+                futures[executor.submit(_execute_forked, task)] = task
+                started.add(task)
+            if not futures:
+                break
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                task = futures.pop(future)
+                if future.exception() is None:
+                    done.add(task)
+                else:
+                    log.error("task {} failed: {}".format(task, future.exception()))
+                    failed.append(task)
+    _job = None
+    return failed
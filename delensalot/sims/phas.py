@@ -13,9 +13,12 @@ from delensalot.core import mpi
 class rng_db:
     """ Class to save and read random number generators states in a sqlite database file.
 
+        States can be added and read in bulk, in a single transaction. With readonly set, all states are read
+        once into memory and the database file is not accessed anymore, avoiding lock contention between processes.
+
     """
 
-    def __init__(self, fname, idtype="INTEGER"):
+    def __init__(self, fname, idtype="INTEGER", readonly=False):
         if not os.path.exists(fname) and mpi.rank == 0:
             con = sqlite3.connect(fname, detect_types=sqlite3.PARSE_DECLTYPES, timeout=3600)
             cur = con.cursor()
@@ -24,21 +27,58 @@ class rng_db:
             con.commit()
         mpi.barrier()
 
-        self.con = sqlite3.connect(fname, timeout=3600., detect_types=sqlite3.PARSE_DECLTYPES)
+        self.fname = fname
+        self.con = None
+        self._snapshot = None
+        if readonly:
+            self.snapshot()
+        else:
+            self.con = sqlite3.connect(fname, timeout=3600., detect_types=sqlite3.PARSE_DECLTYPES)
+
+    @staticmethod
+    def _row(idx, state):
+        return (int(idx), state[0], state[2], state[3], state[4], '_'.join(str(s) for s in state[1]))
+
+    @staticmethod
+    def _state(data):
+        assert (len(data) == 5)
+        typ, pos, has_gauss, cached_gaussian, keys = data
+        keys = np.array([int(a) for a in keys.split('_')], dtype=np.uint32)
+        return [typ, keys, pos, has_gauss, cached_gaussian]
+
+    def snapshot(self):
+        """Reads all states into memory and closes the database. Further adds and deletes are not possible.
+
+        """
+        con = sqlite3.connect('file:%s?mode=ro' % self.fname, uri=True, timeout=3600., detect_types=sqlite3.PARSE_DECLTYPES)
+        rows = con.execute("SELECT id, type, pos, has_gauss, cached_gaussian, keys FROM rngdb").fetchall()
+        con.close()
+        if self.con is not None:
+            self.con.close()
+            self.con = None
+        self._snapshot = {row[0]: self._state(row[1:]) for row in rows}
 
     def add(self, idx, state):
-        idx = int(idx)
+        self.add_many({idx: state})
+
+    def add_many(self, states:dict):
+        """Inserts the states {idx: state} in one transaction. Already stored indices are left untouched.
+
+        """
+        assert self._snapshot is None, 'read-only snapshot'
         try:
-            assert (self.get(idx) is None)
-            keys_string = '_'.join(str(s) for s in state[1])
-            self.con.execute("INSERT INTO rngdb (id, type, pos, has_gauss, cached_gaussian, keys) VALUES (?,?,?,?,?,?)",
-                             (idx, state[0], state[2], state[3], state[4], keys_string))
-            self.con.commit()
-        except:
+            with self.con:
+                cur = self.con.executemany("INSERT OR IGNORE INTO rngdb (id, type, pos, has_gauss, cached_gaussian, keys) VALUES (?,?,?,?,?,?)",
+                                           [self._row(idx, state) for idx, state in states.items()])
+            if cur.rowcount < len(states):
+                print("rng_db::rngdb add failed for %s already stored states!" % (len(states) - cur.rowcount))
+        except sqlite3.Error:
             print("rng_db::rngdb add failed!")
 
     def get(self, idx):
         idx = int(idx)
+        if self._snapshot is not None:
+            return self._snapshot.get(idx, None)
         cur = self.con.cursor()
         cur.execute("SELECT type, pos, has_gauss, cached_gaussian, keys FROM rngdb WHERE id=?", (idx,))
         data = cur.fetchone()
@@ -46,12 +86,28 @@ class rng_db:
         if data is None:
             return None
         else:
-            assert (len(data) == 5)
-            typ, pos, has_gauss, cached_gaussian, keys = data
-            keys = np.array([int(a) for a in keys.split('_')], dtype=np.uint32)
-            return [typ, keys, pos, has_gauss, cached_gaussian]
+            return self._state(data)
+
+    def get_many(self, idx_min, idx_max):
+        """Returns all stored states with idx_min <= idx <= idx_max, as a dictionary {idx: state}
+
+        """
+        if self._snapshot is not None:
+            return {idx: state for idx, state in self._snapshot.items() if idx_min <= idx <= idx_max}
+        rows = self.con.execute("SELECT id, type, pos, has_gauss, cached_gaussian, keys FROM rngdb WHERE id BETWEEN ? AND ?",
+                                (int(idx_min), int(idx_max))).fetchall()
+        return {row[0]: self._state(row[1:]) for row in rows}
+
+    def ids(self):
+        """Returns the set of stored indices
+
+        """
+        if self._snapshot is not None:
+            return set(self._snapshot.keys())
+        return set(row[0] for row in self.con.execute("SELECT id FROM rngdb").fetchall())
 
     def delete(self, idx):
+        assert self._snapshot is None, 'read-only snapshot'
         idx = int(idx)
         try:
             if self.get(idx) is None:
@@ -68,9 +124,12 @@ class sim_lib(object):
     np.random rng states are stored in a sqlite3 database. By default the rng state function is np.random.get_state.
     The rng_db class is tuned for this state fct, you may need to adapt this.
 
+    With readonly set, the stored states are read once into memory (see rng_db) and no new sims can be generated;
+    generate them beforehand with generate(), from a single process.
+
     """
 
-    def __init__(self, lib_dir, get_state_func=np.random.get_state, nsims_max=None):
+    def __init__(self, lib_dir, get_state_func=np.random.get_state, nsims_max=None, readonly=False):
         if not os.path.exists(lib_dir) and mpi.rank == 0:
             os.makedirs(lib_dir)
         self.nmax = nsims_max
@@ -82,15 +141,35 @@ class sim_lib(object):
         hsh = pk.load(open(fn_hash, 'rb'))
         utils.hash_check(hsh, self.hashdict(), ignore=['lib_dir'], fn=fn_hash)
 
-        self._rng_db = rng_db(os.path.join(lib_dir, 'rngdb.db'), idtype='INTEGER')
+        self._rng_db = rng_db(os.path.join(lib_dir, 'rngdb.db'), idtype='INTEGER', readonly=readonly)
         self._get_rng_state = get_state_func
 
     def get_sim(self, idx, **kwargs):
         """Returns sim number idx and caches random number generator state. """
         if self.has_nmax(): assert idx < self.nmax
-        if not self.is_stored(idx):
-            self._rng_db.add(idx, self._get_rng_state())
-        return self._build_sim_from_rng(self._rng_db.get(idx), **kwargs)
+        state = self._rng_db.get(idx)
+        if state is None:
+            assert self._rng_db.con is not None, 'sim %s is not in the read-only snapshot, generate() it first' % idx
+            state = self._get_rng_state()
+            self._rng_db.add(idx, state)
+        return self._build_sim_from_rng(state, **kwargs)
+
+    def generate(self, idxs):
+        """Stores the rng states of all sims in idxs not stored yet, in one transaction.
+
+            This gives the same states as calling get_sim on the missing sims in turn, without building the sims.
+
+        """
+        _generate([self], idxs)
+
+    def _next_state(self):
+        state = self._get_rng_state()
+        self._build_sim_from_rng(state, phas_only=True) # advances the rng as get_sim would
+        return state
+
+    def snapshot(self):
+        """Switches to the read-only in-memory mode, see rng_db.snapshot """
+        self._rng_db.snapshot()
 
     def has_nmax(self):
         return not self.nmax is None
@@ -102,16 +181,12 @@ class sim_lib(object):
     def is_full(self):
         """Checks whether all sims are stored or not. Boolean output. """
         if not self.has_nmax(): return False
-        for idx in range(self.nmax):
-            if not self.is_stored(idx): return False
-        return True
+        return set(range(self.nmax)) <= self._rng_db.ids()
 
     def is_empty(self):
         """Checks whether any sims is stored. Boolean output. """
         assert self.nmax is not None
-        for idx in range(self.nmax):
-            if self.is_stored(idx): return False
-        return True
+        return len(set(range(self.nmax)) & self._rng_db.ids()) == 0
 
     def hashdict(self):
         """Override this """
@@ -122,6 +197,22 @@ class sim_lib(object):
         assert 0
 
 
+def _generate(libs, idxs):
+    """Bulk generation of the missing rng states of sims idxs of the sim_libs, in the order get_sim would produce them
+
+    """
+    stored = [lib._rng_db.ids() for lib in libs]
+    states = [{} for lib in libs]
+    for idx in idxs:
+        for lib, _stored, _states in zip(libs, stored, states):
+            if lib.has_nmax(): assert idx < lib.nmax
+            if int(idx) not in _stored and int(idx) not in _states:
+                _states[int(idx)] = lib._next_state()
+    for lib, _states in zip(libs, states):
+        if len(_states) > 0:
+            lib._rng_db.add_many(_states)
+
+
 class _pix_lib_phas(sim_lib):
     def __init__(self, lib_dir, shape, **kwargs):
         self.shape = shape
@@ -145,6 +236,13 @@ class pix_lib_phas:
     def is_full(self):
         return np.all([lib.is_full() for lib in self.lib_pix.values()])
 
+    def generate(self, idxs):
+        _generate([self.lib_pix[_idf] for _idf in range(self.nfields)], idxs)
+
+    def snapshot(self):
+        for lib in self.lib_pix.values():
+            lib.snapshot()
+
     def get_sim(self, idx, idf=None, phas_only=False):
         if idf is not None:
             assert idf < self.nfields, (idf, self.nfields)
@@ -184,6 +282,15 @@ class lib_phas:
     def is_full(self):
         return np.all([lib.is_full() for lib in self.lib_phas.values()])
 
+    def generate(self, idxs):
+        """Stores in bulk the phases of sims idxs for all fields, see sim_lib.generate """
+        _generate([self.lib_phas[_idf] for _idf in range(self.nfields)], idxs)
+
+    def snapshot(self):
+        """Read-only in-memory mode for all fields, see rng_db.snapshot """
+        for lib in self.lib_phas.values():
+            lib.snapshot()
+
     def get_sim(self, idx, idf=None, phas_only=False):
         if idf is not None:
             assert idf < self.nfields, (idf, self.nfields)
@@ -7,7 +7,7 @@
 and is a mapper between them, so that `get_sim_pmap()` and `get_sim_tmap()` always returns observed maps.
 """
 
-import os
+import os, threading
 from os.path import join as opj
 import numpy as np, healpy as hp
 
@@ -16,8 +16,8 @@ log = logging.getLogger(__name__)
 
 import lenspyx
 from lenspyx.lensing import get_geom as lp_get_geom
-from plancklens.sims import phas
-from delensalot.core import cachers
+from delensalot.sims import phas
+from delensalot.core import cachers, mpi
 from delensalot.config.metamodel import DEFAULT_NotAValue as DNaV
 
 import delensalot
@@ -47,6 +47,190 @@ def cld2clp(cld, lmax):
     return hp.almxfl(cld, cli(factor))
 
 
+class sht_context:
+    """Process-wide SHT execution context, shared by Simhandler and all simulation libraries.
+
+        Holds the number of threads of the transforms, and a registry of the geometry objects (and with them their precomputed ring data), keyed by geominfo.
+        The transforms of the registered geometries are counted in 'counts', per method, and in addition per calling thread,
+        such that the transforms of one request are not mixed up with those of the other pipeline threads.
+
+    """
+    def __init__(self, nthreads=None):
+        self.nthreads = default_nthreads() if nthreads is None else nthreads
+        self._geoms = dict()
+        self.counts = {method: 0 for method in counting_geom.methods}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @staticmethod
+    def _key(geominfo):
+        return (geominfo[0], repr(sorted(geominfo[1].items())))
+
+    def get_geom(self, geominfo):
+        key = self._key(geominfo)
+        if key not in self._geoms:
+            self._geoms[key] = counting_geom(lp_get_geom(geominfo), self.count)
+        return self._geoms[key]
+
+    def count(self, method):
+        with self._lock:
+            self.counts[method] += 1
+        self._local.nsht = getattr(self._local, 'nsht', 0) + 1
+
+    def nsht(self):
+        """Total number of SHTs done so far, a spin-2 transform counting as one
+
+        """
+        with self._lock:
+            return sum(self.counts.values())
+
+    def nsht_thread(self):
+        """Number of SHTs done so far by the calling thread
+
+        """
+        return getattr(self._local, 'nsht', 0)
+
+    def set_nthreads(self, nthreads):
+        log.info('SHTs using {} threads'.format(nthreads))
+        self.nthreads = nthreads
+
+
+class counting_geom:
+    """Geometry wrapper counting the calls to the SHT methods of the geometry
+
+    """
+    methods = ('map2alm', 'map2alm_spin', 'alm2map', 'alm2map_spin')
+
+    def __init__(self, geom, count):
+        self._geom = geom
+        self._count = count # function (method name), called before each transform
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        attr = getattr(self._geom, name)
+        if name not in self.methods:
+            return attr
+        def counted(*args, **kwargs):
+            self._count(name)
+            return attr(*args, **kwargs)
+        return counted
+
+
+def default_nthreads():
+    """Number of SHT threads per rank: OMP_NUM_THREADS if set, else the cpus available to this process, shared among the MPI ranks of the node
+
+    """
+    if 'OMP_NUM_THREADS' in os.environ:
+        return max(1, int(os.environ['OMP_NUM_THREADS']))
+    ncpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    if ncpus == os.cpu_count():
+        # not bound to a subset of the node, the ranks of the node share all cpus
+        ncpus = ncpus // max(1, mpi.local_size)
+    return max(1, ncpus)
+
+
+sht_ctx = sht_context()
+
+
+def default_cache_maxbytes():
+    """Memory budget shared by the in-memory cachers of all simulation libraries of this process: an eighth of the node memory, shared among the MPI ranks of the node
+
+    """
+    try:
+        nbytes = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+    return nbytes // 8 // max(1, mpi.local_size)
+
+
+# one budget for all libraries, the least recently used arrays of any library are evicted first
+cache_budget = cachers.mem_budget(default_cache_maxbytes())
+
+
+class rep_planner:
+    """Conversions between the cached representations of a simulated field, along the cheapest path
+
+        A field is held in the (space, spin) representations ('alm', 0) (T or EB alms), ('map', 0) (T or EB maps) and, for polarization, ('map', 2) (QU maps), on one geometry.
+        Maps are converted into each other only through the alms, which are cached on the way and reused whenever present,
+        such that a map -> alm transform is done at most once per simulation (as long as the alms are not evicted from the cache).
+
+    """
+    def __init__(self, prefix, cacher, geom_lib, lmax):
+        self.prefix = prefix
+        self.cacher = cacher
+        self.geom_lib = geom_lib
+        self.lmax = lmax
+
+    def fn(self, simidx, space, spin, field):
+        return '{}_space{}_spin{}_field{}_{}'.format(self.prefix, space, spin, field, simidx)
+
+    @staticmethod
+    def reps(field):
+        return [('alm', 0), ('map', 2), ('map', 0)] if field == 'polarization' else [('alm', 0), ('map', 0)]
+
+    @staticmethod
+    def nsht2alm(rep, field):
+        """Number of SHTs from representation rep to the alms
+
+        """
+        if rep[0] == 'alm':
+            return 0
+        return 2 if field == 'polarization' and rep[1] == 0 else 1
+
+    def map2alm(self, m, spin, field):
+        kwargs = dict(lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
+        if field == 'temperature':
+            return self.geom_lib.map2alm(m, **kwargs)
+        if spin == 0:
+            return np.array([self.geom_lib.map2alm(m[0], **kwargs), self.geom_lib.map2alm(m[1], **kwargs)])
+        return self.geom_lib.map2alm_spin(m, spin=spin, **kwargs)
+
+    def alm2map(self, alm, spin, field):
+        kwargs = dict(lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
+        if field == 'temperature':
+            return self.geom_lib.alm2map(alm, **kwargs)
+        if spin == 0:
+            return np.array([self.geom_lib.alm2map(alm[0], **kwargs), self.geom_lib.alm2map(alm[1], **kwargs)])
+        return np.array(self.geom_lib.alm2map_spin(alm, spin=spin, **kwargs))
+
+    def get(self, simidx, space, spin, field, make):
+        """Returns the field in representation (space, spin), from the cache, else converted from the cheapest cached representation,
+            else converted from make(), which returns (space, spin, field) in the native representation of the library
+
+        """
+        fn = self.fn(simidx, space, spin, field)
+        ret = self.cacher.get(fn)
+        if ret is not None:
+            log.debug('found "{}"'.format(fn))
+            return ret
+        # the cached representations, each loaded in one step, such that another thread cannot evict it in between
+        cached = {rep: self.cacher.get(self.fn(simidx, *rep, field)) for rep in self.reps(field)}
+        cached = {rep: data for rep, data in cached.items() if data is not None}
+        if not cached:
+            assert make is not None, 'no representation of {} available'.format(fn)
+            log.debug('..nothing cached, making {}'.format(fn))
+            space_in, spin_in, data = make()
+            self.cacher.cache(self.fn(simidx, space_in, spin_in, field), data)
+            if (space_in, spin_in) == (space, spin):
+                return self.cacher.get(fn, data)
+            cached = {(space_in, spin_in): data}
+        if space == 'alm':
+            rep = min(cached.keys(), key=lambda rep: self.nsht2alm(rep, field))
+            log.debug('converting "{}" to "{}"'.format(self.fn(simidx, *rep, field), fn))
+            ret = self.map2alm(cached[rep], rep[1], field)
+        else:
+            alm = cached[('alm', 0)] if ('alm', 0) in cached else self.get(simidx, 'alm', 0, field, make)
+            ret = self.alm2map(alm, spin, field)
+        self.cacher.cache(fn, ret)
+        return self.cacher.get(fn, ret) # unless evicted meanwhile by another thread
+
+
+# serializes the draws from the global numpy random state, which the simulation libraries seed or set before each draw,
+# such that simulations generated from several threads are the same as when generated in turn
+rng_lock = threading.RLock()
+
+
 def get_dirname(s):
     return s.replace('(', '').replace(')', '').replace('{', '').replace('}', '').replace(' ', '').replace('\'', '').replace('\"', '').replace(':', '_').replace(',', '_').replace('[', '').replace(']', '')
 
@@ -78,7 +262,7 @@ class iso_white_noise:
                 assert 0, "must provide fns"
             self.fns = fns
 
-        self.cacher = cachers.cacher_mem(safe=True)
+        self.cacher = cachers.cacher_mem_ro(budget=cache_budget)
 
 
     def get_sim_noise(self, simidx, space, field, spin=2):
@@ -102,7 +286,8 @@ class iso_white_noise:
         if field == 'polarization' and 'P' not in self.nlev:
             assert 0, "need to provide P key in nlev"
         fn = 'noise_space{}_spin{}_field{}_{}'.format(space, spin, field, simidx)
-        if not self.cacher.is_cached(fn):
+        ret = self.cacher.get(fn)
+        if ret is None:
             if self.libdir == DNaV:
                 if self.geominfo[0] == 'healpix':
                     vamin = np.sqrt(hp.nside2pixarea(self.geominfo[1]['nside'], degrees=True)) * 60
@@ -110,21 +295,23 @@ class iso_white_noise:
                     ## FIXME this is a rough estimate, based on total sky coverage / npix()
                     vamin =  np.sqrt(4*np.pi) * (180/np.pi) / self.geom_lib.npix() * 60
                 if field == 'polarization':
-                    noise1 = self.nlev['P'] / vamin * self.pix_lib_phas.get_sim(int(simidx), idf=1)
-                    noise2 = self.nlev['P'] / vamin * self.pix_lib_phas.get_sim(int(simidx), idf=2) # TODO this always produces qu-noise in healpix geominfo?
+                    with rng_lock:
+                        noise1 = self.nlev['P'] / vamin * self.pix_lib_phas.get_sim(int(simidx), idf=1)
+                        noise2 = self.nlev['P'] / vamin * self.pix_lib_phas.get_sim(int(simidx), idf=2) # TODO this always produces qu-noise in healpix geominfo?
                     noise = np.array([noise1, noise2])
                     if space == 'map':
                         if spin == 0:
-                            alm_buffer = self.geom_lib.map2alm_spin(noise, spin=2, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                            noise1 = self.geom_lib.alm2map(alm_buffer[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                            noise2 = self.geom_lib.alm2map(alm_buffer[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
+                            alm_buffer = self.geom_lib.map2alm_spin(noise, spin=2, lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
+                            noise1 = self.geom_lib.alm2map(alm_buffer[0], lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
+                            noise2 = self.geom_lib.alm2map(alm_buffer[1], lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
                             noise = np.array([noise1, noise2])
                     elif space == 'alm':
-                        noise = self.geom_lib.map2alm_spin(noise, spin=2, lmax=self.lmax, mmax=self.lmax, nthreads=4)
+                        noise = self.geom_lib.map2alm_spin(noise, spin=2, lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
                 elif field == 'temperature':
-                    noise = self.nlev['T'] / vamin * self.pix_lib_phas.get_sim(int(simidx), idf=0)
+                    with rng_lock:
+                        noise = self.nlev['T'] / vamin * self.pix_lib_phas.get_sim(int(simidx), idf=0)
                     if space == 'alm':
-                        noise = self.geom_lib.map2alm(noise, lmax=self.lmax, mmax=self.lmax, nthreads=4)
+                        noise = self.geom_lib.map2alm(noise, lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
             else:
                 if field == 'polarization':
                     if self.spin == 2:
@@ -137,40 +324,54 @@ class iso_white_noise:
                     if self.space == 'map':
                         if space == 'alm':
                             if self.spin == 0:
-                                noise1 = self.geom_lib.map2alm(noise[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                noise2 = self.geom_lib.map2alm(noise[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
+                                noise1 = self.geom_lib.map2alm(noise[0], lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
+                                noise2 = self.geom_lib.map2alm(noise[1], lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
                                 noise = np.array([noise1, noise2])
                             elif self.spin == 2:
-                                noise = self.geom_lib.map2alm_spin(noise, spin=self.spin, lmax=self.lmax, mmax=self.lmax, nthreads=4)
+                                noise = self.geom_lib.map2alm_spin(noise, spin=self.spin, lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
                         elif space == 'map':
                             if self.spin != spin:
                                 if self.spin == 0:
-                                    alm_buffer1 = self.geom_lib.map2alm(noise[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                    alm_buffer2 = self.geom_lib.map2alm(noise[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                    noise = self.geom_lib.alm2map_spin([alm_buffer1,alm_buffer2], lmax=self.lmax, spin=spin, mmax=self.lmax, nthreads=4)
+                                    alm_buffer1 = self.geom_lib.map2alm(noise[0], lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
+                                    alm_buffer2 = self.geom_lib.map2alm(noise[1], lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
+                                    noise = self.geom_lib.alm2map_spin([alm_buffer1,alm_buffer2], lmax=self.lmax, spin=spin, mmax=self.lmax, nthreads=sht_ctx.nthreads)
                                 elif self.spin == 2:
-                                    alm_buffer = self.geom_lib.map2alm_spin(noise, spin=self.spin, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                    noise1 = self.geom_lib.alm2map(alm_buffer[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                    noise2 = self.geom_lib.alm2map(alm_buffer[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
+                                    alm_buffer = self.geom_lib.map2alm_spin(noise, spin=self.spin, lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
+                                    noise1 = self.geom_lib.alm2map(alm_buffer[0], lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
+                                    noise2 = self.geom_lib.alm2map(alm_buffer[1], lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
                                     noise = np.array([noise1, noise2])
                     elif self.space == 'alm':
                         if space == 'map':
                             if spin == 0:
-                                noise1 = self.geom_lib.map2alm(noise[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                noise2 = self.geom_lib.map2alm(noise[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
+                                noise1 = self.geom_lib.map2alm(noise[0], lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
+                                noise2 = self.geom_lib.map2alm(noise[1], lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
                                 noise = np.array([noise1, noise2])
                             elif spin == 2:
-                                noise = self.geom_lib.alm2map_spin(noise, spin=spin, lmax=self.lmax, mmax=self.lmax, nthreads=4)       
+                                noise = self.geom_lib.alm2map_spin(noise, spin=spin, lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)       
                 elif field == 'temperature':
                     noise = np.array(load_file(opj(self.libdir, self.fns['T'].format(simidx))))
                     if self.space == 'map':
                         if space == 'alm':
-                            noise = self.geom_lib.map2alm(noise, lmax=self.lmax, mmax=self.lmax, nthreads=4)
+                            noise = self.geom_lib.map2alm(noise, lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
                     elif self.space == 'alm':
                         if space == 'map':
-                            noise = self.geom_lib.alm2map(noise, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-            self.cacher.cache(fn, noise)  
-        return self.cacher.load(fn)
+                            noise = self.geom_lib.alm2map(noise, lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
+            self.cacher.cache(fn, noise)
+            ret = self.cacher.get(fn, noise) # unless evicted meanwhile by another thread
+        return ret
+
+
+    def generate_phases(self, simidxs):
+        """Stores the noise phases of all simidxs in one transaction (on rank 0), and switches all ranks to the read-only in-memory phases
+
+            Must be called by all ranks. Noise of simulations not in simidxs cannot be generated afterwards.
+
+        """
+        if self.libdir == DNaV:
+            if mpi.rank == 0:
+                self.pix_lib_phas.generate(simidxs)
+            mpi.barrier()
+            self.pix_lib_phas.snapshot()
 
 
 class Cls:
@@ -214,23 +415,28 @@ class Cls:
                 self.phi_file = load_file(self.phi_fn)['pp']
             self.phi_field = phi_field
         log.debug("phi_fn is {}".format(self.phi_fn))
-        self.cacher = cachers.cacher_mem(safe=True)
+        self.cacher = cachers.cacher_mem_ro(budget=cache_budget)
 
 
     def get_TEBunl(self, simidx):
         fn = 'cls_{}'.format(simidx)
-        if not self.cacher.is_cached(fn):
+        ret = self.cacher.get(fn)
+        if ret is None:
             ClT, ClE, ClB, ClTE = self.CAMB_file['tt'][:self.lmax+1], self.CAMB_file['ee'][:self.lmax+1], self.CAMB_file['bb'][:self.lmax+1], self.CAMB_file['te'][:self.lmax+1]
-            self.cacher.cache(fn, np.array([ClT, ClE, ClB, ClTE]))
-        return self.cacher.load(fn)   
+            ret = np.array([ClT, ClE, ClB, ClTE])
+            self.cacher.cache(fn, ret)
+            ret = self.cacher.get(fn, ret) # unless evicted meanwhile by another thread
+        return ret
         
     
     def get_sim_clphi(self, simidx):
         fn = 'clphi_{}'.format(simidx)
-        if not self.cacher.is_cached(fn):
-            ClP = self.phi_file[:self.phi_lmax+1]
-            self.cacher.cache(fn, np.array(ClP))
-        return self.cacher.load(fn)
+        ret = self.cacher.get(fn)
+        if ret is None:
+            ret = np.array(self.phi_file[:self.phi_lmax+1])
+            self.cacher.cache(fn, ret)
+            ret = self.cacher.get(fn, ret) # unless evicted meanwhile by another thread
+        return ret
 
 
 class Xunl:
@@ -291,7 +497,7 @@ class Xunl:
             self.phi_lmax = np.min([lmax + 1024, geom_lmax])
         self.isfrozen = isfrozen
             
-        self.cacher = cachers.cacher_mem(safe=True)
+        self.cacher = cachers.cacher_mem_ro(budget=cache_budget)
 
 
     def get_sim_unl(self, simidx, space, field, spin=2):
@@ -311,20 +517,21 @@ class Xunl:
         if field == 'temperature' and spin == 2:
             assert 0, "I don't think you want spin-2 temperature."
         fn = 'unl_space{}_spin{}_field{}_{}'.format(space, spin, field, simidx)
-        if not self.cacher.is_cached(fn):
+        ret = self.cacher.get(fn)
+        if ret is None:
             if self.libdir == DNaV:
                 Cls = self.cls_lib.get_TEBunl(simidx)
                 unl = np.array(self.cl2alm(Cls, field=field, seed=simidx))
                 if space == 'map':
                     if field == 'polarization':
                         if spin == 2:
-                            unl = self.geom_lib.alm2map_spin(unl, lmax=self.lmax, spin=spin, mmax=self.lmax, nthreads=4)
+                            unl = self.geom_lib.alm2map_spin(unl, lmax=self.lmax, spin=spin, mmax=self.lmax, nthreads=sht_ctx.nthreads)
                         elif spin == 0:
-                            unl1 = self.geom_lib.alm2map(unl[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                            unl2 = self.geom_lib.alm2map(unl[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
+                            unl1 = self.geom_lib.alm2map(unl[0], lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
+                            unl2 = self.geom_lib.alm2map(unl[1], lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
                             unl = np.array([unl1, unl2])
                     elif field == 'temperature':
-                        unl = self.geom_lib.alm2map(unl, lmax=self.lmax, mmax=self.lmax, nthreads=4)
+                        unl = self.geom_lib.alm2map(unl, lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
             else:
                 if field  == 'polarization':
                     if self.spin == 2:
@@ -337,38 +544,39 @@ class Xunl:
                     if self.space == 'map':
                         if space == 'alm':
                             if self.spin == 2:
-                                unl = self.geom_lib.map2alm_spin(unl, spin=self.spin, lmax=self.lmax, mmax=self.lmax, nthreads=4)
+                                unl = self.geom_lib.map2alm_spin(unl, spin=self.spin, lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
                             elif self.spin == 0:
-                                unl1 = self.geom_lib.map2alm(unl[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                unl2 = self.geom_lib.map2alm(unl[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
+                                unl1 = self.geom_lib.map2alm(unl[0], lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
+                                unl2 = self.geom_lib.map2alm(unl[1], lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
                                 unl = np.array([unl1, unl2])
                         elif space == 'map':
                             if self.spin != spin:
                                 if self.spin == 0:
-                                    alm_buffer1 = self.geom_lib.map2alm(unl[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                    alm_buffer2 = self.geom_lib.map2alm(unl[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                    unl = self.geom_lib.alm2map_spin([alm_buffer1,alm_buffer2], lmax=self.lmax, spin=spin, mmax=self.lmax, nthreads=4)
+                                    alm_buffer1 = self.geom_lib.map2alm(unl[0], lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
+                                    alm_buffer2 = self.geom_lib.map2alm(unl[1], lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
+                                    unl = self.geom_lib.alm2map_spin([alm_buffer1,alm_buffer2], lmax=self.lmax, spin=spin, mmax=self.lmax, nthreads=sht_ctx.nthreads)
                                 elif self.spin == 2:
-                                    alm_buffer = self.geom_lib.map2alm_spin(unl, spin=self.spin, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                    unl1 = self.geom_lib.alm2map(alm_buffer[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                    unl2 = self.geom_lib.alm2map(alm_buffer[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
+                                    alm_buffer = self.geom_lib.map2alm_spin(unl, spin=self.spin, lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
+                                    unl1 = self.geom_lib.alm2map(alm_buffer[0], lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
+                                    unl2 = self.geom_lib.alm2map(alm_buffer[1], lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
                                     unl = np.array([unl1, unl2])
                     elif self.space == 'alm':
                         if space == 'map':
                             if spin == 0:
-                                unl = self.geom_lib.alm2map(unl, lmax=self.lmax, mmax=self.lmax, nthreads=4)
+                                unl = self.geom_lib.alm2map(unl, lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
                             elif spin == 2:
-                                unl = self.geom_lib.alm2map_spin(unl, spin=spin, lmax=self.lmax, mmax=self.lmax, nthreads=4)
+                                unl = self.geom_lib.alm2map_spin(unl, spin=spin, lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
                 elif field == 'temperature':
                     unl = np.array(load_file(opj(self.libdir, self.fns['T'].format(simidx))))
                     if self.space == 'map':
                         if space == 'alm':
-                            unl = self.geom_lib.map2alm(unl, lmax=self.lmax, mmax=self.lmax, nthreads=4)
+                            unl = self.geom_lib.map2alm(unl, lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
                     elif self.space == 'alm':
                         if space == 'map':
-                            unl = self.geom_lib.alm2map(unl, lmax=self.lmax, mmax=self.lmax, nthreads=4)
+                            unl = self.geom_lib.alm2map(unl, lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
             self.cacher.cache(fn, unl)
-        return self.cacher.load(fn)
+            ret = self.cacher.get(fn, unl) # unless evicted meanwhile by another thread
+        return ret
     
 
     def get_sim_phi(self, simidx, space):
@@ -383,7 +591,8 @@ class Xunl:
             _type_: _description_
         """        
         fn = 'phi_space{}_{}'.format(space, simidx)
-        if not self.cacher.is_cached(fn):
+        ret = self.cacher.get(fn)
+        if ret is None:
             if self.libdir_phi == DNaV:
                 log.debug('generating phi from cl')
                 Clpf = self.cls_lib.get_sim_clphi(simidx)
@@ -393,7 +602,7 @@ class Xunl:
                 ## If it comes from CL, like Gauss phis, then phi modification must happen here
                 phi = self.phi_modifier(phi)
                 if space == 'map':
-                    phi = self.geom_lib.alm2map(phi, lmax=self.phi_lmax, mmax=self.phi_lmax, nthreads=4)
+                    phi = self.geom_lib.alm2map(phi, lmax=self.phi_lmax, mmax=self.phi_lmax, nthreads=sht_ctx.nthreads)
             else:
                 ## Existing phi is loaded, this e.g. is a kappa map on disk
                 if self.phi_space == 'map':
@@ -403,14 +612,15 @@ class Xunl:
                 if self.phi_space == 'map':
                     self.geominfo_phi = ('healpix', {'nside':hp.npix2nside(phi.shape[0])})
                     self.geomlib_phi = get_geom(self.geominfo_phi)
-                    phi = self.geomlib_phi.map2alm(phi, lmax=self.phi_lmax, mmax=self.phi_lmax, nthreads=4)
+                    phi = self.geomlib_phi.map2alm(phi, lmax=self.phi_lmax, mmax=self.phi_lmax, nthreads=sht_ctx.nthreads)
                 ## phi modifcation
                 phi = self.phi_modifier(phi)
                 phi = self.pflm2plm(phi)
                 if space == 'map':
-                    phi = self.geom_lib.alm2map(phi, lmax=self.phi_lmax, mmax=self.phi_lmax, nthreads=4)
+                    phi = self.geom_lib.alm2map(phi, lmax=self.phi_lmax, mmax=self.phi_lmax, nthreads=sht_ctx.nthreads)
             self.cacher.cache(fn, phi)
-        return self.cacher.load(fn)
+            ret = self.cacher.get(fn, phi) # unless evicted meanwhile by another thread
+        return ret
     
 
     def pflm2plm(self, philm):
@@ -432,18 +642,20 @@ class Xunl:
 
 
     def cl2alm(self, cls, field, seed):
-        np.random.seed(int(seed)) # check if this starting point is random
-        if field == 'polarization':
-            alms = hp.synalm(cls, self.lmax, new=True)
-            return alms[1:]
-        elif field == 'temperature':
-            alm = hp.synalm(cls, self.lmax)
-            return alm[0]
+        with rng_lock:
+            np.random.seed(int(seed)) # check if this starting point is random
+            if field == 'polarization':
+                alms = hp.synalm(cls, self.lmax, new=True)
+                return alms[1:]
+            elif field == 'temperature':
+                alm = hp.synalm(cls, self.lmax)
+                return alm[0]
     
 
     def clp2plm(self, clp, seed):
-        np.random.seed(int(seed))
-        plm = hp.synalm(clp, self.phi_lmax)
+        with rng_lock:
+            np.random.seed(int(seed))
+            plm = hp.synalm(clp, self.phi_lmax)
         return plm
 
 
@@ -483,9 +695,11 @@ class Xsky:
             self.lenjob_geominfo = ('thingauss', {'lmax':lmax+1024, 'smax':3})
         else:
             self.lenjob_geominfo = lenjob_geominfo
-        self.lenjob_geomlib = lp_get_geom(self.lenjob_geominfo)
+        self.lenjob_geomlib = get_geom(self.lenjob_geominfo)
 
-        self.cacher = cachers.cacher_mem(safe=True)
+        self.cacher = cachers.cacher_mem_ro(budget=cache_budget)
+        self.reps = rep_planner('sky', self.cacher, self.geom_lib, self.lmax)
+        self._nsht_last = threading.local()
 
 
     def get_sim_sky(self, simidx, space, field, spin=2):
@@ -504,93 +718,49 @@ class Xsky:
             assert 0, "I don't think you want qlms ulms."
         if field == 'temperature' and spin == 2:
             assert 0, "I don't think you want spin-2 temperature."
-        fn = 'sky_space{}_spin{}_field{}_{}'.format(space, spin, field, simidx)
-        log.debug('requesting "{}"'.format(fn))
-        if not self.cacher.is_cached(fn):
-            fn_other = 'sky_space{}_spin{}_field{}_{}'.format(space, self.spin, field, simidx)
-            if not self.cacher.is_cached(fn_other):
-                log.debug('..nothing cached..')
-                if self.libdir == DNaV:
-                    log.debug('.., generating.')
-                    unl = self.unl_lib.get_sim_unl(simidx, space='alm', field=field, spin=0)
-                    philm = self.unl_lib.get_sim_phi(simidx, space='alm')
-                    
-                    if field == 'polarization':
-                        sky = self.unl2len(unl, philm, spin=2, epsilon=self.epsilon)
-                        if space == 'map':
-                            if spin == 0:
-                                alm_buffer = self.lenjob_geomlib.map2alm_spin(sky, spin=2, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                sky1 = self.geom_lib.alm2map(alm_buffer[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                sky2 = self.geom_lib.alm2map(alm_buffer[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                sky = np.array([sky1, sky2])
-                            elif spin == 2:
-                                sky = self.lenjob_geomlib.map2alm_spin(np.copy(sky), spin=2, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                sky = self.geom_lib.alm2map_spin(np.copy(sky), lmax=self.lmax, spin=2, mmax=self.lmax, nthreads=4)
-                        elif space == 'alm':
-                            sky = self.lenjob_geomlib.map2alm_spin(sky, lmax=self.lmax, spin=2, mmax=self.lmax, nthreads=4)
-                    elif field == 'temperature':
-                        sky = self.unl2len(unl, philm, spin=0, epsilon=self.epsilon)
-                        if space == 'map':
-                            sky = self.lenjob_geomlib.map2alm(np.copy(sky), lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                            sky = self.geom_lib.alm2map(np.copy(sky), lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                        elif space == 'alm':
-                            sky = self.lenjob_geomlib.map2alm(sky, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                else:
-                    log.debug('.., but stored on disk.')
-                    if field == 'polarization':
-                        if self.spin == 2:
-                            sky1 = load_file(opj(self.libdir, self.fns['Q'].format(simidx)))
-                            sky2 = load_file(opj(self.libdir, self.fns['U'].format(simidx)))
-                        elif self.spin == 0:
-                            sky1 = load_file(opj(self.libdir, self.fns['E'].format(simidx)))
-                            sky2 = load_file(opj(self.libdir, self.fns['B'].format(simidx)))
-                        sky = np.array([sky1, sky2])
-                        if self.space == 'map':
-                            if space == 'alm':
-                                if self.spin == 0:
-                                    sky1 = self.geom_lib.map2alm(sky[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                    sky2 = self.geom_lib.map2alm(sky[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                    sky = np.array([sky1, sky2])
-                                else:
-                                    sky = self.geom_lib.map2alm_spin(sky, spin=self.spin, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                            elif space == 'map':
-                                if self.spin != spin:
-                                    if self.spin == 0:
-                                        alm_buffer1 = self.geom_lib.map2alm(sky[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                        alm_buffer2 = self.geom_lib.map2alm(sky[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                        sky = self.geom_lib.alm2map_spin([alm_buffer1,alm_buffer2], lmax=self.lmax, spin=spin, mmax=self.lmax, nthreads=4)
-                                    elif self.spin == 2:
-                                        alm_buffer = self.geom_lib.map2alm_spin(sky, spin=self.spin, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                        sky1 = self.geom_lib.alm2map(alm_buffer[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                        sky2 = self.geom_lib.alm2map(alm_buffer[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                        sky = np.array([sky1, sky2])
-                        elif self.space == 'alm':
-                            if space == 'map':
-                                if spin == 0:
-                                    sky1 = self.geom_lib.alm2map(sky[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                    sky2 = self.geom_lib.alm2map(sky[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                    sky = np.array([sky1, sky2])
-                                else:
-                                    sky = self.geom_lib.alm2map_spin(sky, spin=spin, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                    elif field == 'temperature':
-                        sky = np.array(load_file(opj(self.libdir, self.fns['T'].format(simidx))))
-                        if self.space == 'map':
-                            if space == 'alm':
-                                sky = self.geom_lib.map2alm(sky, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                        elif self.space == 'alm':
-                            if space == 'map':
-                                sky = self.geom_lib.alm2map(sky, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-            else:
-                log.debug('found "{}"'.format(fn_other))
-                sky = self.cacher.load(fn_other)
-                if space == 'map':
-                    sky = self.geom_lib.alm2map_spin(self.lenjob_geomlib.map2alm_spin(sky, spin=self.spin, lmax=self.lmax, mmax=self.lmax, nthreads=4), lmax=self.lmax, spin=spin, mmax=self.lmax, nthreads=4)
-            self.cacher.cache(fn, np.array(sky))
-        return self.cacher.load(fn)
+        n0 = sht_ctx.nsht_thread()
+        ret = self.reps.get(simidx, space, spin, field, lambda: self._make_sky(simidx, field))
+        self._nsht_last.n = sht_ctx.nsht_thread() - n0
+        log.debug('sky sim {} {} {} spin {}: {} SHTs'.format(simidx, field, space, spin, self.nsht_last))
+        return ret
+
+
+    @property
+    def nsht_last(self):
+        """Number of SHTs of the last get_sim_sky() call of the calling thread
+
+        """
+        return getattr(self._nsht_last, 'n', 0)
+
+
+    def _make_sky(self, simidx, field):
+        """Lensed field in its native representation: the alms of the lensed maps if generated here, else as stored on disk
+
+        """
+        if self.libdir == DNaV:
+            log.debug('.., generating.')
+            unl = self.unl_lib.get_sim_unl(simidx, space='alm', field=field, spin=0)
+            philm = self.unl_lib.get_sim_phi(simidx, space='alm')
+            if field == 'polarization':
+                sky = self.unl2len(unl, philm, spin=2, epsilon=self.epsilon)
+                return 'alm', 0, self.lenjob_geomlib.map2alm_spin(sky, spin=2, lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
+            sky = self.unl2len(unl, philm, spin=0, epsilon=self.epsilon)
+            return 'alm', 0, self.lenjob_geomlib.map2alm(sky, lmax=self.lmax, mmax=self.lmax, nthreads=sht_ctx.nthreads)
+        log.debug('.., but stored on disk.')
+        if field == 'polarization':
+            if self.spin == 2:
+                sky1 = load_file(opj(self.libdir, self.fns['Q'].format(simidx)))
+                sky2 = load_file(opj(self.libdir, self.fns['U'].format(simidx)))
+            elif self.spin == 0:
+                sky1 = load_file(opj(self.libdir, self.fns['E'].format(simidx)))
+                sky2 = load_file(opj(self.libdir, self.fns['B'].format(simidx)))
+            return self.space, self.spin, np.array([sky1, sky2])
+        return self.space, 0, np.array(load_file(opj(self.libdir, self.fns['T'].format(simidx))))
     
 
     def unl2len(self, Xlm, philm, **kwargs):
         ll = np.arange(0,self.unl_lib.phi_lmax+1,1)
+        kwargs.setdefault('nthreads', sht_ctx.nthreads)
         return lenspyx.alm2lenmap_spin(Xlm, hp.almxfl(philm,  np.sqrt(ll*(ll+1))), geometry=self.lenjob_geominfo, **kwargs)
 
 
@@ -614,11 +784,16 @@ class Xobs:
         self.space = space
         self.noise_lib = noise_lib
         self.fullsky = True #FIXME make it dependent on userdata: if Xobs is set via simhandler, then check if user data is full sky or not.
-        self.cacher = cachers.cacher_mem(safe=True)
+        self.cacher = cachers.cacher_mem_ro(budget=cache_budget) if cacher == DNaV else cacher
+        self.reps = rep_planner('obs', self.cacher, self.geom_lib, self.lmax)
+        self._nsht_last = threading.local()
         self.maps = maps
         if np.all(self.maps != DNaV):
             fn = 'obs_space{}_spin{}_field{}_{}'.format(space, spin, field, 0)
             self.cacher.cache(fn, np.array(self.maps))
+            if hasattr(self.cacher, 'pin'):
+                # user-provided maps cannot be regenerated, they must survive eviction
+                self.cacher.pin(fn)
         else:
             if libdir == DNaV:
                 if len_lib == DNaV:
@@ -662,172 +837,76 @@ class Xobs:
         if not self.fullsky:
             assert self.spin == spin, "can only provide existing data"
             assert self.space == space, "can only provide existing data"
-        fn = 'obs_space{}_spin{}_field{}_{}'.format(space, spin, field, simidx)
-        log.debug('requesting "{}"'.format(fn))
-        fn_otherspin = 'obs_space{}_spin{}_field{}_{}'.format(space, self.spin, field, simidx)
-        fn_otherspace = ''
-        fn_otherspacespin = ''
-        if self.space == 'alm':
-            fn_otherspace = 'obs_space{}_spin{}_field{}_{}'.format('alm', 0, field, simidx)
-        elif self.space == 'map':
-            fn_otherspace = 'obs_space{}_spin{}_field{}_{}'.format('map', spin, field, simidx)
-        if self.space == 'alm':
-            fn_otherspacespin = 'obs_space{}_spin{}_field{}_{}'.format('alm', 0, field, simidx)
-        elif self.space == 'map':
-            fn_otherspacespin = 'obs_space{}_spin{}_field{}_{}'.format('map', self.spin, field, simidx)
-
-        if not self.cacher.is_cached(fn) and not self.cacher.is_cached(fn_otherspin) and not self.cacher.is_cached(fn_otherspacespin) and not self.cacher.is_cached(fn_otherspace):
-            log.debug('..nothing cached..')
-            if self.libdir == DNaV: # sky data comes from len_lib, and we add noise
-                log.debug('.., generating.')
-                obs = self.sky2obs(
-                    np.copy(self.len_lib.get_sim_sky(simidx, spin=spin, space=space, field=field)),
-                    np.copy(self.noise_lib.get_sim_noise(simidx, spin=spin, field=field, space=space)),
+        n0 = sht_ctx.nsht_thread()
+        if self.libdir == DNaV and np.all(self.maps == DNaV): # sky data comes from len_lib, and we add noise
+            fn = self.reps.fn(simidx, space, spin, field)
+            ret = self.cacher.get(fn)
+            if ret is None:
+                log.debug('..nothing cached, generating "{}"'.format(fn))
+                ret = self.sky2obs(
+                    self.len_lib.get_sim_sky(simidx, spin=0, space='alm', field=field),
+                    self.noise_lib.get_sim_noise(simidx, spin=spin, field=field, space=space),
                     spin=spin,
                     space=space,
                     field=field)
-            elif self.libdir != DNaV:  # observed data is somewhere
-                log.debug('.., but stored on disk.')
-                if field == 'polarization':
-                    if self.spin == 2:
-                        if self.fns['Q'] == self.fns['U'] and self.fns['Q'].endswith('.fits'):
-                            # Assume implicitly that Q is field=1, U is field=2
-                            obs1 = load_file(opj(self.libdir, self.fns['Q'].format(simidx)), ifield=1)
-                            obs2 = load_file(opj(self.libdir, self.fns['U'].format(simidx)), ifield=2)
-                        else:
-                            obs1 = load_file(opj(self.libdir, self.fns['Q'].format(simidx)))
-                            obs2 = load_file(opj(self.libdir, self.fns['U'].format(simidx)))
-                    elif self.spin == 0:
-                        if self.fns['E'] == self.fns['B'] and self.fns['B'].endswith('.fits'):
-                            # Assume implicitly that E is field=1, B is field=2
-                            obs1 = load_file(opj(self.libdir, self.fns['E'].format(simidx)), ifield=1)
-                            obs2 = load_file(opj(self.libdir, self.fns['B'].format(simidx)), ifield=2)
-                        else:
-                            obs1 = load_file(opj(self.libdir, self.fns['E'].format(simidx)))
-                            obs2 = load_file(opj(self.libdir, self.fns['B'].format(simidx)))
-                    obs1 = self.CMB_modifier(obs1)
-                    obs2 = self.CMB_modifier(obs2)                
-                    obs = np.array([obs1, obs2])
-                    if self.space == 'map':
-                        if space == 'map':
-                            if self.spin != spin:
-                                if self.spin == 0:
-                                    alm_buffer1 = self.geom_lib.map2alm(obs[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                    alm_buffer2 = self.geom_lib.map2alm(obs[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                    obs = self.geom_lib.alm2map_spin([alm_buffer1,alm_buffer2], lmax=self.lmax, spin=spin, mmax=self.lmax, nthreads=4)
-                                elif self.spin == 2:
-                                    alm_buffer = self.geom_lib.map2alm_spin(obs, spin=self.spin, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                    obs1 = self.geom_lib.alm2map(alm_buffer[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                    obs2 = self.geom_lib.alm2map(alm_buffer[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                    obs = np.array([obs1, obs2])
-                        elif space == 'alm':
-                            if self.spin == 0:
-                                obs1 = self.geom_lib.map2alm(obs[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                obs2 = self.geom_lib.map2alm(obs[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                obs = np.array([obs1, obs2])
-                            else:
-                                obs = self.geom_lib.map2alm_spin(obs, spin=self.spin, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                    elif self.space == 'alm':
-                        if space == 'map':
-                            if spin == 0:
-                                obs1 = self.geom_lib.alm2map(obs[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                obs2 = self.geom_lib.alm2map(obs[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                                obs = np.array([obs1, obs2])
-                            else:
-                                obs = self.geom_lib.alm2map_spin(obs, lmax=self.lmax, spin=spin, mmax=self.lmax, nthreads=4)
-                elif field == 'temperature':
-                    obs = np.array(load_file(opj(self.libdir, self.fns['T'].format(simidx))))
-                    obs = self.CMB_modifier(obs)
-                    if self.space == 'map':
-                        if space == 'alm':
-                            obs = self.geom_lib.map2alm(obs, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                    elif self.space == 'alm':
-                        if space == 'map':
-                            obs = self.geom_lib.alm2map(obs, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                self.cacher.cache(fn, obs)
-            self.cacher.cache(fn, obs)
-        elif self.cacher.is_cached(fn):
-            log.debug('found "{}"'.format(fn))
-            pass
-        elif self.cacher.is_cached(fn_otherspin):
-            log.debug('found "{}"'.format(fn_otherspin))
-            obs = np.array(self.cacher.load(fn_otherspin))
-            if space == 'map':
-                if self.spin == 2:
-                    obs1 = self.geom_lib.map2alm(obs[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                    obs2 = self.geom_lib.map2alm(obs[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                    obs = np.array([obs1, obs2])
-                    obs = self.geom_lib.alm2map_spin(obs, lmax=self.lmax, spin=self.spin, mmax=self.lmax, nthreads=4)
+                self.cacher.cache(fn, ret)
+                ret = self.cacher.get(fn, ret) # unless evicted meanwhile by another thread
+        else: # observed data is on disk or in memory
+            ret = self.reps.get(simidx, space, spin, field, None if self.libdir == DNaV else lambda: self._load_obs(simidx, field))
+        self._nsht_last.n = sht_ctx.nsht_thread() - n0
+        log.debug('obs sim {} {} {} spin {}: {} SHTs'.format(simidx, field, space, spin, self.nsht_last))
+        return ret
+
+
+    @property
+    def nsht_last(self):
+        """Number of SHTs of the last get_sim_obs() call of the calling thread
+
+        """
+        return getattr(self._nsht_last, 'n', 0)
+
+
+    def _load_obs(self, simidx, field):
+        """Observed field as stored on disk, in its native representation
+
+        """
+        log.debug('.., but stored on disk.')
+        if field == 'polarization':
+            if self.spin == 2:
+                if self.fns['Q'] == self.fns['U'] and self.fns['Q'].endswith('.fits'):
+                    # Assume implicitly that Q is field=1, U is field=2
+                    obs1 = load_file(opj(self.libdir, self.fns['Q'].format(simidx)), ifield=1)
+                    obs2 = load_file(opj(self.libdir, self.fns['U'].format(simidx)), ifield=2)
                 else:
-                    obs = self.geom_lib.map2alm_spin(obs, spin=self.spin, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                    obs1 = self.geom_lib.alm2map(obs[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                    obs2 = self.geom_lib.alm2map(obs[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                    obs = np.array([obs1, obs2])
-            self.cacher.cache(fn, obs)
-        elif self.cacher.is_cached(fn_otherspace):
-            log.debug('found "{}"'.format(fn_otherspace))
-            obs = np.array(self.cacher.load(fn_otherspace))
-            if field == 'polarization':
-                if self.space == 'alm':
-                    if spin == 0:
-                        obs1 = self.geom_lib.alm2map(obs[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                        obs2 = self.geom_lib.alm2map(obs[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                        obs = np.array([obs1, obs2])
-                    elif spin == 2:
-                        obs = self.geom_lib.alm2map_spin(obs, lmax=self.lmax, spin=spin, mmax=self.lmax, nthreads=4)
-                elif self.space == 'map':
-                    if self.spin == 0:
-                        alm_buffer1 = self.geom_lib.map2alm(obs[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                        alm_buffer2 = self.geom_lib.map2alm(obs[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                        obs = np.array([alm_buffer1, alm_buffer2])
-                    elif self.spin == 2:
-                        obs = self.geom_lib.map2alm_spin(obs, spin=self.spin, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-            elif field == 'temperature':
-                if self.space == 'alm': 
-                    obs = self.geom_lib.alm2map(obs, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                elif self.space == 'map':
-                    obs = self.geom_lib.map2alm(obs, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-            self.cacher.cache(fn, obs)
-        elif self.cacher.is_cached(fn_otherspacespin):
-            log.debug('found "{}"'.format(fn_otherspacespin))
-            obs = np.array(self.cacher.load(fn_otherspacespin))
-            if self.space == 'alm':
-                obs = self.geom_lib.alm2map_spin(obs, lmax=self.lmax, spin=spin, mmax=self.lmax, nthreads=4)
-            elif self.space == 'map':
-                obs = self.geom_lib.map2alm_spin(obs, spin=self.spin, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-            self.cacher.cache(fn, obs)
-        return self.cacher.load(fn)
+                    obs1 = load_file(opj(self.libdir, self.fns['Q'].format(simidx)))
+                    obs2 = load_file(opj(self.libdir, self.fns['U'].format(simidx)))
+            elif self.spin == 0:
+                if self.fns['E'] == self.fns['B'] and self.fns['B'].endswith('.fits'):
+                    # Assume implicitly that E is field=1, B is field=2
+                    obs1 = load_file(opj(self.libdir, self.fns['E'].format(simidx)), ifield=1)
+                    obs2 = load_file(opj(self.libdir, self.fns['B'].format(simidx)), ifield=2)
+                else:
+                    obs1 = load_file(opj(self.libdir, self.fns['E'].format(simidx)))
+                    obs2 = load_file(opj(self.libdir, self.fns['B'].format(simidx)))
+            return self.space, self.spin, np.array([self.CMB_modifier(obs1), self.CMB_modifier(obs2)])
+        obs = np.array(load_file(opj(self.libdir, self.fns['T'].format(simidx))))
+        return self.space, 0, self.CMB_modifier(obs)
     
 
-    def sky2obs(self, sky, noise, spin, space, field):
+    def sky2obs(self, skylm, noise, spin, space, field):
+        """Observed field in representation (space, spin), from the sky alms and the noise in that representation
+
+            The transfer function is applied onto the sky alms, so that only the synthesis of the observed map is needed.
+            skylm and noise may be read-only cached arrays and are not modified.
+
+        """
         if field == 'polarization':
-            if space == 'map':
-                if spin == 0:
-                    sky1 = self.geom_lib.map2alm(sky[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                    sky2 = self.geom_lib.map2alm(sky[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                    sky = np.array([sky1, sky2])
-                elif spin == 2:
-                    sky = self.geom_lib.map2alm_spin(sky, spin=spin, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-            hp.almxfl(sky[0], self.transfunction, inplace=True)
-            hp.almxfl(sky[1], self.transfunction, inplace=True)
-            if space == 'map':
-                if spin == 0:
-                    sky1 = self.geom_lib.alm2map(sky[0], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                    sky2 = self.geom_lib.alm2map(sky[1], lmax=self.lmax, mmax=self.lmax, nthreads=4)
-                    sky = np.array([sky1, sky2])
-                elif spin == 2:
-                    sky = np.array(self.geom_lib.alm2map_spin(sky, spin=spin, lmax=self.lmax, mmax=self.lmax, nthreads=4))
-                return sky + noise
-            else:
-                return sky + noise
+            obslm = np.array([hp.almxfl(skylm[0], self.transfunction), hp.almxfl(skylm[1], self.transfunction)])
         elif field == 'temperature':
-            if space == 'map':
-                sky = self.geom_lib.map2alm(sky, lmax=self.lmax, mmax=self.lmax, nthreads=4)
-            hp.almxfl(sky, self.transfunction, inplace=True)
-            if space == 'map':
-                return np.array(self.geom_lib.alm2map(sky, lmax=self.lmax, mmax=self.lmax, nthreads=4)) + noise
-            else:
-                return sky + noise
+            obslm = hp.almxfl(skylm, self.transfunction)
+        if space == 'map':
+            return self.reps.alm2map(obslm, spin, field) + noise
+        return obslm + noise
 
 
     def get_sim_noise(self, simidx, space, field, spin=2):
@@ -838,7 +917,7 @@ class Simhandler:
     """Entry point for data handling and generating simulations. Data can be cl, unl, len, or obs, .. and alms or maps. Simhandler connects the individual libraries and decides what can be generated. E.g.: If obs data provided, len data cannot be generated. This structure makes sure we don't "hallucinate" data
 
     """
-    def __init__(self, flavour, space, geominfo=DNaV, maps=DNaV, field=DNaV, cls_lib=DNaV, unl_lib=DNaV, len_lib=DNaV, obs_lib=DNaV, noise_lib=DNaV, libdir=DNaV, libdir_noise=DNaV, libdir_phi=DNaV, fns=DNaV, fnsnoise=DNaV, fnsP=DNaV, lmax=DNaV, transfunction=DNaV, nlev=DNaV, spin=0, CMB_fn=DNaV, phi_fn=DNaV, phi_field=DNaV, phi_space=DNaV, epsilon=1e-7, phi_lmax=DNaV, libdir_suffix=DNaV, lenjob_geominfo=DNaV, cacher=cachers.cacher_mem(safe=True), CMB_modifier=DNaV, phi_modifier=DNaV):
+    def __init__(self, flavour, space, geominfo=DNaV, maps=DNaV, field=DNaV, cls_lib=DNaV, unl_lib=DNaV, len_lib=DNaV, obs_lib=DNaV, noise_lib=DNaV, libdir=DNaV, libdir_noise=DNaV, libdir_phi=DNaV, fns=DNaV, fnsnoise=DNaV, fnsP=DNaV, lmax=DNaV, transfunction=DNaV, nlev=DNaV, spin=0, CMB_fn=DNaV, phi_fn=DNaV, phi_field=DNaV, phi_space=DNaV, epsilon=1e-7, phi_lmax=DNaV, libdir_suffix=DNaV, lenjob_geominfo=DNaV, cacher=DNaV, CMB_modifier=DNaV, phi_modifier=DNaV, nthreads=DNaV):
         """Entry point for simulation data handling.
         Simhandler() connects the individual librariers together accordingly, depending on the provided data.
         It never stores data on disk itself, only in memory.
@@ -868,7 +947,10 @@ class Simhandler:
             epsilon      (float, optional): Lenspyx lensing accuracy. Defaults to 1e-7.
             CMB_modifier (callable, optional): operation defined in the callable will be applied to each of the input maps/alms/cls
             phi_modifier (callable, optional): operation defined in the callable will be applied to the input phi lms
+            cacher       (cacher, optional): in-memory cacher of the observed maps. Defaults to a read-only zero-copy cacher, evicting the least recently used arrays of all simulation libraries beyond `default_cache_maxbytes()` in total. Returned arrays are then non-writeable views, copy them before modifying.
+            nthreads     (int, optional): number of threads of the SHTs, set process-wide for all simulation libraries. Defaults to OMP_NUM_THREADS, or the available cpus shared among the MPI ranks of the node.
         """
+        sht_ctx.set_nthreads(default_nthreads() if nthreads == DNaV else nthreads)
         self.spin = spin
         self.lmax = lmax
         self.phi_lmax = phi_lmax
@@ -995,13 +1077,18 @@ class Simhandler:
         return self.unl_lib.get_sim_phi(simidx=simidx, space=space)
     
     def purgecache(self):
+        """Releases the in-memory simulations of all libraries. Not needed in general, as the cachers evict the least recently used simulations within their memory budget
+
+        """
         log.info('sims_lib: purging cachers to release memory')
-        libs = ['obs_lib', 'noise_lib', 'unl_lib', 'len_lib']
+        libs = ['obs_lib', 'noise_lib', 'unl_lib', 'len_lib', 'cls_lib']
         for lib in libs:
-            if lib in self.__dict__:
-                if len(list(self.obs_lib.cacher._cache.keys())) > 0:
-                    for key in np.copy(list(self.obs_lib.cacher._cache.keys())):
-                        self.obs_lib.cacher.remove(key)
+            cacher = getattr(self.__dict__.get(lib, None), 'cacher', None)
+            if hasattr(cacher, 'clear'):
+                cacher.clear()
+            elif hasattr(cacher, '_cache'):
+                for key in list(cacher._cache.keys()):
+                    cacher.remove(key)
 
     def isdone(self, simidx, field, spin, space='map', flavour='obs'):
         fn = '{}_space{}_spin{}_field{}_{}'.format(flavour, space, spin, field, simidx)
@@ -1053,5 +1140,5 @@ class anafast_clone():
         return self.npixel
 
 def get_geom(geominfo):
-    return lp_get_geom(geominfo)
+    return sht_ctx.get_geom(geominfo)
     # return anafast_clone(geominfo)
\ No newline at end of file
@@ -1,6 +1,22 @@
 import numpy as np
-from numpy.random import default_rng
-rng = default_rng()
+from functools import lru_cache, cached_property
+from numpy.random import default_rng, Generator, Philox, SeedSequence
+_rng = default_rng()
+
+# alm arrays up to this size are processed with precomputed index maps, larger ones (memory-bound) with slices per m
+NALM_KERNEL = 2 ** 19
+
+
+@lru_cache(maxsize=16)
+def _copy_idcs(lmaxin:int, mmaxin:int, lmaxout:int, mmaxout:int, lcut:int):
+    """Indices into the input and output alm layouts of all entries with l <= lcut present in both (read-only)
+
+    """
+    layout = Alm.layout(lmaxin, mmaxin)
+    l, m = layout.ls, layout.ms
+    idx_in = np.flatnonzero((l <= lcut) & (m <= mmaxout))
+    idx_out = Alm.getidx(lmaxout, l[idx_in], m[idx_in])
+    return _readonly(idx_in), _readonly(idx_out)
 
 
 def almxfl(alm:np.ndarray, fl:np.ndarray, mmax:int or None, inplace:bool):
@@ -9,7 +25,7 @@ def almxfl(alm:np.ndarray, fl:np.ndarray, mmax:int or None, inplace:bool):
     Parameters
     ----------
     alm : array
-      The alm to multiply
+      The alm to multiply, or a stack of alms along the last axis
     fl : array
       The function (at l=0..fl.size-1) by which alm must be multiplied.
     mmax : None or int
@@ -24,20 +40,18 @@ def almxfl(alm:np.ndarray, fl:np.ndarray, mmax:int or None, inplace:bool):
       if inplace is True.
 
     """
-    lmax = Alm.getlmax(alm.size, mmax)
+    lmax = Alm.getlmax(alm.shape[-1], mmax)
     if mmax is None or mmax < 0:
         mmax = lmax
     assert fl.size > lmax, (fl.size, lmax)
-    if inplace:
-        for m in range(mmax + 1):
-            b = m * (2 * lmax + 1 - m) // 2 + m
-            alm[b:b + lmax - m + 1] *= fl[m:lmax+1]
-        return
+    ret = alm if inplace else np.copy(alm)
+    layout = Alm.layout(lmax, mmax)
+    if alm.shape[-1] <= NALM_KERNEL:
+        ret *= fl[layout.ls]
     else:
-        ret = np.copy(alm)
-        for m in range(mmax + 1):
-            b = m * (2 * lmax + 1 - m) // 2 + m
-            ret[b:b + lmax - m + 1] *= fl[m:lmax+1]
+        for m, b in enumerate(layout.mstart):
+            ret[..., b:b + lmax - m + 1] *= fl[m:lmax+1]
+    if not inplace:
         return ret
 
 
@@ -62,7 +76,7 @@ def gauss_beam(fwhm:float, lmax:int):
     bl = np.exp(-0.5 * l * (l + 1) * (fwhm / np.sqrt(8.0 * np.log(2.0))) ** 2)
     return bl
 
-def synalm(cl:np.ndarray, lmax:int, mmax:int or None):
+def synalm(cl:np.ndarray, lmax:int, mmax:int or None, rng:Generator or None=None):
     """Creates a Gaussian field alm from input cl array
 
     Parameters
@@ -73,6 +87,8 @@ def synalm(cl:np.ndarray, lmax:int, mmax:int or None):
         Maximum multipole simulated
     mmax: int
         Maximum m defining the alm layout, defaults to lmax if None or < 0
+    rng: Generator or None
+        Random generator to draw from, e.g. one of rng_streams. Defaults to a module-wide generator
 
     Returns
     -------
@@ -83,20 +99,41 @@ def synalm(cl:np.ndarray, lmax:int, mmax:int or None):
     assert lmax + 1 <= cl.size
     if mmax is None or mmax < 0:
         mmax = lmax
-    alm_size = Alm.getsize(lmax, mmax)
-    alm = rng.standard_normal(alm_size) + 1j * rng.standard_normal(alm_size)
+    if rng is None:
+        rng = _rng
+    layout = Alm.layout(lmax, mmax)
+    alm = rng.standard_normal(layout.nalm) + 1j * rng.standard_normal(layout.nalm)
     almxfl(alm, np.sqrt(cl[:lmax+1] * 0.5), mmax, True)
-    real_idcs = Alm.getidx(lmax, np.arange(lmax + 1, dtype=int), 0)
-    alm[real_idcs] = alm[real_idcs].real * np.sqrt(2.)
+    alm[layout.real_idcs] = alm[layout.real_idcs].real * np.sqrt(2.)
     return alm
 
+class rng_streams:
+    """Reproducible and independent random streams, labelled by tuples of non-negative integers, e.g. (simidx, iteration, field)
+
+        Each stream is a counter-based Philox generator seeded by SeedSequence(entropy, spawn_key=key), so that any stream
+        can be regenerated on any rank or thread from the entropy and its key alone, and no phase needs storing.
+
+        Args:
+            entropy: seed of the streams. If None, fresh entropy is drawn; it is then available as self.entropy
+
+    """
+    def __init__(self, entropy:int or None=None):
+        self.entropy = SeedSequence(entropy).entropy
+
+    def __call__(self, *key:int):
+        """Generator of the stream labelled by *key*, restarted from its beginning at each call
+
+        """
+        return Generator(Philox(SeedSequence(self.entropy, spawn_key=tuple(int(k) for k in key))))
+
+
 def alm2cl(alm:np.ndarray, blm:np.ndarray or None, lmax:int or None, mmax:int or None, lmaxout:int or None):
     """Auto- or cross-power spectrum between two alm arrays
 
     Parameters
     ----------
     alm : ndarray
-        First alm harmonic coefficient array
+        First alm harmonic coefficient array, or a stack of alms along the last axis
     blm : ndarray or None
         Second alm harmonic coefficient array, can set this to same alm object or to None if same as alm
     lmax : int or None
@@ -111,30 +148,35 @@ def alm2cl(alm:np.ndarray, blm:np.ndarray or None, lmax:int or None, mmax:int or
         (cross-)power of the input alm and blm arrays
 
     """
-    if lmax is None: lmax = Alm.getlmax(alm.size, mmax)
+    if lmax is None: lmax = Alm.getlmax(alm.shape[-1], mmax)
     if lmaxout is None: lmaxout = lmax
     if mmax is None: mmax = lmax
-    assert lmax == Alm.getlmax(alm.size, mmax), (lmax, Alm.getlmax(alm.size, mmax))
+    if blm is None: blm = alm
+    assert lmax == Alm.getlmax(alm.shape[-1], mmax), (lmax, Alm.getlmax(alm.shape[-1], mmax))
+    assert lmax == Alm.getlmax(blm.shape[-1], mmax), (lmax, Alm.getlmax(blm.shape[-1], mmax))
     lmaxout_ = min(lmaxout, lmax)
-    if blm is not alm: # looks like twice faster than healpy implementation... ?!
-        assert lmax == Alm.getlmax(blm.size, mmax), (lmax, Alm.getlmax(blm.size, mmax))
-        cl = 0.5 * alm[:lmaxout_ + 1].real * blm[:lmaxout_ + 1].real
-        for m in range(1, min(mmax, lmaxout_) + 1):
-            m_idx = Alm.getidx(lmax,  m, m)
-            a = alm[m_idx:m_idx + lmaxout_ - m + 1]
-            b = blm[m_idx:m_idx + lmaxout_ - m + 1]
-            cl[m:] += a.real * b.real + a.imag * b.imag
+    if alm.ndim == 1 and blm.ndim == 1 and alm.size <= NALM_KERNEL:
+        if blm is not alm:
+            clm = alm.real * blm.real + alm.imag * blm.imag
+        else:
+            clm = alm.real ** 2 + alm.imag ** 2
+        clm[:lmax + 1] = 0.5 * alm[:lmax + 1].real * blm[:lmax + 1].real
+        cl = np.bincount(Alm.layout(lmax, mmax).ls, weights=clm, minlength=lmax + 1)[:lmaxout_ + 1]
     else:
-        a = alm[:lmaxout_ + 1].real
-        cl = 0.5 * a.real * a.real
+        cl = 0.5 * alm[..., :lmaxout_ + 1].real * blm[..., :lmaxout_ + 1].real
+        mstart = Alm.layout(lmax, mmax).mstart
         for m in range(1, min(mmax, lmaxout_) + 1):
-            m_idx = Alm.getidx(lmax,  m, m)
-            a = alm[m_idx:m_idx + lmaxout_ - m + 1]
-            cl[m:] += a.real * a.real + a.imag * a.imag
-    cl *= 2. / (2 * np.arange(len(cl)) + 1)
+            m_idx = mstart[m]
+            a = alm[..., m_idx:m_idx + lmaxout_ - m + 1]
+            if blm is not alm: # looks like twice faster than healpy implementation... ?!
+                b = blm[..., m_idx:m_idx + lmaxout_ - m + 1]
+                cl[..., m:] += a.real * b.real + a.imag * b.imag
+            else:
+                cl[..., m:] += a.real * a.real + a.imag * a.imag
+    cl *= 2. / (2 * np.arange(cl.shape[-1]) + 1)
     if lmaxout > lmaxout_:
-        ret = np.zeros(lmaxout + 1, dtype=float)
-        ret[:lmaxout_ + 1] = cl
+        ret = np.zeros((*cl.shape[:-1], lmaxout + 1), dtype=float)
+        ret[..., :lmaxout_ + 1] = cl
         return ret
     return cl
 
@@ -144,7 +186,7 @@ def alm_copy(alm:np.ndarray, mmaxin:int or None, lmaxout:int, mmaxout:int):
         Parameters
         ----------
         alm :ndarray
-            healpy alm arrays to copy.
+            healpy alm array to copy, or a stack of alms along the first axis
         mmaxin: int or None
             mmax parameter of input array (can be set to None or negative for default)
         lmaxout : int
@@ -155,21 +197,21 @@ def alm_copy(alm:np.ndarray, mmaxin:int or None, lmaxout:int, mmaxout:int):
 
     """
     alms = np.atleast_2d(alm)
-    ret = []
-    for alm in alms:
-        lmaxin = Alm.getlmax(alm.size, mmaxin)
-        if mmaxin is None or mmaxin < 0: mmaxin = lmaxin
-        if (lmaxin == lmaxout) and (mmaxin == mmaxout):
-            ret.append(np.copy(alm))
+    lmaxin = Alm.getlmax(alms.shape[-1], mmaxin)
+    if mmaxin is None or mmaxin < 0: mmaxin = lmaxin
+    if (lmaxin == lmaxout) and (mmaxin == mmaxout):
+        ret = np.copy(alms)
+    else:
+        ret = np.zeros((alms.shape[0], Alm.getsize(lmaxout, mmaxout)), dtype=alms.dtype)
+        lmax_min = min(lmaxout, lmaxin)
+        if alms.shape[-1] <= NALM_KERNEL:
+            idx_in, idx_out = _copy_idcs(lmaxin, mmaxin, lmaxout, mmaxout, lmax_min)
+            ret[:, idx_out] = alms[:, idx_in]
         else:
-            _ret = np.zeros(Alm.getsize(lmaxout, mmaxout), dtype=alm.dtype)
-            lmax_min = min(lmaxout, lmaxin)
+            mstart_in, mstart_out = Alm.layout(lmaxin, mmaxin).mstart, Alm.layout(lmaxout, mmaxout).mstart
             for m in range(0, min(mmaxout, mmaxin) + 1):
-                idx_in =  m * (2 * lmaxin + 1 - m) // 2 + m
-                idx_out = m * (2 * lmaxout+ 1 - m) // 2 + m
-                _ret[idx_out: idx_out + lmax_min + 1 - m] = alm[idx_in: idx_in + lmax_min + 1 - m]
-            ret.append(_ret)
-    ret = np.array(ret)
+                idx_in, idx_out = mstart_in[m], mstart_out[m]
+                ret[:, idx_out: idx_out + lmax_min + 1 - m] = alms[:, idx_in: idx_in + lmax_min + 1 - m]
     if ret.shape[0] == 1:
         return ret[0]
     else:
@@ -183,22 +225,103 @@ def alm_splice(alm_lo, alm_hi, lsplit):
     if hasattr(alm_lo, 'alm_splice'):
         return alm_lo.alm_splice(alm_hi, lsplit)
 
-    alm_lo_lmax = Alm.getlmax(len(alm_lo))
-    alm_hi_lmax = Alm.getlmax(len(alm_hi))
+    alm_lo_lmax = Alm.getlmax(alm_lo.shape[-1], None)
+    alm_hi_lmax = Alm.getlmax(alm_hi.shape[-1], None)
 
     assert alm_lo_lmax >= lsplit and alm_hi_lmax >= lsplit
 
     alm_re = np.copy(alm_hi)
-    for m in range(0, lsplit + 1):
-        alm_re[(m * (2 * alm_hi_lmax + 1 - m) // 2 + m):(m * (2 * alm_hi_lmax + 1 - m) // 2 + lsplit + 1)] = \
-        alm_lo[(m * (2 * alm_lo_lmax + 1 - m) // 2 + m):(m * (2 * alm_lo_lmax + 1 - m) // 2 + lsplit + 1)]
+    if alm_hi.shape[-1] <= NALM_KERNEL:
+        idx_lo, idx_hi = _copy_idcs(alm_lo_lmax, alm_lo_lmax, alm_hi_lmax, alm_hi_lmax, lsplit)
+        alm_re[..., idx_hi] = alm_lo[..., idx_lo]
+    else:
+        for m in range(0, lsplit + 1):
+            alm_re[..., (m * (2 * alm_hi_lmax + 1 - m) // 2 + m):(m * (2 * alm_hi_lmax + 1 - m) // 2 + lsplit + 1)] = \
+            alm_lo[..., (m * (2 * alm_lo_lmax + 1 - m) // 2 + m):(m * (2 * alm_lo_lmax + 1 - m) // 2 + lsplit + 1)]
     return alm_re
 
+class alm_layout:
+    """Precomputed indexing of the alm array with lmax, mmax parameters.
+
+        Obtain the shared instance for a layout with Alm.layout(lmax, mmax). All arrays are read-only.
+
+        Attributes:
+            nalm: size of the alm array
+            mstart: index of the first entry (l = m) of each m
+            ls, ms: multipole l and m of each entry (built on first use)
+            real_idcs: indices of the m = 0 entries, real-valued for real fields
+            real_mask: boolean mask of the m = 0 entries (built on first use)
+
+    """
+    def __init__(self, lmax:int, mmax:int):
+        self.lmax = lmax
+        self.mmax = mmax
+        self.nalm = Alm.getsize(lmax, mmax)
+        m = np.arange(mmax + 1)
+        self.mstart = _readonly(m * (2 * lmax + 1 - m) // 2 + m)
+        self.real_idcs = _readonly(np.arange(lmax + 1))
+
+    @cached_property
+    def ms(self):
+        return _readonly(np.repeat(np.arange(self.mmax + 1), self.lmax + 1 - np.arange(self.mmax + 1)))
+
+    @cached_property
+    def ls(self):
+        return _readonly(np.arange(self.nalm) - self.mstart[self.ms] + self.ms)
+
+    @cached_property
+    def real_mask(self):
+        mask = np.zeros(self.nalm, dtype=bool)
+        mask[self.real_idcs] = True
+        return _readonly(mask)
+
+    def dot(self, alm:np.ndarray, blm:np.ndarray, lmin:int=0):
+        """Scalar product sum_l (2l + 1) C_l^{ab} from lmin to lmax, with C_l^{ab} the alm2cl cross-spectrum
+
+        """
+        a0, b0 = alm[lmin:self.lmax + 1], blm[lmin:self.lmax + 1]
+        ret = 2. * np.vdot(alm, blm).real - 2. * np.vdot(alm[:self.lmax + 1], blm[:self.lmax + 1]).real + np.dot(a0.real, b0.real)
+        for m, b in enumerate(self.mstart[1:min(lmin, self.mmax + 1)], start=1):
+            ret -= 2. * np.vdot(alm[b:b + lmin - m], blm[b:b + lmin - m]).real
+        return ret
+
+
+def _readonly(arr:np.ndarray):
+    arr.setflags(write=False)
+    return arr
+
+
+@lru_cache(maxsize=32)
+def _alm_layout(lmax:int, mmax:int):
+    return alm_layout(lmax, mmax)
+
+
 class Alm:
     """alm arrays useful statics. Directly from healpy but excluding keywords
 
 
     """
+    @staticmethod
+    def layout(lmax:int, mmax:int or None):
+        """Shared precomputed indexing of the alm layout with lmax and mmax parameters
+
+        Parameters
+        ----------
+        lmax : int
+          The maximum multipole l, defines the alm layout
+        mmax : int or None
+          The maximum quantum number m, defines the alm layout, defaults to lmax if None or < 0
+
+        Returns
+        -------
+        layout : alm_layout
+            memoized layout instance
+
+        """
+        if mmax is None or mmax < 0:
+            mmax = lmax
+        return _alm_layout(int(lmax), int(mmax))
+
     @staticmethod
     def getsize(lmax:int, mmax:int):
         """Number of entries in alm array with lmax and mmax parameters
@@ -245,6 +368,7 @@ class Alm:
         return m * (2 * lmax + 1 - m) // 2 + l
 
     @staticmethod
+    @lru_cache(maxsize=64)
     def getlmax(s:int, mmax:int or None):
         """Returns the lmax corresponding to a given healpy array size.
 
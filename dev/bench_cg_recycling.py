@@ -0,0 +1,104 @@
+"""Iteration counts of the masked polarization cg inversion, with and without Krylov subspace recycling
+
+    Filters a few Gaussian simulations on a cut sky, once with the standard solver and once harvesting and recycling
+    Ritz vectors across the solves (recycle_nvec), and prints the cg iteration counts.
+
+    With 'healpy', the operator S^-1 + B^t Y^t N^-1 Y B of the polarization filtering (with Y the spin-2 SHTs, B the beam
+    and N^-1 the masked inverse pixel noise) is inverted with cd_solve directly, preconditioned with its diagonal in l.
+    With 'cinv_p', the simulations are filtered with filt_cinv.cinv_p and its multigrid chain (requires plancklens).
+
+    usage: python bench_cg_recycling.py [healpy|cinv_p] [nsims] [recycle_nvec] [nside] [nlev_p]
+
+    The multipoles go up to lmax = 2 nside. See README.rst for results.
+
+"""
+import os, sys, time, tempfile
+import numpy as np
+import healpy as hp
+
+from delensalot.utils import camb_clfile
+from delensalot.core.cg import cd_solve, cd_monitors
+
+nside, lmax, nlev_p, fwhm = 32, 64, 300., 5.
+tol = 1e-4
+
+def get_ninv():
+    npix = hp.nside2npix(nside)
+    theta, phi = hp.pix2ang(nside, np.arange(npix))
+    mask = (np.abs(np.cos(theta)) > 0.5).astype(float)  # |b| > 30 deg, roughly
+    return [mask / (nlev_p / 60. / 180. * np.pi) ** 2 * npix / (4. * np.pi)]
+
+def get_sim(cls, transf, seed):
+    np.random.seed(seed)
+    tlm, elm, blm = hp.synalm([cls['tt'][:lmax + 1], cls['ee'][:lmax + 1], cls['bb'][:lmax + 1], cls['te'][:lmax + 1]], new=True)
+    hp.almxfl(elm, transf, inplace=True)
+    hp.almxfl(blm, transf, inplace=True)
+    Q, U = hp.alm2map_spin([elm, blm], nside, 2, lmax)
+    sig = nlev_p / 60. / 180. * np.pi / np.sqrt(hp.nside2pixarea(nside))
+    return [Q + sig * np.random.standard_normal(Q.size), U + sig * np.random.standard_normal(U.size)]
+
+def dot_op(eblm1, eblm2):
+    """Scalar product of (elm, blm) pairs, counting the m > 0 modes twice"""
+    return np.sum(2. * np.vdot(eblm1, eblm2).real - np.vdot(eblm1[:, :lmax + 1], eblm2[:, :lmax + 1]).real)
+
+class fwd_op:
+    """S^-1 + B^t Y^t N^-1 Y B, on (elm, blm) pairs"""
+    def __init__(self, cls, transf, ninv):
+        self.cls_inv = [np.where(cls[k][:lmax + 1] > 0, 1. / np.where(cls[k][:lmax + 1] > 0, cls[k][:lmax + 1], 1.), 1.) for k in ['ee', 'bb']]
+        self.transf = transf
+        self.ninv = ninv[0] # inverse pixel variance
+
+    def YtNiY(self, eblm):
+        QU = hp.alm2map_spin([hp.almxfl(eblm[0], self.transf), hp.almxfl(eblm[1], self.transf)], nside, 2, lmax)
+        eblm = np.array(hp.map2alm_spin([QU[0] * self.ninv, QU[1] * self.ninv], 2, lmax=lmax)) * hp.nside2npix(nside) / (4. * np.pi)
+        return np.array([hp.almxfl(eblm[0], self.transf), hp.almxfl(eblm[1], self.transf)])
+
+    def __call__(self, eblm):
+        return np.array([hp.almxfl(eblm[i], self.cls_inv[i]) for i in range(2)]) + self.YtNiY(eblm)
+
+    def calc_prep(self, QU):
+        eblm = np.array(hp.map2alm_spin([QU[0] * self.ninv, QU[1] * self.ninv], 2, lmax=lmax)) * hp.nside2npix(nside) / (4. * np.pi)
+        return np.array([hp.almxfl(eblm[0], self.transf), hp.almxfl(eblm[1], self.transf)])
+
+    def pre_op(self, eblm):
+        ninv_bar = np.mean(self.ninv) * hp.nside2npix(nside) / (4. * np.pi)
+        return np.array([hp.almxfl(eblm[i], 1. / (self.cls_inv[i] + ninv_bar * self.transf ** 2)) for i in range(2)])
+
+def bench_healpy(cls_len, transf, ninv, sims, nvec):
+    op = fwd_op(cls_len, transf, ninv)
+    recycler = cd_solve.recycler(nvec=nvec, nkeep=2 * nvec) if nvec > 0 else None
+    its = []
+    for QU in sims:
+        b = op.calc_prep(QU)
+        x = np.zeros_like(b)
+        monitor = cd_monitors.monitor_basic(dot_op, iter_max=1000, eps_min=tol, logger=None)
+        its.append(cd_solve.cd_solve(x, b, op, [op.pre_op], dot_op, monitor, cd_solve.tr_cg, recycler=recycler))
+    return its
+
+def bench_cinv_p(cls_len, transf, ninv, sims, nvec):
+    from delensalot.core.ivf import filt_cinv
+    cinv = filt_cinv.cinv_p(tempfile.mkdtemp(), lmax, nside, cls_len, transf, ninv, recycle_nvec=nvec)
+    its = []
+    for QU in sims:
+        cinv.apply_ivf(QU)
+        its.append(cinv.chain.iter_solve)
+    return its
+
+if __name__ == '__main__':
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'healpy'
+    nsims = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    recycle_nvec = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    if len(sys.argv) > 4:
+        nside = int(sys.argv[4])
+        lmax = 2 * nside
+    if len(sys.argv) > 5:
+        nlev_p = float(sys.argv[5])
+    cls_len = camb_clfile(os.path.join(os.path.dirname(__file__), '..', 'delensalot', 'data', 'cls', 'FFP10_wdipole_lensedCls.dat'))
+    transf = hp.gauss_beam(fwhm / 60. / 180. * np.pi, lmax=lmax)
+    ninv = get_ninv()
+    sims = [get_sim(cls_len, transf, seed) for seed in range(nsims)]
+    bench = {'healpy': bench_healpy, 'cinv_p': bench_cinv_p}[mode]
+    for nvec in [0, recycle_nvec]:
+        t0 = time.time()
+        its = bench(cls_len, transf, ninv, sims, nvec)
+        print('%s, recycle_nvec %2d: cg iterations %s, total %d (%.0f secs)' % (mode, nvec, its, np.sum(its), time.time() - t0))
@@ -0,0 +1,83 @@
+"""Timings of the utils_hp alm kernels against the former loops over m
+
+    Checks that almxfl, alm2cl, alm_copy and alm_splice agree with the loop implementations, and prints their timings
+    for single alms and stacks of alms.
+
+    usage: python bench_utils_hp.py [lmax1 lmax2 ...]
+
+"""
+import sys, time
+import numpy as np
+
+from delensalot.utility import utils_hp
+from delensalot.utility.utils_hp import Alm
+
+
+def almxfl_loop(alm, fl, mmax):
+    lmax = Alm.getlmax(alm.shape[-1], mmax)
+    ret = np.copy(alm)
+    for m in range(mmax + 1):
+        b = m * (2 * lmax + 1 - m) // 2 + m
+        ret[..., b:b + lmax - m + 1] *= fl[m:lmax+1]
+    return ret
+
+def alm2cl_loop(alm, blm, lmax, mmax):
+    cl = 0.5 * alm[:lmax + 1].real * blm[:lmax + 1].real
+    for m in range(1, mmax + 1):
+        m_idx = Alm.getidx(lmax, m, m)
+        a = alm[m_idx:m_idx + lmax - m + 1]
+        b = blm[m_idx:m_idx + lmax - m + 1]
+        cl[m:] += a.real * b.real + a.imag * b.imag
+    return cl * 2. / (2 * np.arange(len(cl)) + 1)
+
+def alm_copy_loop(alm, lmaxin, lmaxout):
+    ret = np.zeros(Alm.getsize(lmaxout, lmaxout), dtype=alm.dtype)
+    lmax_min = min(lmaxout, lmaxin)
+    for m in range(0, lmax_min + 1):
+        idx_in = m * (2 * lmaxin + 1 - m) // 2 + m
+        idx_out = m * (2 * lmaxout + 1 - m) // 2 + m
+        ret[idx_out: idx_out + lmax_min + 1 - m] = alm[idx_in: idx_in + lmax_min + 1 - m]
+    return ret
+
+def alm_splice_loop(alm_lo, alm_hi, lsplit):
+    lmax_lo, lmax_hi = Alm.getlmax(alm_lo.size, None), Alm.getlmax(alm_hi.size, None)
+    ret = np.copy(alm_hi)
+    for m in range(0, lsplit + 1):
+        ret[m * (2 * lmax_hi + 1 - m) // 2 + m:m * (2 * lmax_hi + 1 - m) // 2 + lsplit + 1] = \
+        alm_lo[m * (2 * lmax_lo + 1 - m) // 2 + m:m * (2 * lmax_lo + 1 - m) // 2 + lsplit + 1]
+    return ret
+
+def timeit(func, *args, n=5):
+    func(*args) # builds the index maps
+    t0 = time.time()
+    for i in range(n):
+        func(*args)
+    return (time.time() - t0) / n * 1e3
+
+def randalm(lmax, *shape):
+    nalm = Alm.getsize(lmax, lmax)
+    alm = np.random.standard_normal((*shape, nalm)) + 1j * np.random.standard_normal((*shape, nalm))
+    alm[..., :lmax + 1] = alm[..., :lmax + 1].real
+    return alm
+
+if __name__ == '__main__':
+    lmaxs = [int(arg) for arg in sys.argv[1:]] or [128, 512, 1024, 2048, 4096]
+    print('%6s %-22s %10s %10s' % ('lmax', 'kernel', 'loop [ms]', 'new [ms]'))
+    for lmax in lmaxs:
+        alm, blm, fl, stack = randalm(lmax), randalm(lmax), np.random.random(lmax + 1), randalm(lmax, 8)
+        alm_lo = randalm(lmax // 2)
+        assert np.allclose(utils_hp.almxfl(alm, fl, lmax, False), almxfl_loop(alm, fl, lmax))
+        assert np.allclose(utils_hp.alm2cl(alm, blm, lmax, lmax, lmax), alm2cl_loop(alm, blm, lmax, lmax))
+        assert np.allclose(utils_hp.alm_copy(alm, None, lmax // 2, lmax // 2), alm_copy_loop(alm, lmax, lmax // 2))
+        assert np.allclose(utils_hp.alm_splice(alm_lo, alm, lmax // 4), alm_splice_loop(alm_lo, alm, lmax // 4))
+        rows = [
+            ('almxfl', timeit(almxfl_loop, alm, fl, lmax), timeit(utils_hp.almxfl, alm, fl, lmax, False)),
+            ('almxfl (8 stacked)', sum(timeit(almxfl_loop, a, fl, lmax) for a in stack), timeit(utils_hp.almxfl, stack, fl, lmax, False)),
+            ('alm2cl', timeit(alm2cl_loop, alm, blm, lmax, lmax), timeit(utils_hp.alm2cl, alm, blm, lmax, lmax, lmax)),
+            ('alm2cl (8 stacked)', sum(timeit(alm2cl_loop, a, a, lmax, lmax) for a in stack), timeit(utils_hp.alm2cl, stack, None, lmax, lmax, lmax)),
+            ('alm_copy', timeit(alm_copy_loop, alm, lmax, lmax // 2), timeit(utils_hp.alm_copy, alm, None, lmax // 2, lmax // 2)),
+            ('alm_copy (8 stacked)', sum(timeit(alm_copy_loop, a, lmax, lmax // 2) for a in stack), timeit(utils_hp.alm_copy, stack, None, lmax // 2, lmax // 2)),
+            ('alm_splice', timeit(alm_splice_loop, alm_lo, alm, lmax // 4), timeit(utils_hp.alm_splice, alm_lo, alm, lmax // 4)),
+        ]
+        for name, t_loop, t_new in rows:
+            print('%6d %-22s %10.3f %10.3f' % (lmax, name, t_loop, t_new))
@@ -0,0 +1,90 @@
+"""unit test: L-BFGS inverse Hessian of core.iterator.bfgs
+
+    Tests the two-loop recursion of BFGS_Hessian against the recursive product form of the inverse Hessian update,
+    and against the dense BFGS inverse Hessian, on a small quadratic problem.
+
+    E.g.,
+        python3 -m unittest test_unit_bfgs
+
+"""
+
+
+import unittest
+
+import numpy as np
+
+from delensalot.core import cachers
+from delensalot.core.iterator import bfgs
+
+
+def applyH_recursive(x, k, s, y, applyH0k, L):
+    """Recursive product form H_new = (1 - rho s y^t) H (1 - rho y s^t) + rho ss^t, as applied before the two-loop recursion"""
+    def _applyH(x, k, depth):
+        if k <= 0 or depth >= L: return applyH0k(x, k)
+        rho = 1. / np.sum(s[k - 1] * y[k - 1])
+        Hv = _applyH(x - rho * y[k - 1] * np.sum(x * s[k - 1]), k - 1, depth + 1)
+        return Hv - s[k - 1] * (rho * np.sum(y[k - 1] * Hv)) + rho * s[k - 1] * np.sum(s[k - 1] * x)
+    return _applyH(x, k, 0)
+
+
+def H_dense(k, s, y, H0, L):
+    """Dense L-BFGS inverse Hessian at iteration k"""
+    H = H0.copy()
+    I = np.eye(H0.shape[0])
+    for i in range(max(0, k - L), k):
+        rho = 1. / np.dot(s[i], y[i])
+        H = (I - rho * np.outer(s[i], y[i])) @ H @ (I - rho * np.outer(y[i], s[i])) + rho * np.outer(s[i], s[i])
+    return H
+
+
+class BFGS_Hessian(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        npix, self.nits = 12, 6
+        A = rng.standard_normal((npix, npix))
+        A = A @ A.T + npix * np.eye(npix) # SPD Hessian of a quadratic problem
+        self.s = [rng.standard_normal(npix) for _ in range(self.nits)]
+        self.y = [A @ s for s in self.s]
+        self.h0 = 1. / np.diag(A)
+        self.applyH0k = lambda x, k: self.h0 * x
+        self.x = rng.standard_normal(npix)
+
+    def hessian(self, L):
+        cacher = cachers.cacher_mem()
+        H = bfgs.BFGS_Hessian(cacher, self.applyH0k, {}, {}, dot_op=lambda a, b: np.sum(a * b), L=L, verbose=False)
+        for k in range(self.nits):
+            cacher.cache('y_%s'%k, self.y[k])
+            cacher.cache('s_%s'%k, self.s[k])
+            H.add_ys('y_%s'%k, 's_%s'%k, k)
+        return H
+
+    def test_applyH(self):
+        for L in [100000, 3]:
+            H = self.hessian(L)
+            for k in range(self.nits + 1):
+                ref = applyH_recursive(self.x, k, self.s, self.y, self.applyH0k, L)
+                self.assertTrue(np.allclose(H.applyH(self.x, k), ref, rtol=1e-10, atol=0.))
+                self.assertTrue(np.allclose(H.applyH(self.x, k), H_dense(k, self.s, self.y, np.diag(self.h0), L) @ self.x, rtol=1e-10, atol=0.))
+
+    def test_get_mHkgk(self):
+        for L in [100000, 3]:
+            H = self.hessian(L)
+            for k in range(self.nits + 1):
+                ref = -H_dense(k, self.s, self.y, np.diag(self.h0), L) @ self.x
+                self.assertTrue(np.allclose(H.get_mHkgk(self.x, k), ref, rtol=1e-10, atol=0.))
+                H.get_mHkgk(self.x, k, output_fname='mHkgk')
+                self.assertTrue(np.allclose(H.cacher.load('mHkgk'), ref, rtol=1e-10, atol=0.))
+
+    def test_rho_reset(self):
+        H = self.hessian(100000)
+        H.applyH(self.x, self.nits)
+        s, y = 2. * self.s[-1], self.y[-1] + 1.
+        H.cacher.cache('y_new', y)
+        H.cacher.cache('s_new', s)
+        H.add_ys('y_new', 's_new', self.nits - 1)
+        self.assertEqual(H.rho(self.nits - 1), 1. / np.sum(s * y))
+
+
+if __name__ == '__main__':
+    unittest.main()
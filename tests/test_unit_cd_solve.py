@@ -0,0 +1,110 @@
+"""unit test: conjugate directions solvers of core.cg.cd_solve
+
+    Tests that the solves deflated with Ritz vectors recycled from previous solves reach the same solutions as the standard solver,
+    in fewer iterations, on a small SPD operator with a few isolated low eigenvalues, and that the block solver for several
+    right-hand-sides reaches the same solutions as separate solves.
+
+    E.g.,
+        python3 -m unittest test_unit_cd_solve
+
+"""
+
+
+import unittest
+
+import numpy as np
+
+from delensalot.core.cg import cd_solve, cd_monitors
+
+
+def spd_operator(n, nlow, seed=1):
+    """SPD matrix with nlow isolated low eigenvalues, and a diagonal preconditioner"""
+    rng = np.random.default_rng(seed)
+    Q = np.linalg.qr(rng.standard_normal((n, n)))[0]
+    ev = np.concatenate([np.logspace(-4, -2, nlow), np.linspace(0.5, 2., n - nlow)])
+    scal = np.exp(0.5 * rng.standard_normal(n))
+    A = scal[:, None] * ((Q * ev) @ Q.T) * scal[None, :]
+    return A, 1. / np.diag(A)
+
+
+def solve(A, b, pre, tol=1e-8, **kwargs):
+    x = np.zeros_like(b)
+    monitor = cd_monitors.monitor_basic(np.dot, iter_max=2000, eps_min=tol, logger=None)
+    niter = cd_solve.cd_solve(x, b, lambda v: A @ v, [lambda v: pre * v], np.dot, monitor, cd_solve.tr_cg, **kwargs)
+    return x, niter
+
+
+class recycler(unittest.TestCase):
+
+    def setUp(self):
+        self.A, self.pre = spd_operator(200, 6)
+        rng = np.random.default_rng(2)
+        self.bs = [rng.standard_normal(200) for _ in range(4)]
+
+    def test_recycled_solves(self):
+        rec = cd_solve.recycler(nvec=8, nkeep=16)
+        for i, b in enumerate(self.bs):
+            x_ref, niter_ref = solve(self.A, b, self.pre)
+            x, niter = solve(self.A, b, self.pre, recycler=rec)
+            self.assertTrue(np.allclose(x, np.linalg.solve(self.A, b), rtol=1e-5, atol=0.))
+            self.assertTrue(np.allclose(x, x_ref, rtol=1e-5, atol=0.))
+            if i == 0:
+                self.assertEqual(niter, niter_ref) # nothing to recycle yet
+            else:
+                self.assertLess(niter, 0.8 * niter_ref)
+            self.assertEqual(len(rec.vecs), 8)
+
+    def test_invalidate(self):
+        rec = cd_solve.recycler(nvec=8, nkeep=16)
+        solve(self.A, self.bs[0], self.pre, recycler=rec)
+        A2 = self.A + np.diag(self.pre ** -1) # new operator with the same low eigenspace, roughly
+        rec.invalidate()
+        x, niter = solve(A2, self.bs[1], self.pre, recycler=rec)
+        self.assertTrue(np.allclose(x, np.linalg.solve(A2, self.bs[1]), rtol=1e-5, atol=0.))
+        for vec, fwd in zip(rec.vecs, rec.fwds):
+            self.assertTrue(np.allclose(A2 @ vec, fwd))
+
+    def test_exclusive(self):
+        with self.assertRaises(AssertionError):
+            solve(self.A, self.bs[0], self.pre, recycler=cd_solve.recycler(nvec=8, nkeep=16), deflation=([], []))
+
+
+class block(unittest.TestCase):
+
+    def setUp(self):
+        self.A, self.pre = spd_operator(200, 6)
+        rng = np.random.default_rng(3)
+        self.bs = [rng.standard_normal(200) for _ in range(4)]
+
+    def solve_block(self, bs, tol=1e-8):
+        xs = [np.zeros_like(b) for b in bs]
+        monitor = cd_monitors.monitor_block(np.dot, iter_max=2000, eps_min=tol, logger=None,
+                                            d0s=np.array([np.dot(b, b) for b in bs]))
+        niter = cd_solve.cd_solve_block(xs, bs, lambda v: self.A @ v, lambda v: self.pre * v, np.dot, monitor)
+        return xs, niter
+
+    def test_block_vs_separate(self):
+        xs, niter = self.solve_block(self.bs)
+        niters_ref = []
+        for x, b in zip(xs, self.bs):
+            x_ref, niter_ref = solve(self.A, b, self.pre)
+            niters_ref.append(niter_ref)
+            self.assertTrue(np.allclose(x, np.linalg.solve(self.A, b), rtol=1e-5, atol=0.))
+            self.assertTrue(np.allclose(x, x_ref, rtol=1e-5, atol=0.))
+        self.assertLess(niter, 0.6 * min(niters_ref))
+
+    def test_single_rhs(self):
+        xs, niter = self.solve_block(self.bs[:1])
+        x_ref, niter_ref = solve(self.A, self.bs[0], self.pre)
+        self.assertTrue(np.allclose(xs[0], x_ref, rtol=1e-5, atol=0.))
+        self.assertLessEqual(abs(niter - niter_ref), 1)
+
+    def test_dependent_rhs(self):
+        bs = self.bs[:2] + [self.bs[0] + 2. * self.bs[1]] # rank-deficient block
+        xs, niter = self.solve_block(bs)
+        for x, b in zip(xs, bs):
+            self.assertTrue(np.allclose(x, np.linalg.solve(self.A, b), rtol=1e-5, atol=0.))
+
+
+if __name__ == '__main__':
+    unittest.main()
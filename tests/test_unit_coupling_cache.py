@@ -0,0 +1,48 @@
+"""unit test: keys of the on-disk coupling matrix cache of core.power.pospace
+
+    The key must only depend on the values defining the coupling matrix, such that all ranks and all runs share one cache file.
+
+    E.g.,
+        python3 -m unittest test_unit_coupling_cache
+
+"""
+
+
+import unittest
+import subprocess
+import sys
+
+import numpy as np
+
+from delensalot.core.power import pospace
+
+_KEY_SCRIPT = """
+import numpy as np
+from delensalot.core.power import pospace
+mask = np.linspace(0., 1., 48)
+print(pospace._coupling_hash(mask, 30, np.array([2, 10, 20, 30]), None, np.int64(60), 1.5))
+"""
+
+
+class coupling_hash(unittest.TestCase):
+
+    def key_from_process(self):
+        return subprocess.run([sys.executable, '-c', _KEY_SCRIPT], check=True, capture_output=True, text=True).stdout.strip().splitlines()[-1]
+
+    def test_same_key_across_processes(self):
+        key1, key2 = self.key_from_process(), self.key_from_process()
+        self.assertEqual(key1, key2)
+        mask = np.linspace(0., 1., 48)
+        self.assertEqual(key1, pospace._coupling_hash(mask, 30, np.array([2, 10, 20, 30]), None, np.int64(60), 1.5))
+
+    def test_key_depends_on_values(self):
+        mask = np.linspace(0., 1., 48)
+        key = pospace._coupling_hash(mask, 30, None)
+        self.assertEqual(key, pospace._coupling_hash(mask.copy(), 30, None))
+        self.assertEqual(key, pospace._coupling_hash(mask, np.int64(30), None))
+        self.assertNotEqual(key, pospace._coupling_hash(mask, 31, None))
+        self.assertNotEqual(key, pospace._coupling_hash(mask[::-1], 30, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""unit test: existence index of core.file_index
+
+    Tests that the existence checks of indexed directories are answered from the listing, that added files are seen,
+    and that paths outside the indexed directories are checked on the file system.
+
+    E.g.,
+        python3 -m unittest test_unit_file_index
+
+"""
+
+
+import unittest
+import os
+import tempfile
+import shutil
+
+from delensalot.core import file_index
+
+
+class file_index_exists(unittest.TestCase):
+
+    def setUp(self):
+        self.lib_dir = tempfile.mkdtemp()
+        self.indexed = os.path.join(self.lib_dir, 'indexed')
+        self.outside = os.path.join(self.lib_dir, 'outside')
+        for directory in [self.indexed, self.outside]:
+            os.makedirs(directory)
+        for fn in ['sim_0000.npy', 'sim_0001.npy']:
+            open(os.path.join(self.indexed, fn), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.lib_dir)
+
+    def test_exists(self):
+        index = file_index.file_index([self.indexed], collective=False)
+        self.assertTrue(index.exists(os.path.join(self.indexed, 'sim_0000.npy')))
+        self.assertTrue(index.exists(os.path.join(self.indexed, '..', 'indexed', 'sim_0001.npy')))
+        self.assertFalse(index.exists(os.path.join(self.indexed, 'sim_0002.npy')))
+
+    def test_snapshot_and_add(self):
+        index = file_index.file_index([self.indexed], collective=False)
+        fn = os.path.join(self.indexed, 'sim_0002.npy')
+        open(fn, 'w').close()
+        self.assertFalse(index.exists(fn)) # written after the listing
+        index.add(fn)
+        self.assertTrue(index.exists(fn))
+        index.add(os.path.join(self.outside, 'sim_0000.npy')) # outside the index, ignored
+        self.assertFalse(index.exists(os.path.join(self.outside, 'sim_0000.npy')))
+
+    def test_outside(self):
+        index = file_index.file_index([self.indexed], collective=False)
+        fn = os.path.join(self.outside, 'sim_0000.npy')
+        self.assertFalse(index.exists(fn))
+        open(fn, 'w').close()
+        self.assertTrue(index.exists(fn)) # checked on the file system
+
+    def test_missing_directory(self):
+        missing = os.path.join(self.lib_dir, 'missing')
+        index = file_index.file_index([missing], collective=False)
+        self.assertFalse(index.exists(os.path.join(missing, 'sim_0000.npy')))
+        os.makedirs(missing)
+        fn = os.path.join(missing, 'sim_0000.npy')
+        open(fn, 'w').close()
+        self.assertFalse(index.exists(fn)) # indexed as empty
+        index.add(fn)
+        self.assertTrue(index.exists(fn))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""unit test: random number generator states of sims.phas
+
+    Tests the bulk adds and reads of rng_db and its read-only snapshots, and that the bulk generation of the phases
+    gives the same phases as generating them one at a time.
+
+    E.g.,
+        python3 -m unittest test_unit_phas
+
+"""
+
+
+import unittest
+import os
+import tempfile
+import shutil
+
+import numpy as np
+
+from delensalot.sims import phas
+
+
+class rng_db(unittest.TestCase):
+
+    def setUp(self):
+        self.lib_dir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.lib_dir, 'rngdb.db')
+        self.states = {}
+        for idx in range(4):
+            np.random.seed(idx)
+            self.states[idx] = np.random.get_state()
+
+    def tearDown(self):
+        shutil.rmtree(self.lib_dir)
+
+    def assertStateEqual(self, state, ref):
+        self.assertEqual(state[0], ref[0])
+        self.assertTrue(np.array_equal(state[1], ref[1]))
+        self.assertEqual(list(state[2:]), list(ref[2:]))
+
+    def test_bulk_round_trip(self):
+        db = phas.rng_db(self.fname)
+        db.add_many(self.states)
+        db.add(0, self.states[1]) # already stored, left untouched
+        self.assertEqual(db.ids(), set(self.states.keys()))
+        for idx, state in self.states.items():
+            self.assertStateEqual(db.get(idx), state)
+        self.assertEqual(set(db.get_many(1, 2).keys()), {1, 2})
+        self.assertIsNone(db.get(10))
+
+    def test_snapshot(self):
+        db = phas.rng_db(self.fname)
+        db.add_many(self.states)
+        snap = phas.rng_db(self.fname, readonly=True)
+        self.assertIsNone(snap.con)
+        self.assertEqual(snap.ids(), db.ids())
+        for idx in self.states.keys():
+            self.assertStateEqual(snap.get(idx), db.get(idx))
+        self.assertEqual(set(snap.get_many(2, 10).keys()), {2, 3})
+        with self.assertRaises(AssertionError):
+            snap.add(10, self.states[0])
+        db.snapshot()
+        self.assertIsNone(db.con)
+        self.assertStateEqual(db.get(3), self.states[3])
+
+
+class lib_phas(unittest.TestCase):
+
+    def setUp(self):
+        self.lib_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.lib_dir)
+
+    def test_generate_matches_get_sim(self):
+        np.random.seed(42)
+        ref = phas.lib_phas(os.path.join(self.lib_dir, 'ref'), 2, 16)
+        sims_ref = [ref.get_sim(idx) for idx in range(3)] # one sim at a time, all fields of a sim in turn
+
+        np.random.seed(42)
+        lib = phas.lib_phas(os.path.join(self.lib_dir, 'bulk'), 2, 16)
+        lib.generate(range(3))
+        self.assertTrue(all(lib[idf].is_stored(idx) for idf in range(2) for idx in range(3)))
+        for idx in range(3):
+            self.assertTrue(np.array_equal(lib.get_sim(idx), sims_ref[idx]))
+
+    def test_snapshot(self):
+        lib = phas.pix_lib_phas(self.lib_dir, 3, (12,))
+        lib.generate([0, 1])
+        sims = [lib.get_sim(idx) for idx in [0, 1]]
+        lib.snapshot()
+        for idx in [0, 1]:
+            self.assertTrue(np.array_equal(lib.get_sim(idx), sims[idx]))
+        with self.assertRaises(AssertionError):
+            lib.get_sim(2) # not generated before the snapshot
+        ro = phas.pix_lib_phas(self.lib_dir, 3, (12,), readonly=True)
+        self.assertTrue(np.array_equal(ro.get_sim(1, idf=2), sims[1][2]))
+
+
+if __name__ == '__main__':
+    unittest.main()
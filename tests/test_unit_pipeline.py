@@ -0,0 +1,65 @@
+"""unit test: producer/consumer pipelines of core.pipeline
+
+    Tests that all items pass all stages in order, and that the first exception of a stage is re-raised once the pipeline is drained.
+
+    E.g.,
+        python3 -m unittest test_unit_pipeline
+
+"""
+
+
+import unittest
+import threading
+import time
+
+from delensalot.core import pipeline
+
+
+class run(unittest.TestCase):
+
+    def test_order(self):
+        seen = {name: [] for name in ['draw', 'lens', 'write']}
+        def func(name, delay):
+            def _func(item, data):
+                time.sleep(delay)
+                seen[name].append(item)
+                return (data or []) + [name]
+            return _func
+        out = {}
+        stages = [pipeline.stage('draw', func('draw', 0.)), pipeline.stage('lens', func('lens', 0.002)),
+                  pipeline.stage('write', lambda item, data: out.update({item: data}))]
+        pipeline.run(stages, range(10), maxsize=1)
+        for name in ['draw', 'lens']:
+            self.assertEqual(seen[name], list(range(10)))
+        self.assertEqual(out, {item: ['draw', 'lens'] for item in range(10)})
+        self.assertEqual([_stage.nitems for _stage in stages], [10, 10, 10])
+
+    def test_stages_overlap(self):
+        # the second item is drawn while the first one is still in the next stage
+        started = threading.Event()
+        def draw(item, data):
+            if item == 1:
+                self.assertTrue(started.wait(5.))
+            return item
+        def lens(item, data):
+            started.set()
+            time.sleep(0.01)
+            return data
+        pipeline.run([pipeline.stage('draw', draw), pipeline.stage('lens', lens)], range(2))
+
+    def test_error(self):
+        done = []
+        def fail(item, data):
+            if item == 3:
+                raise ValueError('stage failed on purpose')
+            return item
+        stages = [pipeline.stage('draw', lambda item, data: item), pipeline.stage('lens', fail),
+                  pipeline.stage('write', lambda item, data: done.append(item))]
+        with self.assertRaises(ValueError):
+            pipeline.run(stages, range(100), maxsize=1)
+        self.assertTrue(set(done) <= {0, 1, 2}) # items queued behind the failure may be drained
+        self.assertTrue(all(not thread.name.startswith('pipeline-') for thread in threading.enumerate()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+"""unit test: task graph and dynamic scheduling of core.scheduler
+
+    Tests the dependency handling of the task graph, and the execution order and failure propagation of the serial and pool backends.
+
+    E.g.,
+        python3 -m unittest test_unit_scheduler
+
+"""
+
+
+import unittest
+import os
+import tempfile
+import shutil
+
+from delensalot.core import scheduler
+
+
+class recording_job:
+    """Job recording the tasks it runs, failing on the tasks given"""
+    def __init__(self, fail=()):
+        self.ran = []
+        self.fail = fail
+
+    def run_task(self, task, simidx):
+        assert (task, simidx) not in self.fail, 'failing on purpose'
+        self.ran.append((task, simidx))
+
+
+class file_job:
+    """Job marking the tasks it runs with files, as the pool backend runs them in other processes"""
+    def __init__(self, lib_dir, fail=()):
+        self.lib_dir = lib_dir
+        self.fail = fail
+
+    def run_task(self, task, simidx):
+        assert (task, simidx) not in self.fail, 'failing on purpose'
+        open(os.path.join(self.lib_dir, '{}_{}'.format(task, simidx)), 'w').close()
+
+    def ran(self):
+        return sorted(os.listdir(self.lib_dir))
+
+
+def chain_graph(simidxs):
+    """calc_phi -> calc_meanfield (over all simidxs) -> calc_blt, as in the MAP jobs"""
+    graph = scheduler.task_graph()
+    phis = [graph.add(('calc_phi', simidx)) for simidx in simidxs]
+    mf = graph.add(('calc_meanfield', 0), phis)
+    for simidx in simidxs:
+        graph.add(('calc_blt', simidx), [mf, ('calc_phi', simidx)])
+    return graph
+
+
+class task_graph(unittest.TestCase):
+
+    def test_add(self):
+        graph = scheduler.task_graph()
+        graph.add(('a', 0))
+        graph.add(('b', 0), [('a', 0), ('not_in_graph', 0)])
+        self.assertEqual(graph.deps[('b', 0)], [('a', 0)])
+        self.assertEqual(len(graph), 2)
+        self.assertIn(('a', 0), graph)
+        with self.assertRaises(AssertionError):
+            graph.add(('a', 0))
+
+    def test_ready_and_select(self):
+        graph = chain_graph([0, 1])
+        self.assertEqual(graph.select('calc_blt'), [('calc_blt', 0), ('calc_blt', 1)])
+        self.assertEqual(graph.ready(set(), set()), [('calc_phi', 0), ('calc_phi', 1)])
+        done = {('calc_phi', 0), ('calc_phi', 1)}
+        self.assertEqual(graph.ready(done, done), [('calc_meanfield', 0)])
+
+    def test_skipped(self):
+        graph = chain_graph([0, 1])
+        self.assertEqual(graph.skipped([('calc_phi', 1)]), {('calc_meanfield', 0), ('calc_blt', 0), ('calc_blt', 1)})
+        self.assertEqual(graph.skipped([('calc_blt', 0)]), set())
+
+
+class run_serial(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = scheduler.backend
+        scheduler.backend = 'serial'
+
+    def tearDown(self):
+        scheduler.backend = self.backend
+
+    def test_order(self):
+        graph = chain_graph([0, 1, 2])
+        job = recording_job()
+        scheduler.run(job, graph)
+        self.assertEqual(job.ran, graph.tasks)
+
+    def test_failure(self):
+        graph = chain_graph([0, 1])
+        graph.add(('independent', 0))
+        job = recording_job(fail=[('calc_phi', 1)])
+        with self.assertRaises(AssertionError):
+            scheduler.run(job, graph)
+        self.assertEqual(job.ran, [('calc_phi', 0), ('independent', 0)])
+
+
+class run_pool(unittest.TestCase):
+
+    def setUp(self):
+        self.backend, self.nprocs = scheduler.backend, scheduler.nprocs
+        scheduler.backend, scheduler.nprocs = 'pool', 2
+        self.lib_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        scheduler.backend, scheduler.nprocs = self.backend, self.nprocs
+        shutil.rmtree(self.lib_dir)
+
+    def test_all_done(self):
+        graph = chain_graph([0, 1, 2])
+        job = file_job(self.lib_dir)
+        scheduler.run(job, graph)
+        self.assertEqual(job.ran(), sorted('{}_{}'.format(*task) for task in graph.tasks))
+
+    def test_failure(self):
+        graph = chain_graph([0, 1])
+        job = file_job(self.lib_dir, fail=[('calc_phi', 0)])
+        with self.assertRaises(AssertionError):
+            scheduler.run(job, graph)
+        self.assertEqual(job.ran(), ['calc_phi_1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+"""unit test: alm kernels of utility.utils_hp
+
+    Tests almxfl, alm2cl, alm_copy and alm_layout.dot against straightforward loops over m, for several alm layouts,
+    unstacked and stacked, with the index-map kernels of small arrays as well as with the slices per m of large arrays.
+
+    E.g.,
+        python3 -m unittest test_unit_utils_hp
+
+"""
+
+
+import unittest
+
+import numpy as np
+
+from delensalot.utility import utils_hp
+from delensalot.utility.utils_hp import Alm
+
+layouts = [(10, 10), (10, 4), (7, 0), (1, 1)] # (lmax, mmax)
+
+
+def idx(lmax, l, m):
+    return m * (2 * lmax + 1 - m) // 2 + l
+
+
+def rand_alm(lmax, mmax, rng, shape=()):
+    alm = rng.standard_normal((*shape, Alm.getsize(lmax, mmax))) + 1j * rng.standard_normal((*shape, Alm.getsize(lmax, mmax)))
+    alm[..., :lmax + 1] = alm[..., :lmax + 1].real
+    return alm
+
+
+def almxfl_loop(alm, fl, lmax, mmax):
+    ret = np.copy(alm)
+    for m in range(mmax + 1):
+        for l in range(m, lmax + 1):
+            ret[..., idx(lmax, l, m)] *= fl[l]
+    return ret
+
+
+def alm2cl_loop(alm, blm, lmax, mmax, lmaxout):
+    cl = np.zeros((*alm.shape[:-1], lmaxout + 1))
+    for l in range(min(lmax, lmaxout) + 1):
+        for m in range(min(l, mmax) + 1):
+            cross = (alm[..., idx(lmax, l, m)] * np.conj(blm[..., idx(lmax, l, m)])).real
+            cl[..., l] += cross if m == 0 else 2 * cross
+        cl[..., l] /= 2 * l + 1
+    return cl
+
+
+def alm_copy_loop(alm, lmaxin, mmaxin, lmaxout, mmaxout):
+    ret = np.zeros((*alm.shape[:-1], Alm.getsize(lmaxout, mmaxout)), dtype=alm.dtype)
+    for m in range(min(mmaxin, mmaxout) + 1):
+        for l in range(m, min(lmaxin, lmaxout) + 1):
+            ret[..., idx(lmaxout, l, m)] = alm[..., idx(lmaxin, l, m)]
+    return ret
+
+
+class kernels(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(3)
+        self.NALM_KERNEL = utils_hp.NALM_KERNEL
+
+    def tearDown(self):
+        utils_hp.NALM_KERNEL = self.NALM_KERNEL
+
+    def both_paths(self, test):
+        for NALM_KERNEL in [self.NALM_KERNEL, 0]: # index maps, slices per m
+            utils_hp.NALM_KERNEL = NALM_KERNEL
+            for lmax, mmax in layouts:
+                for shape in [(), (3,)]:
+                    with self.subTest(NALM_KERNEL=NALM_KERNEL, lmax=lmax, mmax=mmax, shape=shape):
+                        test(lmax, mmax, shape)
+
+    def test_almxfl(self):
+        def test(lmax, mmax, shape):
+            alm, fl = rand_alm(lmax, mmax, self.rng, shape), self.rng.standard_normal(lmax + 3)
+            ref = almxfl_loop(alm, fl, lmax, mmax)
+            self.assertTrue(np.allclose(utils_hp.almxfl(alm, fl, mmax, False), ref))
+            utils_hp.almxfl(alm, fl, mmax, True)
+            self.assertTrue(np.allclose(alm, ref))
+        self.both_paths(test)
+
+    def test_alm2cl(self):
+        def test(lmax, mmax, shape):
+            alm, blm = rand_alm(lmax, mmax, self.rng, shape), rand_alm(lmax, mmax, self.rng, shape)
+            for lmaxout in [lmax, lmax // 2, lmax + 3]:
+                self.assertTrue(np.allclose(utils_hp.alm2cl(alm, blm, lmax, mmax, lmaxout), alm2cl_loop(alm, blm, lmax, mmax, lmaxout)))
+                self.assertTrue(np.allclose(utils_hp.alm2cl(alm, None, lmax, mmax, lmaxout), alm2cl_loop(alm, alm, lmax, mmax, lmaxout)))
+        self.both_paths(test)
+
+    def test_alm_copy(self):
+        def test(lmax, mmax, shape):
+            alm = rand_alm(lmax, mmax, self.rng, shape)
+            for lmaxout, mmaxout in [(lmax, mmax), (lmax // 2, min(mmax, lmax // 2)), (lmax + 3, mmax), (lmax + 3, lmax + 3), (lmax, mmax // 2)]:
+                self.assertTrue(np.array_equal(utils_hp.alm_copy(alm, mmax, lmaxout, mmaxout), alm_copy_loop(alm, lmax, mmax, lmaxout, mmaxout)))
+        self.both_paths(test)
+
+    def test_dot(self):
+        for lmax, mmax in layouts:
+            alm, blm = rand_alm(lmax, mmax, self.rng), rand_alm(lmax, mmax, self.rng)
+            layout = Alm.layout(lmax, mmax)
+            cl = alm2cl_loop(alm, blm, lmax, mmax, lmax)
+            for lmin in [0, 1, lmax // 2, lmax]:
+                with self.subTest(lmax=lmax, mmax=mmax, lmin=lmin):
+                    ref = np.sum((2 * np.arange(lmin, lmax + 1) + 1) * cl[lmin:])
+                    self.assertTrue(np.isclose(layout.dot(alm, blm, lmin=lmin), ref))
+
+
+if __name__ == '__main__':
+    unittest.main()